@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Measures fragment download throughput for different worker counts against a
+local fake file server. Each request is delayed by --latency seconds to stand in
+for the round trip to S3.
+
+Run it with the package installed (e.g. ``pip install -e .``)::
+
+    python benchmarks/bench_parallel_downloads.py --files 64 --size 262144 --latency 0.05
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from canvas_data.api import CanvasDataAPI
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_handler(payload, latency):
+    class FileHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+    return FileHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=64)
+    parser.add_argument('--size', type=int, default=256 * 1024, help='bytes per file')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds of delay per request')
+    parser.add_argument('--workers', default='1,2,4,8,16')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(os.urandom(args.size), args.latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    files = [{'url': '{}/{}.gz'.format(base_url, i), 'filename': '{}.gz'.format(i)} for i in range(args.files)]
+
+    cd = CanvasDataAPI(api_key='bench', api_secret='bench')
+    total_mb = args.files * args.size / (1024.0 * 1024.0)
+    print('{:>8} {:>10} {:>10}'.format('workers', 'seconds', 'MB/s'))
+    for workers in [int(w) for w in args.workers.split(',')]:
+        download_dir = tempfile.mkdtemp()
+        try:
+            start = time.time()
+            cd.get_files(files, download_directory=download_dir, max_workers=workers)
+            elapsed = time.time() - start
+        finally:
+            shutil.rmtree(download_dir)
+        print('{:>8} {:>10.2f} {:>10.1f}'.format(workers, elapsed, total_mb / elapsed))
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Compares per-request latency and the number of new connections for one-off
+``requests.get`` calls against CanvasDataAPI's shared, pooled session, using a
+local keep-alive HTTP server. Every new connection against the real API or S3
+also costs a TLS handshake, so the connection count is the handshake count.
+
+Run it with the package installed (e.g. ``pip install -e .``)::
+
+    python benchmarks/bench_session.py --requests 500
+"""
+import argparse
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import requests
+
+from canvas_data.api import CanvasDataAPI
+
+
+class CountingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+    connections = 0
+
+    def process_request(self, request, client_address):
+        # called once per accepted connection, not once per HTTP request
+        self.connections += 1
+        return ThreadingMixIn.process_request(self, request, client_address)
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send headers and body without waiting on delayed ACKs from the client
+    disable_nagle_algorithm = True
+    body = b'{"message": "ok"}'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(server, get, url, count):
+    server.connections = 0
+    start = time.time()
+    for _ in range(count):
+        get(url).content
+    elapsed = time.time() - start
+    return elapsed * 1000.0 / count, server.connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    server = CountingHTTPServer(('127.0.0.1', 0), JSONHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/api/schema'.format(server.server_address[1])
+
+    cd = CanvasDataAPI(api_key='bench', api_secret='bench')
+    print('{:<18} {:>14} {:>12}'.format('client', 'ms/request', 'connections'))
+    for name, get in [('requests.get', requests.get), ('pooled session', cd._get_with_retries)]:
+        latency, connections = run(server, get, url, args.requests)
+        print('{:<18} {:>14.3f} {:>12}'.format(name, latency, connections))
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
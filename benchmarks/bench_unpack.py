@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Measures unpacking throughput on synthetic gzip fragments: first the old
+line-by-line copy against the block copy with several buffer sizes, then how
+CanvasDataAPI.unpack_files scales with the number of decompression processes
+(``jobs``). Use more fragments/rows for a multi-GB table.
+
+Run it with the package installed (e.g. ``pip install -e .``)::
+
+    python benchmarks/bench_unpack.py --fragments 32 --rows 200000 --jobs 1,2,4,8
+"""
+import argparse
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from canvas_data.api import CanvasDataAPI, _gzip
+
+
+def unpack_per_line(files, outfilename):
+    """The line-by-line copy that get_data_for_table used to do, as a baseline."""
+    with open(outfilename, 'wb') as outfile:
+        for infilename in files:
+            with gzip.open(infilename, 'rb') as infile:
+                for line in infile:
+                    try:
+                        outfile.write(line)
+                    except IOError:
+                        raise
+
+
+def timed(func, outfilename):
+    start = time.time()
+    func(outfilename)
+    elapsed = time.time() - start
+    os.remove(outfilename)
+    return elapsed
+
+
+def make_fragments(directory, fragments, rows):
+    """Writes `fragments` gzip files of `rows` tab-separated rows each; returns their names and unpacked size."""
+    rand = random.Random(0)
+    filenames = []
+    size = 0
+    for i in range(fragments):
+        lines = []
+        for n in range(rows):
+            lines.append('{}\t{}\t{}\t2017-05-{:02d} 12:{:02d}:00.000\t\\N\t{}\n'.format(
+                i * rows + n, rand.randint(1, 10 ** 12), rand.choice(['active', 'deleted', 'completed']),
+                rand.randint(1, 28), rand.randint(0, 59), 'x' * rand.randint(5, 60)))
+        data = ''.join(lines).encode('utf-8')
+        size += len(data)
+        filename = os.path.join(directory, 'fragment-{:05d}.gz'.format(i))
+        with gzip.open(filename, 'wb') as f:
+            f.write(data)
+        filenames.append(filename)
+    return filenames, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fragments', type=int, default=32)
+    parser.add_argument('--rows', type=int, default=200000, help='rows per fragment')
+    parser.add_argument('--jobs', default='1,2,4,8')
+    parser.add_argument('--buffer-sizes', default='65536,1048576,4194304', help='block sizes in bytes')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        files, size = make_fragments(workdir, args.fragments, args.rows)
+        total_mb = size / (1024.0 * 1024.0)
+        outfilename = os.path.join(workdir, 'table.txt')
+        print('{} fragments, {:.1f} MB unpacked, {} CPUs, gzip module: {}'.format(
+            args.fragments, total_mb, os.cpu_count(), _gzip.__name__))
+
+        print('{:<22} {:>10} {:>10}'.format('copy', 'seconds', 'MB/s'))
+        elapsed = timed(lambda out: unpack_per_line(files, out), outfilename)
+        print('{:<22} {:>10.2f} {:>10.1f}'.format('per line', elapsed, total_mb / elapsed))
+        for buffer_size in [int(b) for b in args.buffer_sizes.split(',')]:
+            cd = CanvasDataAPI(api_key='bench', api_secret='bench', unpack_buffer_size=buffer_size)
+            elapsed = timed(lambda out: cd.unpack_files(files, out), outfilename)
+            print('{:<22} {:>10.2f} {:>10.1f}'.format('blocks of {}'.format(buffer_size), elapsed, total_mb / elapsed))
+
+        cd = CanvasDataAPI(api_key='bench', api_secret='bench')
+        print('{:<22} {:>10} {:>10}'.format('jobs', 'seconds', 'MB/s'))
+        for jobs in [int(j) for j in args.jobs.split(',')]:
+            elapsed = timed(lambda out: cd.unpack_files(files, out, jobs=jobs), outfilename)
+            print('{:<22} {:>10.2f} {:>10.1f}'.format(jobs, elapsed, total_mb / elapsed))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+"""
+An offline stand-in for the Canvas Data API, for the benchmarks.
+
+`generate_dumps` writes a history of dumps with synthetic gzipped fragment files for
+the tables of a schema (by default `DEFAULT_SCHEMA`, a cut-down copy of the real one;
+pass the output of ``canvas-data get-schema`` to use the real tables), and
+`FakeCanvasDataServer` serves the dump history with the same endpoints and response
+shapes as the real API, checking the HMAC signature of every API request.
+
+Run on its own, it generates a data set and serves it until interrupted::
+
+    python benchmarks/fake_api.py --data-dir /tmp/fake-canvas-data --rows 20000 --dumps 3
+    canvas-data --api-root http://127.0.0.1:8000 --api-key bench --api-secret bench list-dumps
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+from canvas_data.hmac_auth import CanvasDataHMACAuth
+
+SCHEMA_VERSION = '5.0.0'
+CATALOGUE_FILENAME = 'catalogue.json'
+
+
+def _columns(*columns):
+    json_columns = []
+    for name, type in columns:
+        column = {'name': name, 'type': type, 'description': ''}
+        if type == 'varchar':
+            column['length'] = 256
+        json_columns.append(column)
+    return json_columns
+
+
+# a few of the real tables, with a representative mix of column types
+DEFAULT_SCHEMA = {
+    'version': SCHEMA_VERSION,
+    'schema': {
+        'account_dim': {'tableName': 'account_dim', 'columns': _columns(
+            ('id', 'bigint'), ('canvas_id', 'bigint'), ('name', 'varchar'), ('depth', 'int'),
+            ('workflow_state', 'enum'), ('parent_account', 'varchar'), ('parent_account_id', 'bigint'),
+            ('created_at', 'timestamp'), ('updated_at', 'timestamp'), ('sis_source_id', 'varchar'))},
+        'user_dim': {'tableName': 'user_dim', 'columns': _columns(
+            ('id', 'bigint'), ('canvas_id', 'bigint'), ('root_account_id', 'bigint'), ('name', 'varchar'),
+            ('time_zone', 'text'), ('created_at', 'timestamp'), ('visibility', 'enum'),
+            ('school_name', 'varchar'), ('school_position', 'varchar'), ('gender', 'varchar'),
+            ('locale', 'varchar'), ('public', 'varchar'), ('birthdate', 'timestamp'),
+            ('country_code', 'varchar'), ('workflow_state', 'enum'), ('sortable_name', 'varchar'),
+            ('global_canvas_id', 'varchar'))},
+        'course_dim': {'tableName': 'course_dim', 'columns': _columns(
+            ('id', 'bigint'), ('canvas_id', 'bigint'), ('root_account_id', 'bigint'), ('account_id', 'bigint'),
+            ('enrollment_term_id', 'bigint'), ('name', 'varchar'), ('code', 'varchar'), ('type', 'varchar'),
+            ('created_at', 'timestamp'), ('start_at', 'timestamp'), ('conclude_at', 'timestamp'),
+            ('publicly_visible', 'boolean'), ('sis_source_id', 'varchar'), ('workflow_state', 'enum'),
+            ('wiki_id', 'bigint'), ('syllabus_body', 'text'))},
+        'enrollment_dim': {'tableName': 'enrollment_dim', 'columns': _columns(
+            ('id', 'bigint'), ('canvas_id', 'bigint'), ('root_account_id', 'bigint'),
+            ('course_section_id', 'bigint'), ('role_id', 'bigint'), ('type', 'enum'),
+            ('workflow_state', 'enum'), ('created_at', 'timestamp'), ('updated_at', 'timestamp'),
+            ('start_at', 'timestamp'), ('end_at', 'timestamp'), ('completed_at', 'timestamp'),
+            ('self_enrolled', 'boolean'), ('sis_source_id', 'varchar'), ('course_id', 'bigint'),
+            ('user_id', 'bigint'), ('last_activity_at', 'timestamp'))},
+        'enrollment_fact': {'tableName': 'enrollment_fact', 'columns': _columns(
+            ('enrollment_id', 'bigint'), ('user_id', 'bigint'), ('course_id', 'bigint'),
+            ('enrollment_term_id', 'bigint'), ('course_account_id', 'bigint'), ('course_section_id', 'bigint'),
+            ('computed_final_score', 'double precision'), ('computed_current_score', 'double precision'))},
+        'submission_fact': {'tableName': 'submission_fact', 'columns': _columns(
+            ('submission_id', 'bigint'), ('assignment_id', 'bigint'), ('course_id', 'bigint'),
+            ('enrollment_term_id', 'bigint'), ('user_id', 'bigint'), ('grader_id', 'bigint'),
+            ('course_account_id', 'bigint'), ('score', 'double precision'), ('published_score', 'double precision'),
+            ('what_if_score', 'double precision'), ('submission_comments_count', 'int'),
+            ('account_id', 'bigint'), ('assignment_group_id', 'bigint'), ('quiz_id', 'bigint'),
+            ('quiz_submission_id', 'bigint'), ('wiki_id', 'bigint'))},
+        'requests': {'tableName': 'requests', 'columns': _columns(
+            ('id', 'guid'), ('timestamp', 'timestamp'), ('timestamp_year', 'varchar'),
+            ('timestamp_month', 'varchar'), ('timestamp_day', 'varchar'), ('user_id', 'bigint'),
+            ('course_id', 'bigint'), ('root_account_id', 'bigint'), ('course_account_id', 'bigint'),
+            ('quiz_id', 'bigint'), ('discussion_id', 'bigint'), ('conversation_id', 'bigint'),
+            ('assignment_id', 'bigint'), ('url', 'text'), ('user_agent', 'text'), ('http_method', 'varchar'),
+            ('remote_ip', 'varchar'), ('interaction_micros', 'bigint'), ('web_application_controller', 'varchar'),
+            ('web_application_action', 'varchar'), ('web_application_context_type', 'varchar'),
+            ('web_application_context_id', 'varchar'), ('real_user_id', 'bigint'), ('session_id', 'varchar'),
+            ('user_agent_id', 'bigint'), ('http_status', 'varchar'), ('http_version', 'varchar'),
+            ('developer_key_id', 'bigint'))},
+    },
+}
+
+WORDS = ('introduction', 'biology', 'history', 'advanced', 'seminar', 'chemistry', 'to', 'the', 'of',
+         'studies', 'section', 'lab', 'discussion', 'quiz', 'week', 'final', 'project', 'reading',
+         'assignment', 'module', 'fall', 'spring', 'economics', 'writing', 'research', 'methods')
+ENUMS = ('active', 'deleted', 'completed', 'invited', 'available', 'unpublished', 'StudentEnrollment',
+         'TeacherEnrollment')
+CONTROLLERS = ('courses', 'assignments', 'discussion_topics', 'quizzes/quizzes', 'files', 'context',
+               'users', 'submissions')
+USER_AGENTS = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0',
+               'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_6) AppleWebKit/603.3.8 (KHTML, like Gecko) Safari/603.3.8',
+               'candroid/5.3.1 (Android 7.0)', 'iCanvas/4.6.1 (iOS 10.3.3)')
+NULL_RATE = 0.05
+
+
+class RowGenerator(object):
+    """Makes plausible rows - ids that repeat across tables, words, timestamps - for one table."""
+
+    def __init__(self, table_name, columns, seed=0, start=datetime(2017, 9, 1)):
+        self.table_name = table_name
+        self.columns = columns
+        self.random = random.Random('{}/{}'.format(table_name, seed))
+        self.start = start
+
+    def rows(self, count, first_id=1):
+        for i in range(count):
+            yield '\t'.join(self._value(c, first_id + i) for c in self.columns) + '\n'
+
+    def _value(self, column, row_id):
+        name, type = column['name'], column['type']
+        rnd = self.random
+        if name == 'id':
+            return str(uuid.UUID(int=rnd.getrandbits(128))) if type == 'guid' else str(row_id)
+        if rnd.random() < NULL_RATE:
+            return '\\N'
+        if name == 'timestamp_day' or name == 'timestamp_month' or name == 'timestamp_year':
+            return self.start.strftime({'timestamp_day': '%Y-%m-%d', 'timestamp_month': '%Y-%m',
+                                        'timestamp_year': '%Y'}[name])
+        if name == 'url':
+            return 'https://canvas.example.edu/courses/{}/{}/{}'.format(
+                rnd.randint(1, 5000), rnd.choice(CONTROLLERS), rnd.randint(1, 100000))
+        if name == 'user_agent':
+            return rnd.choice(USER_AGENTS)
+        if name == 'web_application_controller':
+            return rnd.choice(CONTROLLERS)
+        if name == 'remote_ip':
+            return '10.{}.{}.{}'.format(rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(1, 254))
+        if type == 'bigint':
+            if name.endswith('_id'):
+                return str(10000000000000 + rnd.randint(1, 100000))
+            return str(rnd.randint(1, 10 ** 9))
+        if type in ('int', 'integer'):
+            return str(rnd.randint(0, 100))
+        if type == 'double precision':
+            return '{:.2f}'.format(rnd.uniform(0, 100))
+        if type == 'boolean':
+            return rnd.choice(('true', 'false'))
+        if type in ('timestamp', 'datetime'):
+            when = self.start + timedelta(seconds=rnd.randint(0, 86399), milliseconds=rnd.randint(0, 999))
+            return when.strftime('%Y-%m-%d %H:%M:%S.') + '{:03d}'.format(when.microsecond // 1000)
+        if type == 'date':
+            return (self.start + timedelta(days=rnd.randint(0, 365))).strftime('%Y-%m-%d')
+        if type == 'enum':
+            return rnd.choice(ENUMS)
+        if type == 'guid':
+            return str(uuid.UUID(int=rnd.getrandbits(128)))
+        return ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 6)))
+
+
+def generate_dumps(directory, schema=None, rows=10000, requests_rows=None, fragments=2, dumps=2, seed=0):
+    """
+    Writes `dumps` dumps of synthetic data to `directory` and returns the catalogue describing
+    them, which is also saved as `catalogue.json` so the data can be served again later.
+
+    Every dump has all of the schema's tables: each table gets `rows` rows (the `requests`
+    table `requests_rows`, by default five times as many) split over `fragments` gzipped
+    files. As with the real data, the `requests` files in every dump but the first only hold
+    that day's new rows (the dump is partial for `requests`), while the other tables are full
+    snapshots every time.
+    """
+    schema = schema or DEFAULT_SCHEMA
+    if requests_rows is None:
+        requests_rows = rows * 5
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    start = datetime(2017, 9, 1)
+    catalogue = {'schema': schema, 'dumps': []}
+    for sequence in range(1, dumps + 1):
+        day = start + timedelta(days=sequence - 1)
+        dump = {
+            'dumpId': str(uuid.UUID(int=random.Random(sequence + seed).getrandbits(128))),
+            'sequence': sequence,
+            'accountId': 'self',
+            'schemaVersion': schema['version'],
+            'createdAt': day.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'updatedAt': day.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'expires': (day + timedelta(days=60)).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'finished': True,
+            'tables': {},
+        }
+        for artifact in sorted(schema['schema']):
+            table = schema['schema'][artifact]
+            table_name = table['tableName']
+            table_rows = requests_rows if table_name == 'requests' else rows
+            generator = RowGenerator(table_name, table['columns'], seed='{}/{}'.format(seed, sequence), start=day)
+            files = []
+            per_fragment = -(-table_rows // fragments)
+            for fragment in range(fragments):
+                count = max(0, min(per_fragment, table_rows - fragment * per_fragment))
+                filename = '{}-{:05d}-{:05d}.gz'.format(table_name, sequence, fragment)
+                path = os.path.join(directory, filename)
+                with gzip.open(path, 'wt') as f:
+                    f.writelines(generator.rows(count, first_id=fragment * per_fragment + 1))
+                files.append({'filename': filename, 'rows': count, 'size': os.path.getsize(path),
+                              'md5': _md5(path)})
+            dump['tables'][table_name] = {
+                'partial': table_name == 'requests' and sequence > 1,
+                'files': files,
+            }
+        dump['numFiles'] = sum(len(t['files']) for t in dump['tables'].values())
+        catalogue['dumps'].append(dump)
+
+    with open(os.path.join(directory, CATALOGUE_FILENAME), 'w') as f:
+        json.dump(catalogue, f)
+    return catalogue
+
+
+def load_catalogue(directory):
+    with open(os.path.join(directory, CATALOGUE_FILENAME)) as f:
+        return json.load(f)
+
+
+def _md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class FakeCanvasDataServer(ThreadingMixIn, HTTPServer):
+    """
+    Serves a catalogue from `generate_dumps` over HTTP on localhost. API requests must be
+    signed with `api_key`/`api_secret`, as `CanvasDataHMACAuth` does; file downloads
+    (like the real, pre-signed file URLs) aren't checked, and support Range requests.
+    Every request is delayed by `latency` seconds. Use `url` as the client's `api_root`.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, directory, catalogue=None, api_key='bench', api_secret='bench', latency=0, port=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), _Handler)
+        self.directory = directory
+        self.catalogue = catalogue or load_catalogue(directory)
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.latency = latency
+        self.url = 'http://127.0.0.1:{}'.format(self.server_address[1])
+        self.dumps = sorted(self.catalogue['dumps'], key=lambda d: d['sequence'])
+        self.requests_served = 0
+        self._thread = None
+
+    def start(self):
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def file_entry(self, file, **extra):
+        entry = {'url': '{}/files/{}'.format(self.url, file['filename']), 'filename': file['filename']}
+        entry.update(extra)
+        return entry
+
+    def dump_summary(self, dump):
+        return dict((k, v) for k, v in dump.items() if k != 'tables')
+
+    def dump_files(self, dump):
+        result = self.dump_summary(dump)
+        result['artifactsByTable'] = dict(
+            (table_name, {'tableName': table_name, 'partial': table['partial'],
+                          'files': [self.file_entry(f) for f in table['files']]})
+            for table_name, table in dump['tables'].items())
+        return result
+
+    def table_history(self, table_name):
+        history = []
+        for dump in reversed(self.dumps):
+            table = dump['tables'].get(table_name)
+            if table:
+                history.append({'dumpId': dump['dumpId'], 'sequence': dump['sequence'], 'partial': table['partial'],
+                                'files': [self.file_entry(f) for f in table['files']]})
+        return {'table': table_name, 'history': history}
+
+    def sync_files(self):
+        files = []
+        for table_name in sorted(self.dumps[-1]['tables']):
+            history = self.table_history(table_name)['history']
+            needed = []
+            for dump in history:
+                needed.append(dump)
+                if not dump['partial']:
+                    break
+            for dump in reversed(needed):
+                files.extend(dict(f, table=table_name, partial=dump['partial']) for f in dump['files'])
+        return {'schemaVersion': self.dumps[-1]['schemaVersion'], 'incomplete': [], 'files': files}
+
+
+_ROUTES = [
+    (re.compile(r'^/api/schema$'), 'schema_versions'),
+    (re.compile(r'^/api/schema/(?P<version>[^/]+)$'), 'schema'),
+    (re.compile(r'^/api/account/self/dump$'), 'dumps'),
+    (re.compile(r'^/api/account/self/file/latest$'), 'latest'),
+    (re.compile(r'^/api/account/self/file/byDump/(?P<dump_id>[^/]+)$'), 'by_dump'),
+    (re.compile(r'^/api/account/self/file/byTable/(?P<table_name>[^/]+)$'), 'by_table'),
+    (re.compile(r'^/api/account/self/file/sync$'), 'sync'),
+]
+_RANGE_RE = re.compile(r'^bytes=(\d+)-(\d*)$')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests_served += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        parsed = urlparse(self.path)
+        if parsed.path.startswith('/files/'):
+            return self.send_file(os.path.basename(parsed.path))
+        if not self.signature_ok():
+            return self.send_json({'message': 'Invalid signature'}, status=401)
+
+        query = dict((k, v[0]) for k, v in parse_qs(parsed.query).items())
+        for pattern, route in _ROUTES:
+            match = pattern.match(parsed.path)
+            if match:
+                return getattr(self, 'route_' + route)(query, **match.groupdict())
+        self.send_json({'message': 'Not found'}, status=404)
+
+    def signature_ok(self):
+        auth = CanvasDataHMACAuth(self.server.api_key, self.server.api_secret, api_root=self.server.url)
+        auth.req_date = self.headers.get('Date', '')
+        expected = auth.get_headers(self.server.url + self.path)['Authorization']
+        return self.headers.get('Authorization') == expected
+
+    def route_schema_versions(self, query):
+        schema = self.server.catalogue['schema']
+        self.send_json([{'version': schema['version'], 'createdAt': self.server.dumps[0]['createdAt']}])
+
+    def route_schema(self, query, version):
+        schema = self.server.catalogue['schema']
+        if version not in ('latest', schema['version']):
+            return self.send_json({'message': 'No such schema version'}, status=404)
+        self.send_json(schema)
+
+    def route_dumps(self, query):
+        limit = int(query.get('limit', 50))
+        if 'after' in query:
+            dumps = [d for d in self.server.dumps if d['sequence'] > int(query['after'])][:limit]
+        else:
+            dumps = list(reversed(self.server.dumps))[:limit]
+        self.send_json([self.server.dump_summary(d) for d in dumps])
+
+    def route_latest(self, query):
+        self.send_json(self.server.dump_files(self.server.dumps[-1]))
+
+    def route_by_dump(self, query, dump_id):
+        for dump in self.server.dumps:
+            if dump['dumpId'] == dump_id:
+                return self.send_json(self.server.dump_files(dump))
+        self.send_json({'message': 'No such dump'}, status=404)
+
+    def route_by_table(self, query, table_name):
+        self.send_json(self.server.table_history(table_name))
+
+    def route_sync(self, query):
+        self.send_json(self.server.sync_files())
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_file(self, filename):
+        path = os.path.join(self.server.directory, filename)
+        if not filename.endswith('.gz') or not os.path.isfile(path):
+            return self.send_json({'message': 'Not found'}, status=404)
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = _RANGE_RE.match(self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                block = f.read(min(remaining, 1024 * 1024))
+                if not block:
+                    break
+                self.wfile.write(block)
+                remaining -= len(block)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-dir', required=True, help='where to put (or find) the generated dumps')
+    parser.add_argument('--schema', help="a JSON schema, as printed by 'canvas-data get-schema'")
+    parser.add_argument('--rows', type=int, default=10000, help='rows per table in each dump')
+    parser.add_argument('--fragments', type=int, default=2, help='files per table in each dump')
+    parser.add_argument('--dumps', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0, help='seconds of delay per request')
+    parser.add_argument('--api-key', default='bench')
+    parser.add_argument('--api-secret', default='bench')
+    args = parser.parse_args()
+
+    if os.path.isfile(os.path.join(args.data_dir, CATALOGUE_FILENAME)):
+        catalogue = load_catalogue(args.data_dir)
+    else:
+        schema = None
+        if args.schema:
+            with open(args.schema) as f:
+                schema = {'version': SCHEMA_VERSION, 'schema': json.load(f)}
+        catalogue = generate_dumps(args.data_dir, schema=schema, rows=args.rows, fragments=args.fragments,
+                                   dumps=args.dumps)
+
+    server = FakeCanvasDataServer(args.data_dir, catalogue, api_key=args.api_key, api_secret=args.api_secret,
+                                  latency=args.latency, port=args.port)
+    print('Serving {} dumps at {}'.format(len(catalogue['dumps']), server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+Runs the SDK's download and unpack paths, and the CLI commands built on them, against
+a local fake Canvas Data API (see fake_api.py) and reports MB/s and rows/s for each.
+
+Every benchmark starts from empty download and data directories, so the ones that
+unpack include the time it takes to download. Download throughput is measured in
+compressed bytes; unpacking in uncompressed bytes. The synthetic data is
+generated once per run unless --data-dir points at a directory with data from an earlier
+run (or from fake_api.py).
+
+Run it with the package installed (e.g. ``pip install -e .``)::
+
+    python benchmarks/run_benchmarks.py --rows 50000 --fragments 4 --latency 0.02 --workers 4
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from click.testing import CliRunner
+
+from canvas_data.api import CanvasDataAPI
+from canvas_data.scripts.canvasdata import cli
+
+from fake_api import CATALOGUE_FILENAME, FakeCanvasDataServer, generate_dumps, load_catalogue
+
+
+class BenchmarkRunner(object):
+    def __init__(self, server, workers=1, jobs=1, repeat=1):
+        self.server = server
+        self.workers = workers
+        self.jobs = jobs
+        self.repeat = repeat
+        self.latest = server.dumps[-1]
+        self.results = []
+
+    def api(self):
+        return CanvasDataAPI(api_key=self.server.api_key, api_secret=self.server.api_secret,
+                             api_root=self.server.url, pool_maxsize=max(10, self.workers))
+
+    def run(self, name, func, rows=None):
+        """Run `func(download_dir, data_dir)` `repeat` times, keeping the fastest; it returns the bytes it handled."""
+        best = None
+        for _ in range(self.repeat):
+            workdir = tempfile.mkdtemp(prefix='canvas-data-bench-')
+            try:
+                download_dir = os.path.join(workdir, 'downloads')
+                data_dir = os.path.join(workdir, 'data')
+                start = time.time()
+                size = func(download_dir, data_dir)
+                elapsed = time.time() - start
+            finally:
+                shutil.rmtree(workdir)
+            if best is None or elapsed < best[0]:
+                best = (elapsed, size)
+        elapsed, size = best
+        self.results.append((name, elapsed, size / elapsed / 1e6 if size else None,
+                             rows / elapsed if rows else None))
+
+    def table_rows(self, table_name, dump=None):
+        return sum(f['rows'] for f in (dump or self.latest)['tables'][table_name]['files'])
+
+    def dump_rows(self, include_requests=True):
+        return sum(self.table_rows(t) for t in self.latest['tables'] if include_requests or t != 'requests')
+
+    def dump_bytes(self, include_requests=True):
+        return sum(f['size'] for t, table in self.latest['tables'].items() if include_requests or t != 'requests'
+                   for f in table['files'])
+
+    def report(self):
+        print('{:<45} {:>9} {:>10} {:>12}'.format('benchmark', 'seconds', 'MB/s', 'rows/s'))
+        for name, elapsed, mb_per_second, rows_per_second in self.results:
+            print('{:<45} {:>9.3f} {:>10} {:>12}'.format(
+                name, elapsed,
+                '{:.2f}'.format(mb_per_second) if mb_per_second is not None else '-',
+                '{:.0f}'.format(rows_per_second) if rows_per_second is not None else '-'))
+
+
+def _output_size(paths):
+    if isinstance(paths, str):
+        paths = [paths]
+    return sum(os.path.getsize(p) for p in paths)
+
+
+def _invoke(runner, args):
+    result = runner.invoke(cli, args, catch_exceptions=False)
+    if result.exit_code != 0:
+        raise RuntimeError('canvas-data {} failed:\n{}'.format(' '.join(args), result.output))
+
+
+def run_benchmarks(bench):
+    server = bench.server
+    dump_id = bench.latest['dumpId']
+    tables = sorted(t for t in bench.latest['tables'] if t != 'requests')
+    biggest = max(tables, key=bench.table_rows)
+
+    bench.run('download_files (dump, {} workers)'.format(bench.workers),
+              lambda dl, data: _output_size(bench.api().download_files(
+                  dump_id=dump_id, download_directory=dl, max_workers=bench.workers)),
+              rows=bench.dump_rows())
+
+    def get_data_for_table(table_name):
+        return lambda dl, data: _output_size(bench.api().get_data_for_table(
+            table_name, dump_id=dump_id, download_directory=dl, data_directory=data, jobs=bench.jobs))
+
+    for table_name in (biggest, 'requests'):
+        if table_name not in bench.latest['tables']:
+            continue
+        bench.run('get_data_for_table ({}, {} jobs)'.format(table_name, bench.jobs), get_data_for_table(table_name),
+                  rows=bench.table_rows(table_name))
+
+    bench.run('get_data_for_dump ({} jobs)'.format(bench.jobs),
+              lambda dl, data: _output_size(bench.api().get_data_for_dump(
+                  dump_id=dump_id, download_directory=dl, data_directory=data, include_requests=True,
+                  jobs=bench.jobs)),
+              rows=bench.dump_rows())
+
+    runner = CliRunner()
+    base_args = ['--api-root', server.url, '--api-key', server.api_key, '--api-secret', server.api_secret]
+
+    bench.run('cli get-dump-files (--parallel {})'.format(bench.workers),
+              lambda dl, data: _invoke(runner, base_args + ['get-dump-files', '--download-dir', dl,
+                                                            '--parallel', str(bench.workers)])
+              or bench.dump_bytes(include_requests=False),
+              rows=bench.dump_rows(include_requests=False))
+
+    def unpack_dump_files(dl, data):
+        _invoke(runner, base_args + ['unpack-dump-files', '--download-dir', dl, '--data-dir', data,
+                                     '--parallel', str(bench.workers), '--jobs', str(bench.jobs)])
+        return _output_size(os.path.join(root, f) for root, dirs, files in os.walk(data)
+                            for f in files if f.endswith('.txt'))
+    bench.run('cli unpack-dump-files (--jobs {})'.format(bench.jobs), unpack_dump_files,
+              rows=bench.dump_rows(include_requests=False))
+
+    def sync(dl, data):
+        _invoke(runner, base_args + ['sync', '--include-requests', '--download-dir', dl,
+                                     '--parallel', str(bench.workers)])
+        return _output_size(os.path.join(dl, f) for f in os.listdir(dl) if f.endswith('.gz'))
+    bench.run('cli sync (--parallel {})'.format(bench.workers), sync)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-dir', help='keep the generated dumps here (default: a temporary directory)')
+    parser.add_argument('--rows', type=int, default=20000, help='rows per table in each dump')
+    parser.add_argument('--fragments', type=int, default=4, help='files per table in each dump')
+    parser.add_argument('--dumps', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds of delay per request')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent downloads')
+    parser.add_argument('--jobs', type=int, default=1, help='processes to decompress with')
+    parser.add_argument('--repeat', type=int, default=1, help='run each benchmark this many times and keep the best')
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='canvas-data-fake-')
+    try:
+        if os.path.isfile(os.path.join(data_dir, CATALOGUE_FILENAME)):
+            catalogue = load_catalogue(data_dir)
+        else:
+            start = time.time()
+            catalogue = generate_dumps(data_dir, rows=args.rows, fragments=args.fragments, dumps=args.dumps)
+            print('Generated {} dumps in {:.1f}s'.format(len(catalogue['dumps']), time.time() - start))
+
+        server = FakeCanvasDataServer(data_dir, catalogue, latency=args.latency).start()
+        try:
+            bench = BenchmarkRunner(server, workers=args.workers, jobs=args.jobs, repeat=args.repeat)
+            run_benchmarks(bench)
+            bench.report()
+            print('{} requests served'.format(server.requests_served))
+        finally:
+            server.stop()
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,38 +1,79 @@
+import email.utils
 import gzip
+import hashlib
+import io
 import logging
 import os
+import random
+import re
+import shutil
+import threading
 import time
+import zlib
+from collections import deque
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+from datetime import datetime
+
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, RequestException
 
+from .cache import FileCache
+from .compat import replace as _replace
+from .export import export_fragments
 from .exceptions import (APIConnectionError, CanvasDataAPIError,
-                         MissingCredentialsError)
+                         DownloadVerificationError, MissingCredentialsError)
 from .hmac_auth import API_ROOT, CanvasDataHMACAuth
+from .manifest import DownloadManifest
+from .metrics import Metrics
+from .pipeline import Pipeline
+from .ratelimit import TokenBucket
+from .storage import LocalStorage, Storage
+from .requests_pipeline import RequestsPartitioner
+
+try:
+    # python-isal's gzip module is a drop-in replacement that decompresses several times faster
+    from isal import igzip as _gzip
+except ImportError:
+    _gzip = gzip
 
 logger = logging.getLogger(__name__)
 
 
+# responses that are handed back to the caller instead of being retried; 206 and 416 are the
+# answers to a Range request for a partly or completely downloaded file
+_NO_RETRY_STATUS_CODES = (200, 206, 416)
+
+
 def retry(func):
-    """File download retry decorator"""
-    def retried_func(*args, **kwargs):
-        MAX_TRIES = 3
+    """
+    Request retry decorator for CanvasDataAPI methods. The number of retries and the
+    delay between them come from the instance's `max_retries`, `retry_delay`,
+    `retry_backoff` and `max_retry_delay` settings (see `_retry_wait`).
+    """
+    def retried_func(self, *args, **kwargs):
         tries = 0
         while True:
             try:
-                resp = func(*args, **kwargs)
+                resp = func(self, *args, **kwargs)
                 logger.debug(resp.request.headers)
-                if resp.status_code != 200 and tries < MAX_TRIES:
+                if resp.status_code not in _NO_RETRY_STATUS_CODES and tries < self.max_retries:
                     logger.warning("Got a non-200 response ({}) - going to retry.".format(resp.status_code))
+                    # release the connection back to the pool before trying again
+                    resp.close()
+                    self.metrics.increment('request.retries')
+                    time.sleep(_retry_wait(self, tries, resp.headers))
                     tries += 1
-                    time.sleep(2)
                     continue
 
             except ConnectionError as e:
                 resp = None
-                if tries < MAX_TRIES:
+                if tries < self.max_retries:
+                    logger.exception("ConnectionError - %d/%d tries", tries + 1, self.max_retries)
+                    self.metrics.increment('request.retries')
+                    time.sleep(_retry_wait(self, tries))
                     tries += 1
-                    logger.exception("ConnectionError - %d/%d tries", tries, MAX_TRIES)
-                    time.sleep(2)
                     continue
                 else:
                     logger.exception("ConnectionError - reached the retry limit")
@@ -43,36 +84,475 @@ def retry(func):
     return retried_func
 
 
-@retry
-def _get_with_retries(*args, **kwargs):
-    return requests.get(*args, **kwargs)
+def _retry_wait(client, tries, headers=None):
+    """
+    How long to wait before retrying a request that has already been retried `tries` times.
+    If the server sent a Retry-After header (as it does with 429 and 503 responses), that's
+    what we wait, up to `max_retry_delay`. Otherwise the delay grows exponentially -
+    `retry_delay` times `retry_backoff` to the power of `tries`, capped at `max_retry_delay` -
+    and a random amount of up to half of it is taken off, so that parallel clients don't
+    retry in lockstep.
+    """
+    retry_after = (headers or {}).get('Retry-After')
+    if retry_after:
+        try:
+            return min(max(0, float(retry_after)), client.max_retry_delay)
+        except ValueError:
+            try:
+                retry_at = email.utils.parsedate_to_datetime(retry_after)
+                return min(max(0, (retry_at - datetime.now(retry_at.tzinfo)).total_seconds()), client.max_retry_delay)
+            except (TypeError, ValueError):
+                pass
+    delay = min(client.retry_delay * (client.retry_backoff ** tries), client.max_retry_delay)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _makedirs(directory):
+    """Create a directory if it doesn't exist yet; safe to call from several threads at once."""
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+
+def _files_from_file_urls(file_urls, table_name=None, include_requests=True):
+    """
+    Returns the list of files in a `get_file_urls` response: either every file in a dump
+    (optionally limited to one table) or every file in a table's history. Each file is
+    annotated with the `table`, `dumpId`, `sequence` and `partial` flag it belongs to.
+    """
+    files = []
+    if 'artifactsByTable' in file_urls:
+        for dump_table_name, artifacts in file_urls['artifactsByTable'].items():
+            if table_name and table_name != dump_table_name:
+                continue
+            if dump_table_name == 'requests' and not include_requests:
+                continue
+            files.extend(_annotate_files(artifacts['files'], table=dump_table_name, dumpId=file_urls.get('dumpId'),
+                                         sequence=file_urls.get('sequence'), partial=artifacts.get('partial')))
+    else:
+        for dump in file_urls['history']:
+            files.extend(_annotate_files(dump['files'], table=file_urls.get('table', table_name), dumpId=dump.get('dumpId'),
+                                         sequence=dump.get('sequence'), partial=dump.get('partial')))
+    return files
+
+
+def _annotate_files(files, **info):
+    """Returns copies of the file dicts with the extra keys added (without overriding existing ones)."""
+    annotated = []
+    for file in files:
+        file = dict(file)
+        for k, v in info.items():
+            file.setdefault(k, v)
+        annotated.append(file)
+    return annotated
+
+
+def _is_annotated(entry):
+    """Whether a manifest entry knows which dump and table its file belongs to."""
+    return entry['dump_id'] is not None and entry['table_name'] is not None and entry['sequence'] is not None
+
+
+def _as_storage(directory):
+    """A download or data directory as a `Storage`: either it already is one, or it's a local path."""
+    return directory if isinstance(directory, Storage) else LocalStorage(directory)
+
+
+def _local_directory(directory):
+    """The path of a local download or data directory, or None if it's some other kind of `Storage`."""
+    if isinstance(directory, LocalStorage):
+        return directory.directory
+    if isinstance(directory, Storage):
+        return None
+    return directory
+
+
+def _expected_md5(file, headers):
+    """The MD5 a download should have: from the file metadata if it's there, or else a plain-MD5 ETag."""
+    if file.get('md5'):
+        return file['md5']
+    etag = headers.get('ETag', '').strip('"').lower()
+    return etag if _MD5_RE.match(etag) else None
+
+
+_CONTENT_RANGE_RE = re.compile(r'bytes (?:(\d+)-\d+|\*)/(\d+)')
+_MD5_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _iter_gzip_rows(fileobj):
+    """Yields the tab-separated rows of a gzipped Canvas Data file as lists, with `\\N` values as None."""
+    with io.TextIOWrapper(_gzip.GzipFile(fileobj=fileobj, mode='rb'), encoding='utf-8', newline='\n') as lines:
+        for line in lines:
+            yield [None if value == '\\N' else value for value in line.rstrip('\n').split('\t')]
+
+
+def _unpack_fragment(infilename, outfile, table_name, outfilename, buffer_size=1024*1024):
+    """Decompress one gzipped fragment file and append its data to an open output file, one block at a time."""
+    try:
+        with _gzip.open(infilename, 'rb') as infile:
+            shutil.copyfileobj(infile, outfile, buffer_size)
+    except (IOError, OSError, EOFError, zlib.error) as e:
+        msg = 'Error preparing data for table {}. Input file: {}  Output file: {}  ({})'.format(table_name, infilename, outfilename, e)
+        raise CanvasDataAPIError(msg)
+
+
+def _unpack_fragment_file(infilename, outfilename, table_name, buffer_size=1024*1024):
+    """
+    Decompress one gzipped fragment file into its own output file. This is what runs in the
+    worker processes when unpacking with more than one job; it's written to `<outfilename>.part`
+    first so that an interrupted run never leaves a truncated file behind.
+    """
+    partfilename = outfilename + '.part'
+    try:
+        with open(partfilename, 'wb') as outfile:
+            _unpack_fragment(infilename, outfile, table_name, outfilename, buffer_size)
+    except Exception:
+        if os.path.isfile(partfilename):
+            os.remove(partfilename)
+        raise
+    _replace(partfilename, outfilename)
+    return outfilename
+
+
+class _GzipValidator(object):
+    """
+    Decompresses a gzip stream as it arrives, to count its rows (lines) and to catch corrupt
+    or truncated data without reading the file again. The decompressed data is thrown away.
+    Files made of several concatenated gzip members are handled.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.rows = 0
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def feed(self, chunk):
+        try:
+            while chunk:
+                self.rows += self._decompressor.decompress(chunk).count(b'\n')
+                chunk = self._decompressor.unused_data
+                if chunk:
+                    # the start of another gzip member
+                    self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        except zlib.error as e:
+            raise DownloadVerificationError('{} is not valid gzip data: {}'.format(self.filename, e))
+
+    def finish(self):
+        if not self._decompressor.eof:
+            raise DownloadVerificationError('{} is a truncated gzip file'.format(self.filename))
+
+
+class _PartialDownload(object):
+    """
+    Tracks the download of a file into `<target>.part`, so that an interrupted download can be
+    resumed with a Range request and a finished one can be verified before it's renamed into place.
+    The expected size and MD5 come from the file metadata returned by the API (`size`/`md5`) when
+    present, and otherwise from the response's Content-Range/Content-Length and (plain MD5) ETag.
+    The MD5 of every download is computed, so that it can be recorded in the manifest.
+    With `validate`, the data is also decompressed as it's written (see `_GzipValidator`), so
+    that a corrupt file fails as soon as the bad data arrives, and `rows` is set when it's done.
+    """
+
+    def __init__(self, file, target_file, restart=False, validate=False):
+        self.file = file
+        self.target_file = target_file
+        self.part_file = target_file + '.part'
+        if restart and os.path.isfile(self.part_file):
+            os.remove(self.part_file)
+        self.fd = None
+        self.validate = validate
+        self.validator = None
+        self.rows = None
+
+    def request_headers(self):
+        """Headers for the next request: a Range request if part of the file is already here."""
+        self.offset = os.path.getsize(self.part_file) if os.path.isfile(self.part_file) else 0
+        if self.offset:
+            return {'Range': 'bytes={}-'.format(self.offset)}
+        return {}
+
+    def start(self, status, headers):
+        """
+        Prepare to receive the body of a response. Returns False if there's nothing left to
+        receive because the .part file was already complete.
+        """
+        content_range = _CONTENT_RANGE_RE.match(headers.get('Content-Range', ''))
+        if status == 206 and content_range and int(content_range.group(1) or -1) == self.offset:
+            mode = 'ab'
+            self.expected_size = int(content_range.group(2))
+        elif status == 200:
+            mode = 'wb'
+            self.offset = 0
+            content_length = headers.get('Content-Length')
+            self.expected_size = int(content_length) if content_length else None
+        elif status == 416 and content_range and int(content_range.group(2)) == self.offset:
+            # the server says the range starts at the end of the file - we already have all of it
+            mode = None
+            self.expected_size = self.offset
+        elif status in (206, 416):
+            # the range we got back doesn't match what's on disk; start over
+            os.remove(self.part_file)
+            raise DownloadVerificationError('Unexpected range response for {}: {} {}'.format(
+                self.part_file, status, headers.get('Content-Range')))
+        else:
+            raise CanvasDataAPIError('Unable to download {} (HTTP {})'.format(self.file['filename'], status))
+
+        if self.file.get('size') is not None:
+            self.expected_size = int(self.file['size'])
+        self.expected_md5 = _expected_md5(self.file, headers)
+
+        self.md5 = hashlib.md5()
+        self.validator = _GzipValidator(self.part_file) if self.validate else None
+        if self.offset:
+            # the bytes we already have need to be part of the checksum (and validation) too
+            with open(self.part_file, 'rb') as f:
+                for block in iter(lambda: f.read(1024*1024), b''):
+                    self._check(block)
+
+        if mode:
+            self.fd = open(self.part_file, mode)
+        return mode is not None
+
+    def write(self, chunk):
+        self._check(chunk)
+        self.fd.write(chunk)
+
+    def _check(self, chunk):
+        self.md5.update(chunk)
+        if self.validator:
+            try:
+                self.validator.feed(chunk)
+            except DownloadVerificationError:
+                # the data on disk can't be trusted, so the next try has to start from scratch
+                self.close()
+                os.remove(self.part_file)
+                raise
+
+    def close(self):
+        if self.fd:
+            self.fd.close()
+            self.fd = None
+
+    def finish(self):
+        """Verify the .part file and atomically rename it to the target filename."""
+        self.close()
+        size = os.path.getsize(self.part_file)
+        if self.expected_size is not None and size != self.expected_size:
+            if size > self.expected_size:
+                os.remove(self.part_file)
+            raise DownloadVerificationError('{} is {} bytes; expected {}'.format(self.part_file, size, self.expected_size))
+        if self.expected_md5 and self.md5.hexdigest() != self.expected_md5:
+            os.remove(self.part_file)
+            raise DownloadVerificationError('{} has MD5 {}; expected {}'.format(self.part_file, self.md5.hexdigest(), self.expected_md5))
+        if self.validator:
+            try:
+                self.validator.finish()
+            except DownloadVerificationError:
+                os.remove(self.part_file)
+                raise
+            self.rows = self.validator.rows
+        _replace(self.part_file, self.target_file)
+        self.size = size
+
+
+class _StorageDownload(object):
+    """
+    Streams a download straight into a `Storage` other than a local directory. There's no
+    resuming: a failed download is aborted and the next try starts from the beginning. The
+    size, MD5 and (with `validate`) gzip data are checked as for `_PartialDownload` before
+    the file is committed to the storage.
+    """
+
+    def __init__(self, file, storage, validate=False):
+        self.file = file
+        self.storage = storage
+        self.name = file['filename']
+        self.validate = validate
+        self.writer = None
+        self.rows = None
+
+    def request_headers(self):
+        return {}
+
+    def start(self, status, headers):
+        if status != 200:
+            raise CanvasDataAPIError('Unable to download {} (HTTP {})'.format(self.name, status))
+        content_length = headers.get('Content-Length')
+        self.expected_size = int(content_length) if content_length else None
+        if self.file.get('size') is not None:
+            self.expected_size = int(self.file['size'])
+        self.expected_md5 = _expected_md5(self.file, headers)
+        self.md5 = hashlib.md5()
+        self.size = 0
+        self.validator = _GzipValidator(self.storage.location(self.name)) if self.validate else None
+        self.writer = self.storage.open_write(self.name)
+        return True
+
+    def write(self, chunk):
+        self.md5.update(chunk)
+        self.size += len(chunk)
+        if self.validator:
+            self.validator.feed(chunk)
+        self.writer.write(chunk)
+
+    def close(self):
+        """Throw away whatever was written, unless the download was committed."""
+        if self.writer:
+            self.writer.abort()
+            self.writer = None
+
+    def finish(self):
+        location = self.storage.location(self.name)
+        if self.expected_size is not None and self.size != self.expected_size:
+            raise DownloadVerificationError('{} is {} bytes; expected {}'.format(location, self.size, self.expected_size))
+        if self.expected_md5 and self.md5.hexdigest() != self.expected_md5:
+            raise DownloadVerificationError('{} has MD5 {}; expected {}'.format(location, self.md5.hexdigest(), self.expected_md5))
+        if self.validator:
+            self.validator.finish()
+            self.rows = self.validator.rows
+        self.writer.commit()
+        self.writer = None
 
 
 class CanvasDataAPI(object):
 
-    def __init__(self, api_key, api_secret, download_chunk_size=1024*1024):
+    def __init__(self, api_key, api_secret, download_chunk_size=1024*1024, download_retries=3,
+                 session=None, pool_connections=10, pool_maxsize=10,
+                 max_retries=3, retry_delay=1, retry_backoff=2, max_retry_delay=60, use_manifest=True,
+                 unpack_buffer_size=1024*1024, cache_dir=None, cache_ttl=300, cache_max_size=64*1024*1024,
+                 max_requests_per_second=None, max_bytes_per_second=None, metrics=None, api_root=API_ROOT,
+                 validate_downloads=False):
+        """
+        All API and file requests share one `requests.Session`, so connections (and their
+        TLS handshakes) are reused. Pass your own `session` to control the transport
+        completely; otherwise one is created that keeps up to `pool_maxsize` connections
+        open to each of up to `pool_connections` hosts. When downloading with
+        `max_workers`, keep `pool_maxsize` at least as large as the number of workers.
+
+        Unless `use_manifest` is False, each download directory gets a `DownloadManifest`
+        recording which dump, table and sequence each downloaded file belongs to.
+
+        With `validate_downloads`, every file is decompressed as it downloads, so a corrupt or
+        truncated fragment is caught (and downloaded again) straight away rather than when
+        it's unpacked, and its row count is recorded in the manifest.
+
+        Fragments are decompressed in blocks of `unpack_buffer_size` bytes. If python-isal
+        is installed (``pip install canvas-data-sdk[fast]``), its faster gzip implementation is used.
+
+        Set `cache_dir` to keep API responses in an on-disk `FileCache` that other processes can
+        share (up to `cache_max_size` bytes). Numbered schema versions are cached forever; the
+        latest schema, the schema version list, dump lists and file lists expire after
+        `cache_ttl` seconds. Entries are kept apart per `api_root` and API key, so clients for
+        different accounts or servers can share one cache directory.
+
+        Failed requests are retried up to `max_retries` times with exponential backoff and
+        jitter, honoring any Retry-After header (up to `max_retry_delay`). To throttle the
+        client, set `max_requests_per_second` (for all requests, API and file) and/or
+        `max_bytes_per_second` (for file downloads); the limits are shared by all the
+        threads using this instance. You can also assign `TokenBucket` objects to
+        `request_limiter` and `bandwidth_limiter` to share limits between instances.
+
+        Request latencies, retries, download and decompression sizes and times are reported
+        to `metrics`, a `canvas_data.metrics.Metrics` (for instance a `MetricsCollector` or
+        `StatsdMetrics`); by default they're discarded.
+
+        `api_root` is only worth changing to point the client at a stand-in server, such as
+        the one the benchmarks use.
+        """
         if not api_key or not api_secret:
             raise MissingCredentialsError(self)
 
         self.api_key = api_key
         self.api_secret = api_secret
+        self.api_root = api_root
 
         self.schema = {}
         self.schema_versions = None
 
         self.download_chunk_size = download_chunk_size
+        self.download_retries = download_retries
+        self.validate_downloads = validate_downloads
+        self.unpack_buffer_size = unpack_buffer_size
+
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.retry_backoff = retry_backoff
+        self.max_retry_delay = max_retry_delay
+
+        self.request_limiter = TokenBucket(max_requests_per_second) if max_requests_per_second else None
+        self.bandwidth_limiter = TokenBucket(max_bytes_per_second) if max_bytes_per_second else None
+
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        self.session = session
+
+        self.cache = FileCache(cache_dir, max_size=cache_max_size) if cache_dir else None
+        self.cache_ttl = cache_ttl
+
+        self.use_manifest = use_manifest
+        self._manifests = {}
+        self._manifests_lock = threading.Lock()
+
+    @retry
+    def _get_with_retries(self, *args, **kwargs):
+        if self.request_limiter:
+            self.request_limiter.consume()
+        # only the API calls are signed; the file URLs carry their own signature
+        with self.metrics.timer('request.latency', {'kind': 'api' if kwargs.get('auth') else 'file'}):
+            return self.session.get(*args, **kwargs)
+
+    def _cache_key(self, key):
+        """Scope a cache key to this API server and account, so clients sharing a cache never see each other's entries."""
+        scope = hashlib.sha1('{}\n{}'.format(self.api_root, self.api_key).encode('utf-8')).hexdigest()
+        return '{}/{}'.format(scope, key)
+
+    def _cache_get(self, key, ttl):
+        if self.cache is None:
+            return None
+        return self.cache.get(self._cache_key(key), ttl=ttl)
+
+    def _cache_set(self, key, value):
+        if self.cache is not None:
+            self.cache.set(self._cache_key(key), value)
+
+    def get_manifest(self, download_directory='./downloads'):
+        """
+        Returns the `DownloadManifest` for a download directory, or None if manifests are turned
+        off or the directory is a `Storage` other than a local directory.
+        """
+        download_directory = _local_directory(download_directory)
+        if not self.use_manifest or download_directory is None:
+            return None
+        key = os.path.abspath(download_directory)
+        with self._manifests_lock:
+            if key not in self._manifests:
+                _makedirs(download_directory)
+                self._manifests[key] = DownloadManifest.for_directory(download_directory)
+            return self._manifests[key]
 
     def get_schema_versions(self):
         """Get the list of all available schema versions."""
-        url = '{}/api/schema'.format(API_ROOT)
+        url = '{}/api/schema'.format(self.api_root)
         if self.schema_versions:
             return self.schema_versions
+        cached = self._cache_get('schema_versions', self.cache_ttl)
+        if cached is not None:
+            self.schema_versions = cached
+            return cached
         else:
             try:
-                response = _get_with_retries(url, auth=CanvasDataHMACAuth(self.api_key, self.api_secret))
+                response = self._get_with_retries(url, auth=CanvasDataHMACAuth(self.api_key, self.api_secret, api_root=self.api_root))
                 if response.status_code == 200:
                     schema_versions = response.json()
                     self.schema_versions = schema_versions
+                    self._cache_set('schema_versions', schema_versions)
                     return schema_versions
                 else:
                     response_data = response.json()
@@ -89,46 +569,60 @@ class CanvasDataAPI(object):
         the same as the table names. If you'd rather have the keys in the returned data
         structure always exactly match the table names, set `key_on_tablenames=True`
         """
-        url = '{}/api/schema/{}'.format(API_ROOT, version)
         cache_key = '{}/{}'.format(version, key_on_tablenames)
         if cache_key in self.schema:
             return self.schema[cache_key]
-        else:
-            try:
-                response = _get_with_retries(url, auth=CanvasDataHMACAuth(self.api_key, self.api_secret))
-                if response.status_code == 200:
-                    schema = response.json()
-                    if key_on_tablenames:
-                        fixed_schema = {}
-                        for k, v in schema['schema'].items():
-                            fixed_schema[v['tableName']] = v
-                        self.schema[cache_key] = fixed_schema
-                        return fixed_schema
 
-                    self.schema[cache_key] = schema['schema']
-                    return schema['schema']
+        # a numbered schema version never changes, so it can be cached forever
+        disk_cache_key = 'schema/{}'.format(version)
+        schema = self._cache_get(disk_cache_key, self.cache_ttl if version == 'latest' else None)
+        if schema is None:
+            schema = self._fetch_schema(version)
+            self._cache_set(disk_cache_key, schema)
 
-                else:
-                    response_data = response.json()
-                    raise CanvasDataAPIError(response_data['message'])
-            except ConnectionError as e:
-                raise APIConnectionError("A connection error occurred", e)
-            except RequestException as e:
-                raise CanvasDataAPIError("A generic requests error occurred", e)
+        if key_on_tablenames:
+            fixed_schema = {}
+            for k, v in schema['schema'].items():
+                fixed_schema[v['tableName']] = v
+            self.schema[cache_key] = fixed_schema
+            return fixed_schema
+
+        self.schema[cache_key] = schema['schema']
+        return schema['schema']
+
+    def _fetch_schema(self, version):
+        url = '{}/api/schema/{}'.format(self.api_root, version)
+        try:
+            response = self._get_with_retries(url, auth=CanvasDataHMACAuth(self.api_key, self.api_secret, api_root=self.api_root))
+            if response.status_code == 200:
+                return response.json()
+            else:
+                response_data = response.json()
+                raise CanvasDataAPIError(response_data['message'])
+        except ConnectionError as e:
+            raise APIConnectionError("A connection error occurred", e)
+        except RequestException as e:
+            raise CanvasDataAPIError("A generic requests error occurred", e)
 
     def get_dumps(self, account_id='self', limit=100, after_sequence=None):
         """Get a list of all dumps"""
-        url = '{}/api/account/{}/dump'.format(API_ROOT, account_id)
+        url = '{}/api/account/{}/dump'.format(self.api_root, account_id)
         try:
             params = {
                 'limit': limit,
             }
-            if after_sequence:
+            if after_sequence is not None:
                 params['after'] = after_sequence
 
-            response = _get_with_retries(url, params=params, auth=CanvasDataHMACAuth(self.api_key, self.api_secret))
+            disk_cache_key = 'dumps/{}/{}/{}'.format(account_id, limit, params.get('after'))
+            dumps = self._cache_get(disk_cache_key, self.cache_ttl)
+            if dumps is not None:
+                return dumps
+
+            response = self._get_with_retries(url, params=params, auth=CanvasDataHMACAuth(self.api_key, self.api_secret, api_root=self.api_root))
             if response.status_code == 200:
                 dumps = response.json()
+                self._cache_set(disk_cache_key, dumps)
                 return dumps
             else:
                 try:
@@ -141,21 +635,67 @@ class CanvasDataAPI(object):
         except RequestException as e:
             raise CanvasDataAPIError("A generic requests error occurred", e)
 
+    def iter_dumps(self, account_id='self', after_sequence=0, page_size=100, with_files=False, prefetch=4):
+        """
+        Walks the whole dump history, oldest first, starting after `after_sequence`. Pages of
+        `page_size` dumps are fetched lazily with `get_dumps` as the iteration goes.
+        With `with_files=True`, (dump, file_urls) tuples are yielded instead, where `file_urls`
+        is the `get_file_urls` response for that dump; the file lists for the next `prefetch`
+        dumps are fetched concurrently while the current one is being processed.
+        """
+        dumps = self._iter_dump_pages(account_id, after_sequence, page_size)
+        if not with_files:
+            for dump in dumps:
+                yield dump
+            return
+
+        if prefetch <= 1:
+            for dump in dumps:
+                yield dump, self.get_file_urls(account_id=account_id, dump_id=dump['dumpId'])
+            return
+
+        with ThreadPoolExecutor(max_workers=prefetch) as executor:
+            window = deque()
+            for dump in dumps:
+                window.append((dump, executor.submit(self.get_file_urls, account_id=account_id, dump_id=dump['dumpId'])))
+                if len(window) > prefetch:
+                    dump, future = window.popleft()
+                    yield dump, future.result()
+            while window:
+                dump, future = window.popleft()
+                yield dump, future.result()
+
+    def _iter_dump_pages(self, account_id, after_sequence, page_size):
+        after = after_sequence
+        while True:
+            page = self.get_dumps(account_id=account_id, limit=page_size, after_sequence=after)
+            dumps = sorted((d for d in page if d['sequence'] > after), key=lambda d: d['sequence'])
+            for dump in dumps:
+                yield dump
+            if not dumps or len(page) < page_size:
+                return
+            after = dumps[-1]['sequence']
+
     def get_file_urls(self, account_id='self', **kwargs):
         """Get a list of file URLs, either by dump_id (or latest) or by table_name."""
         if kwargs.get('dump_id'):
             if kwargs['dump_id'] == 'latest':
-                url = '{}/api/account/{}/file/latest'.format(API_ROOT, account_id)
+                url = '{}/api/account/{}/file/latest'.format(self.api_root, account_id)
             else:
-                url = '{}/api/account/{}/file/byDump/{}'.format(API_ROOT, account_id, kwargs['dump_id'])
+                url = '{}/api/account/{}/file/byDump/{}'.format(self.api_root, account_id, kwargs['dump_id'])
         elif kwargs.get('table_name'):
-            url = '{}/api/account/{}/file/byTable/{}'.format(API_ROOT, account_id, kwargs['table_name'])
+            url = '{}/api/account/{}/file/byTable/{}'.format(self.api_root, account_id, kwargs['table_name'])
         else:
             raise CanvasDataAPIError("Must pass either dump_id or table_name")
+        # the file URLs are signed and expire, so these are only ever cached for cache_ttl
+        files = self._cache_get(url, self.cache_ttl)
+        if files is not None:
+            return files
         try:
-            response = _get_with_retries(url, auth=CanvasDataHMACAuth(self.api_key, self.api_secret))
+            response = self._get_with_retries(url, auth=CanvasDataHMACAuth(self.api_key, self.api_secret, api_root=self.api_root))
             if response.status_code == 200:
                 files = response.json()
+                self._cache_set(url, files)
                 return files
             else:
                 response_data = response.json()
@@ -167,9 +707,9 @@ class CanvasDataAPI(object):
 
     def get_sync_file_urls(self, account_id='self'):
         """Get a list of file URLs that constitute a complete snapshot of the current data"""
-        url = '{}/api/account/{}/file/sync'.format(API_ROOT, account_id)
+        url = '{}/api/account/{}/file/sync'.format(self.api_root, account_id)
         try:
-            response = _get_with_retries(url, auth=CanvasDataHMACAuth(self.api_key, self.api_secret))
+            response = self._get_with_retries(url, auth=CanvasDataHMACAuth(self.api_key, self.api_secret, api_root=self.api_root))
             if response.status_code == 200:
                 files = response.json()
                 return files
@@ -182,88 +722,588 @@ class CanvasDataAPI(object):
             raise CanvasDataAPIError("A generic requests error occurred", e)
 
     def download_files(self, account_id='self', dump_id=None, table_name=None,
-                       download_directory='./downloads', include_requests=True, force=False):
-        """Download all of the files for a specific dump, all of the files for a specific table, or the files for a specific table from a specific dump."""
-        local_files = []
+                       download_directory='./downloads', include_requests=True, force=False,
+                       max_workers=1, minimal=False):
+        """
+        Download all of the files for a specific dump, all of the files for a specific table, or the files for a specific table from a specific dump.
+        Set `max_workers` to download that many files concurrently.
+        When downloading a table's files without a dump_id, `minimal=True` downloads only the files
+        that `plan_table_backfill` says are needed instead of the table's whole history.
+        """
         if dump_id:
-            dump_files = self.get_file_urls(account_id=account_id, dump_id=dump_id)
-            for dump_table_name, artifacts in dump_files['artifactsByTable'].items():
-                if table_name and table_name != dump_table_name:
-                    continue
-                else:
-                    if dump_table_name == 'requests' and not include_requests:
-                        continue
-                    else:
-                        # download the files
-                        for file in artifacts['files']:
-                            local_files.append(self.get_file(file=file, download_directory=download_directory, force=force))
-
+            file_urls = self.get_file_urls(account_id=account_id, dump_id=dump_id)
+        elif table_name and minimal:
+            plan = self.plan_table_backfill(table_name, account_id=account_id)
+            return self.get_files(plan['files'], download_directory=download_directory, force=force, max_workers=max_workers)
         elif table_name:
             # no dump ID was specified; just get all of the files for the specified table
-            dump_files = self.get_file_urls(account_id=account_id, table_name=table_name)
-            for dump in dump_files['history']:
-                for file in dump['files']:
-                    local_files.append(self.get_file(file=file, download_directory=download_directory, force=force))
-
+            file_urls = self.get_file_urls(account_id=account_id, table_name=table_name)
         else:
             raise CanvasDataAPIError("Neither dump_id or table_name was specified; must specify at least one.")
 
+        files = _files_from_file_urls(file_urls, table_name=table_name, include_requests=include_requests)
+        return self.get_files(files, download_directory=download_directory, force=force, max_workers=max_workers)
+
+    def plan_table_backfill(self, table_name, account_id='self', measure=False, max_workers=8):
+        """
+        Works out the smallest set of files that rebuilds a table from its history: the files
+        of the most recent full (non-partial) dump of the table, plus those of the partial dumps
+        after it. Everything older is made obsolete by that full dump.
+
+        Returns a dict with the planned `files`, the `skipped` files, the `dumps` the plan uses
+        (oldest first), and `planned_bytes`, `total_bytes` and `saved_bytes`. File sizes come
+        from the file metadata when the API includes them; otherwise, with `measure=True`, each
+        file's size is looked up with a one-byte Range request (up to `max_workers` at a time).
+        Sizes that aren't known count as 0.
+        """
+        table_files = self.get_file_urls(account_id=account_id, table_name=table_name)
+        history = sorted(table_files['history'], key=lambda dump: dump['sequence'], reverse=True)
+        needed = []
+        for dump in history:
+            needed.append(dump)
+            if not dump.get('partial'):
+                break
+        skipped = history[len(needed):]
+
+        files = _files_from_file_urls({'history': list(reversed(needed))}, table_name=table_name)
+        skipped_files = _files_from_file_urls({'history': list(reversed(skipped))}, table_name=table_name)
+
+        if measure:
+            unknown = [f for f in files + skipped_files if f.get('size') is None]
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for f, size in zip(unknown, executor.map(self._get_file_size, unknown)):
+                    f['size'] = size
+
+        planned_bytes = sum(f.get('size') or 0 for f in files)
+        skipped_bytes = sum(f.get('size') or 0 for f in skipped_files)
+        return {
+            'table': table_name,
+            'dumps': [dict((k, v) for k, v in dump.items() if k != 'files') for dump in reversed(needed)],
+            'files': files,
+            'skipped': skipped_files,
+            'planned_bytes': planned_bytes,
+            'total_bytes': planned_bytes + skipped_bytes,
+            'saved_bytes': skipped_bytes,
+        }
+
+    def _get_file_size(self, file):
+        """Find out a file's size with a one-byte Range request (the signed URLs only allow GET)."""
+        r = self._get_with_retries(file['url'], stream=True, headers={'Range': 'bytes=0-0'})
+        try:
+            content_range = _CONTENT_RANGE_RE.match(r.headers.get('Content-Range', ''))
+            if r.status_code == 206 and content_range:
+                return int(content_range.group(2))
+            if r.status_code == 200 and r.headers.get('Content-Length'):
+                return int(r.headers['Content-Length'])
+            return None
+        finally:
+            r.close()
+
+    def get_files(self, files, download_directory='./downloads', force=False, max_workers=1, callback=None):
+        """
+        Download a list of files (as returned by `get_file_urls`), using up to `max_workers`
+        concurrent downloads. Returns the local filenames in the same order as `files`.
+        Files that the download directory's manifest says are already there (and that are
+        still in the directory) are skipped without checking each one, unless `force` is set.
+        If `callback` is given it is called with each local filename as soon as that file
+        is done; it is always called from the calling thread, so it's safe to use it to
+        update a progress bar.
+        `download_directory` can also be a `Storage`; see `get_file`.
+        """
+        manifest = self.get_manifest(download_directory)
+        downloaded = set()
+        if manifest and not force:
+            # one listing of the directory catches files that were deleted behind the manifest's back
+            downloaded = manifest.filenames() & set(os.listdir(_local_directory(download_directory)))
+
+        local_files = [None] * len(files)
+        pending = []
+        skipped = []
+        for i, file in enumerate(files):
+            if file['filename'] in downloaded:
+                local_files[i] = os.path.join(_local_directory(download_directory), file['filename'])
+                skipped.append(file)
+                if callback:
+                    callback(local_files[i])
+            else:
+                pending.append(i)
+        if skipped:
+            self._annotate_downloads(manifest, skipped)
+
+        if max_workers <= 1:
+            for i in pending:
+                local_files[i] = self.get_file(file=files[i], download_directory=download_directory, force=force)
+                if callback:
+                    callback(local_files[i])
+            return local_files
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for i in pending:
+                future = executor.submit(self.get_file, file=files[i], download_directory=download_directory, force=force)
+                futures[future] = i
+            try:
+                for future in as_completed(futures):
+                    local_file = future.result()
+                    local_files[futures[future]] = local_file
+                    if callback:
+                        callback(local_file)
+            except Exception:
+                # don't start any more downloads; the ones in flight will finish before we re-raise
+                for future in futures:
+                    future.cancel()
+                raise
         return local_files
 
-    def get_file(self, file, download_directory='./downloads', force=False):
-        # make sure that the download directory exists
-        if not os.path.exists(download_directory):
-            os.makedirs(download_directory)
+    def get_file(self, file, download_directory='./downloads', force=False, validate=None):
+        """
+        Download a single file to the download directory, unless it's already there.
+        The data is written to a `.part` file that's renamed into place once its size (and
+        checksum, when one is known) has been verified. If a download is interrupted, the next
+        attempt - in this call or a later one - resumes it with an HTTP Range request.
+        A download that fails partway through is retried up to `download_retries` times.
+        `validate` overrides the instance's `validate_downloads` setting for this file.
+
+        `download_directory` can also be a `Storage`, such as an `S3Storage`, in which case the
+        file is streamed straight into it (without resuming or a manifest) and its location
+        in the storage is returned.
+        """
+        if validate is None:
+            validate = self.validate_downloads
 
-        target_file = os.path.join(download_directory, file['filename'])
-        if os.path.isfile(target_file) and not force:
-            logger.debug("Not downloading %s because it already exists.", target_file)
-            pass
+        if _local_directory(download_directory) is None:
+            storage = download_directory
+            target_file = storage.location(file['filename'])
+            if storage.exists(file['filename']) and not force:
+                logger.debug("Not downloading %s because it already exists.", target_file)
+                return target_file
+            download = _StorageDownload(file, storage, validate=validate)
         else:
-            logger.debug("Downloading %s because it doesn't exist yet.", target_file)
-            r = _get_with_retries(file['url'], stream=True)
-            with open(target_file, 'wb') as fd:
-                for chunk in r.iter_content(chunk_size=self.download_chunk_size):
-                    fd.write(chunk)
-        return target_file
+            # make sure that the download directory exists
+            download_directory = _local_directory(download_directory)
+            _makedirs(download_directory)
+
+            target_file = os.path.join(download_directory, file['filename'])
+            if os.path.isfile(target_file) and not force:
+                logger.debug("Not downloading %s because it already exists.", target_file)
+                manifest = self.get_manifest(download_directory)
+                entry = manifest.get(file['filename']) if manifest else None
+                if manifest and entry is None:
+                    self._record_download(download_directory, file, os.path.getsize(target_file))
+                elif entry and not _is_annotated(entry):
+                    self._annotate_downloads(manifest, [file], [entry['filename']])
+                return target_file
+            download = _PartialDownload(file, target_file, restart=force, validate=validate)
+
+        logger.debug("Downloading %s because it doesn't exist yet.", target_file)
+        start = time.time()
+        tries = 0
+        while True:
+            tries += 1
+            try:
+                r = self._get_with_retries(file['url'], stream=True, headers=download.request_headers())
+                try:
+                    if download.start(r.status_code, r.headers):
+                        for chunk in r.iter_content(chunk_size=self.download_chunk_size):
+                            if self.bandwidth_limiter:
+                                self.bandwidth_limiter.consume(len(chunk))
+                            download.write(chunk)
+                            self.metrics.increment('download.bytes', len(chunk))
+                    download.finish()
+                finally:
+                    download.close()
+                    r.close()
+                self.metrics.timing('download.time', time.time() - start)
+                if download.rows is not None:
+                    self.metrics.increment('download.rows', download.rows)
+                self._record_download(download_directory, file, download.size, download.md5.hexdigest(), download.rows)
+                return target_file
+            except (RequestException, DownloadVerificationError) as e:
+                # an interrupted local download keeps its .part file, so the next try only fetches the rest
+                if tries < self.download_retries:
+                    logger.warning("Error downloading %s (%s) - %d/%d tries", file['filename'], e, tries, self.download_retries)
+                    continue
+                if isinstance(e, DownloadVerificationError):
+                    raise
+                raise APIConnectionError('Unable to download {}: {}'.format(file['filename'], e))
+
+    def _record_download(self, download_directory, file, size, md5=None, rows=None):
+        """Add a downloaded file to the download directory's manifest."""
+        manifest = self.get_manifest(download_directory)
+        if manifest:
+            manifest.add(file['filename'], dump_id=file.get('dumpId'), table_name=file.get('table'),
+                         sequence=file.get('sequence'), partial=file.get('partial'), size=size, md5=md5,
+                         rows=rows)
+
+    def _annotate_downloads(self, manifest, files, unannotated=None):
+        """
+        Record the dump, table and sequence of already downloaded files whose manifest entries
+        lack them (the filenames in `unannotated`, or all of them that do if it's not given).
+        """
+        if unannotated is None:
+            unannotated = set(e['filename'] for e in manifest.entries() if not _is_annotated(e))
+        manifest.annotate([(f['filename'], f.get('dumpId'), f.get('table'), f.get('sequence'), f.get('partial'))
+                           for f in files if f['filename'] in unannotated and f.get('table')])
+
+    def gc(self, download_directory='./downloads', dry_run=False):
+        """
+        Delete downloaded files that are no longer needed for the latest full snapshot of
+        their table, according to the download directory's manifest (see
+        `DownloadManifest.obsolete`). Files that aren't in the manifest are left alone.
+        Returns the manifest entries of the deleted files; with `dry_run`, nothing is
+        deleted and the entries that would have been deleted are returned.
+        """
+        manifest = self.get_manifest(download_directory)
+        if manifest is None:
+            raise CanvasDataAPIError("gc needs a download manifest; this CanvasDataAPI has use_manifest=False")
+
+        obsolete = manifest.obsolete()
+        if not dry_run:
+            for entry in obsolete:
+                path = os.path.join(download_directory, entry['filename'])
+                if os.path.isfile(path):
+                    logger.debug("Deleting %s; it's older than the latest full snapshot of %s", path, entry['table_name'])
+                    os.remove(path)
+            manifest.remove([entry['filename'] for entry in obsolete])
+        return obsolete
+
+    def plan_sync(self, download_directory='./downloads', account_id='self', include_requests=True):
+        """
+        Compare the download directory with the current complete snapshot of the data, as
+        listed by `get_sync_file_urls`. Returns a dict with the files that need to be
+        downloaded (`download`) and the names of the local fragment files that are no longer
+        part of the snapshot (`delete`). Files for tables that the API reports as incomplete
+        are never marked for deletion, and neither are the `requests` files when
+        `include_requests` is False.
+        """
+        sync_files = self.get_sync_file_urls(account_id=account_id)
+        files = [f for f in sync_files['files'] if include_requests or f.get('table') != 'requests']
+
+        _makedirs(download_directory)
+        on_disk = set(os.listdir(download_directory))
+        manifest = self.get_manifest(download_directory)
+        downloaded = manifest.filenames() if manifest else set()
+
+        keep_tables = set(sync_files.get('incomplete') or [])
+        if not include_requests:
+            keep_tables.add('requests')
+        snapshot = set(f['filename'] for f in sync_files['files'])
+        delete = []
+        for filename in sorted(on_disk):
+            name = filename[:-len('.part')] if filename.endswith('.part') else filename
+            if not name.endswith('.gz') or name in snapshot:
+                continue
+            entry = manifest.get(name) if manifest and name in downloaded else None
+            if entry and entry['table_name'] in keep_tables:
+                continue
+            delete.append(filename)
+
+        return {
+            'download': [f for f in files if f['filename'] not in on_disk],
+            'delete': delete,
+        }
+
+    def sync(self, download_directory='./downloads', account_id='self', include_requests=True,
+             delete=True, max_workers=1, callback=None, plan=None):
+        """
+        Make the download directory match the current complete snapshot of the data: download
+        the files that aren't here yet, using up to `max_workers` concurrent downloads, and -
+        unless `delete` is False - delete the fragment files that are no longer part of the
+        snapshot. Pass a `plan` from `plan_sync` to act on it instead of making a new one.
+        `callback` works as it does for `get_files`.
+        Returns a dict with the lists of `downloaded` and `deleted` filenames.
+        """
+        if plan is None:
+            plan = self.plan_sync(download_directory=download_directory, account_id=account_id,
+                                  include_requests=include_requests)
+
+        self.get_files(plan['download'], download_directory=download_directory, max_workers=max_workers,
+                       callback=callback)
+
+        deleted = []
+        if delete:
+            for filename in plan['delete']:
+                logger.debug("Deleting %s because it's no longer part of the snapshot.", filename)
+                path = os.path.join(download_directory, filename)
+                if os.path.isfile(path):
+                    os.remove(path)
+                deleted.append(filename)
+            manifest = self.get_manifest(download_directory)
+            if manifest:
+                manifest.remove(deleted)
+
+        return {'downloaded': [f['filename'] for f in plan['download']], 'deleted': deleted}
 
     def get_data_for_table(self, table_name, account_id='self', dump_id='latest',
                            data_directory='./data', download_directory='./downloads',
-                           force=False):
+                           force=False, jobs=1, per_fragment=False):
         """
         Decompresses and concatenates the dump files for a particular table and writes the resulting data to a text file.
         If a sequence parameter is passed in, the output filename will be prefixed with the sequence.
+        Set `jobs` to decompress that many fragments at the same time, in separate processes.
+        With `per_fragment=True` each fragment is decompressed to its own file in a directory named
+        after the table instead, and the list of those files is returned.
+        The download and data directories can also be `Storage` objects. If either isn't local,
+        the data is streamed from one to the other, and `jobs` is ignored.
         """
+        with self.metrics.timer('table.time', {'table': table_name}):
+            if _local_directory(data_directory) is None or _local_directory(download_directory) is None:
+                return self._get_data_for_table_in_storage(table_name, account_id, dump_id, data_directory,
+                                                           download_directory, force, per_fragment)
+            data_directory = _local_directory(data_directory)
+            download_directory = _local_directory(download_directory)
 
-        # make sure that the data directory exists
-        if not os.path.exists(data_directory):
-            os.makedirs(data_directory)
+            # make sure that the data directory exists
+            if not os.path.exists(data_directory):
+                os.makedirs(data_directory)
 
-        outfilename = os.path.join(data_directory, '{}.txt'.format(table_name))
+            if per_fragment:
+                files = self.download_files(account_id=account_id, dump_id=dump_id, table_name=table_name, download_directory=download_directory)
+                return self.unpack_fragments(files, os.path.join(data_directory, table_name), jobs=jobs,
+                                             force=force, table_name=table_name)
 
-        if os.path.isfile(outfilename) and not force:
-            logger.debug("Not overwriting %s because it already exists.", outfilename)
-            return outfilename
-        else:
-            # get the raw data files
-            files = self.download_files(account_id=account_id, dump_id=dump_id, table_name=table_name, download_directory=download_directory)
+            outfilename = os.path.join(data_directory, '{}.txt'.format(table_name))
+
+            if os.path.isfile(outfilename) and not force:
+                logger.debug("Not overwriting %s because it already exists.", outfilename)
+                return outfilename
+            else:
+                # get the raw data files
+                files = self.download_files(account_id=account_id, dump_id=dump_id, table_name=table_name, download_directory=download_directory)
+                return self.unpack_files(files, outfilename, jobs=jobs, table_name=table_name)
+
+    def _get_data_for_table_in_storage(self, table_name, account_id, dump_id, data_directory, download_directory,
+                                       force, per_fragment):
+        download_storage = _as_storage(download_directory)
+        data_storage = _as_storage(data_directory)
+        outname = '{}.txt'.format(table_name)
+        if not per_fragment and data_storage.exists(outname) and not force:
+            logger.debug("Not overwriting %s because it already exists.", data_storage.location(outname))
+            return data_storage.location(outname)
 
+        files = self.download_files(account_id=account_id, dump_id=dump_id, table_name=table_name,
+                                    download_directory=download_directory)
+        # the downloaded files come back as locations; fragment filenames never contain a slash
+        names = [os.path.basename(f) for f in files]
+
+        with self.metrics.timer('unpack.time', {'table': table_name}):
+            if not per_fragment:
+                self.unpack_to_storage(download_storage, names, data_storage, outname, table_name=table_name)
+                return data_storage.location(outname)
+
+            outnames = []
+            for name in names:
+                fragment_outname = '{}/{}.txt'.format(table_name, name[:-len('.gz')] if name.endswith('.gz') else name)
+                if force or not data_storage.exists(fragment_outname):
+                    self.unpack_to_storage(download_storage, [name], data_storage, fragment_outname, table_name=table_name)
+                outnames.append(data_storage.location(fragment_outname))
+            return outnames
+
+    def unpack_to_storage(self, source, names, target, outname, table_name=None):
+        """
+        Decompresses the gzipped fragment files `names` in the `source` storage and concatenates
+        them, in order, into the file `outname` in the `target` storage, streaming one block at a
+        time. The output only appears in the target once all of it has been written.
+        """
+        writer = target.open_write(outname)
+        try:
+            for name in names:
+                infile = source.open_read(name)
+                try:
+                    with _gzip.GzipFile(fileobj=infile, mode='rb') as gzfile:
+                        shutil.copyfileobj(gzfile, writer, self.unpack_buffer_size)
+                finally:
+                    infile.close()
+            writer.commit()
+        except (IOError, OSError, EOFError, zlib.error) as e:
+            writer.abort()
+            msg = 'Error preparing data for table {}. Input file: {}  Output file: {}  ({})'.format(
+                table_name, source.location(name), target.location(outname), e)
+            raise CanvasDataAPIError(msg)
+        except Exception:
+            writer.abort()
+            raise
+
+    def unpack_files(self, files, outfilename, jobs=1, table_name=None):
+        """
+        Decompresses gzipped fragment files and concatenates them, in order, into `outfilename`.
+        With `jobs` > 1 the fragments are decompressed in parallel by a pool of processes (into
+        temporary files next to `outfilename`), and then concatenated.
+        """
+        start = time.time()
+        if jobs <= 1:
             with open(outfilename, 'wb') as outfile:
                 # gunzip each file and write the data to the output file
                 for infilename in files:
-                    with gzip.open(infilename, 'rb') as infile:
-                        for line in infile:
-                            try:
-                                outfile.write(line)
-                            except IOError:
-                                msg = 'Error preparing data for table {}. Input file: {}  Output file: {}'.format(table_name, infilename, outfilename)
-                                raise CanvasDataAPIError(msg)
+                    _unpack_fragment(infilename, outfile, table_name, outfilename, self.unpack_buffer_size)
+            self._record_unpack(files, [outfilename], table_name, start)
+            return outfilename
 
+        tmpfilenames = ['{}.{}.tmp'.format(outfilename, i) for i in range(len(files))]
+        try:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                for _ in executor.map(_unpack_fragment_file, files, tmpfilenames,
+                                      [table_name] * len(files), [self.unpack_buffer_size] * len(files)):
+                    pass
+            with open(outfilename, 'wb') as outfile:
+                for tmpfilename in tmpfilenames:
+                    with open(tmpfilename, 'rb') as tmpfile:
+                        shutil.copyfileobj(tmpfile, outfile, self.unpack_buffer_size)
+                    os.remove(tmpfilename)
+        finally:
+            for tmpfilename in tmpfilenames:
+                if os.path.isfile(tmpfilename):
+                    os.remove(tmpfilename)
+        self._record_unpack(files, [outfilename], table_name, start)
+        return outfilename
+
+    def unpack_fragments(self, files, output_directory, jobs=1, force=False, table_name=None):
+        """
+        Decompresses each gzipped fragment file to its own `.txt` file in `output_directory`,
+        using up to `jobs` processes. Fragments that were already unpacked are skipped unless
+        `force` is set. Returns the output filenames in the same order as `files`.
+        """
+        start = time.time()
+        _makedirs(output_directory)
+        outfilenames = []
+        todo = []
+        for infilename in files:
+            basename = os.path.basename(infilename)
+            if basename.endswith('.gz'):
+                basename = basename[:-len('.gz')]
+            outfilename = os.path.join(output_directory, '{}.txt'.format(basename))
+            outfilenames.append(outfilename)
+            if force or not os.path.isfile(outfilename):
+                todo.append((infilename, outfilename))
+
+        if jobs <= 1:
+            for infilename, outfilename in todo:
+                _unpack_fragment_file(infilename, outfilename, table_name, self.unpack_buffer_size)
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                for _ in executor.map(_unpack_fragment_file, [t[0] for t in todo], [t[1] for t in todo],
+                                      [table_name] * len(todo), [self.unpack_buffer_size] * len(todo)):
+                    pass
+        self._record_unpack([t[0] for t in todo], [t[1] for t in todo], table_name, start)
+        return outfilenames
+
+    def _record_unpack(self, infilenames, outfilenames, table_name, start):
+        """Report the time and the compressed and decompressed sizes of an unpacking run."""
+        tags = {'table': table_name or 'unknown'}
+        self.metrics.timing('unpack.time', time.time() - start, tags)
+        self.metrics.increment('unpack.bytes_in', sum(os.path.getsize(f) for f in infilenames), tags)
+        self.metrics.increment('unpack.bytes_out', sum(os.path.getsize(f) for f in outfilenames), tags)
+
+    def export_data_for_table(self, table_name, format='parquet', account_id='self', dump_id='latest',
+                              data_directory='./data', download_directory='./downloads', force=False,
+                              row_group_size=1000000):
+        """
+        Converts the dump files for a particular table to a columnar Parquet (or, with
+        `format='arrow'`, Arrow IPC) file, with column types taken from the dump's schema.
+        See `export.export_fragments`; this needs pyarrow.
+        """
+        _makedirs(data_directory)
+
+        outfilename = os.path.join(data_directory, '{}.{}'.format(table_name, format))
+        if os.path.isfile(outfilename) and not force:
+            logger.debug("Not overwriting %s because it already exists.", outfilename)
             return outfilename
 
+        dump = self.get_file_urls(account_id=account_id, dump_id=dump_id)
+        json_schema = self.get_schema(dump['schemaVersion'], key_on_tablenames=True)
+        files = self.get_files(_files_from_file_urls(dump, table_name=table_name), download_directory=download_directory)
+
+        # write to a temporary file so that an interrupted export doesn't look finished
+        partfilename = outfilename + '.part'
+        export_fragments(files, table_name, json_schema[table_name]['columns'], partfilename, format=format,
+                         row_group_size=row_group_size)
+        _replace(partfilename, outfilename)
+        return outfilename
+
+    def partition_requests(self, account_id='self', data_directory='./data', download_directory='./downloads',
+                           max_workers=1, max_open_files=32, timestamp_column='timestamp', callback=None):
+        """
+        Splits the `requests` table into per-day files under `<data_directory>/requests`, using a
+        `RequestsPartitioner`. The dumps to process come from `plan_table_backfill`: the latest
+        full dump of the table and the partial dumps after it, oldest first. Dumps that were
+        already processed are skipped, so it's safe to re-run this after every new dump.
+        `callback`, if given, is called with each dump after it's processed.
+        Returns the sorted list of days that were written.
+
+        The position of the `timestamp_column` is looked up in the schema version of each dump,
+        since the layout of the `requests` table can change between versions.
+        """
+        timestamp_indexes = {}
+
+        def timestamp_index(schema_version):
+            if schema_version not in timestamp_indexes:
+                schema = self.get_schema(schema_version, key_on_tablenames=True)
+                column_names = [c['name'] for c in schema['requests']['columns']]
+                timestamp_indexes[schema_version] = column_names.index(timestamp_column)
+            return timestamp_indexes[schema_version]
+
+        partitioner = RequestsPartitioner(os.path.join(data_directory, 'requests'), timestamp_index('latest'),
+                                          max_open_files=max_open_files)
+
+        plan = self.plan_table_backfill('requests', account_id=account_id)
+        days = set()
+        for dump in plan['dumps']:
+            if not partitioner.is_processed(dump['sequence']):
+                # the table's history doesn't say which schema version a dump has, but the dump does
+                schema_version = (dump.get('schemaVersion') or
+                                  self.get_file_urls(account_id=account_id, dump_id=dump['dumpId'])['schemaVersion'])
+                dump_files = [f for f in plan['files'] if f['sequence'] == dump['sequence']]
+                files = self.get_files(dump_files, download_directory=download_directory, max_workers=max_workers)
+                days.update(partitioner.process_dump(dump['sequence'], files, partial=dump.get('partial'),
+                                                     timestamp_column_index=timestamp_index(schema_version)))
+            if callback:
+                callback(dump)
+        return sorted(days)
+
+    def iter_rows(self, table_name, account_id='self', dump_id='latest', download_directory='./downloads',
+                  stream=False, max_workers=1):
+        """
+        Yields the rows of a table from a dump as lists of column values, reading the gzipped
+        fragments directly instead of writing an unpacked text file first. Values are strings;
+        nulls (`\\N`) are returned as None. By default the fragments are downloaded (if they
+        aren't already, using up to `max_workers` concurrent downloads) and read from the
+        download directory. With `stream=True` the rows are decompressed straight from the
+        HTTP responses and nothing is written to disk.
+        """
+        if stream:
+            file_urls = self.get_file_urls(account_id=account_id, dump_id=dump_id)
+            for file in _files_from_file_urls(file_urls, table_name=table_name):
+                r = self._get_with_retries(file['url'], stream=True)
+                try:
+                    if r.status_code != 200:
+                        raise CanvasDataAPIError('Unable to download {} (HTTP {})'.format(file['filename'], r.status_code))
+                    for row in _iter_gzip_rows(r.raw):
+                        yield row
+                finally:
+                    r.close()
+        else:
+            files = self.download_files(account_id=account_id, dump_id=dump_id, table_name=table_name,
+                                        download_directory=download_directory, max_workers=max_workers)
+            for infilename in files:
+                with open(infilename, 'rb') as infile:
+                    for row in _iter_gzip_rows(infile):
+                        yield row
+
     def get_data_for_dump(self, dump_id='latest', account_id='self', data_directory='./data',
-                          download_directory='./downloads', include_requests=False, force=False):
-        """Decompresses and concatenates the dump files for all of the tables in a particular dump."""
+                          download_directory='./downloads', include_requests=False, force=False,
+                          jobs=1, per_fragment=False, pipelined=False, max_workers=1, queue_size=2):
+        """
+        Decompresses and concatenates the dump files for all of the tables in a particular dump.
+        `jobs` and `per_fragment` are passed on to `get_data_for_table`.
+        With `pipelined=True`, tables are decompressed as soon as their files are downloaded,
+        while the next tables download (see `process_dump_tables`); `max_workers` and
+        `queue_size` are passed on to it. Pipelining only works with local directories.
+        """
+        if pipelined:
+            return self._get_data_for_dump_pipelined(dump_id, account_id, data_directory, download_directory,
+                                                     include_requests, force, jobs, per_fragment, max_workers,
+                                                     queue_size)
+
         dump = self.get_file_urls(dump_id=dump_id, account_id=account_id)
         dump_table_names = dump['artifactsByTable'].keys()
         outfiles = []
@@ -271,11 +1311,80 @@ class CanvasDataAPI(object):
             if table_name == 'requests' and not include_requests:
                 continue
             filename = self.get_data_for_table(table_name=table_name, account_id=account_id, dump_id=dump_id,
-                                               data_directory=data_directory, download_directory=download_directory)
+                                               data_directory=data_directory, download_directory=download_directory,
+                                               jobs=jobs, per_fragment=per_fragment)
             outfiles.append(filename)
 
         return outfiles
 
+    def _get_data_for_dump_pipelined(self, dump_id, account_id, data_directory, download_directory, include_requests,
+                                     force, jobs, per_fragment, max_workers, queue_size):
+        if _local_directory(data_directory) is None or _local_directory(download_directory) is None:
+            raise CanvasDataAPIError("get_data_for_dump can only be pipelined with local directories")
+        data_directory = _local_directory(data_directory)
+        download_directory = _local_directory(download_directory)
+        _makedirs(data_directory)
+
+        dump = self.get_file_urls(dump_id=dump_id, account_id=account_id)
+        outfiles = {}
+        table_names = []
+        for table_name in dump['artifactsByTable']:
+            if table_name == 'requests' and not include_requests:
+                continue
+            outfilename = os.path.join(data_directory, '{}.txt'.format(table_name))
+            if not per_fragment and os.path.isfile(outfilename) and not force:
+                logger.debug("Not overwriting %s because it already exists.", outfilename)
+                outfiles[table_name] = outfilename
+            else:
+                table_names.append(table_name)
+
+        def unpack(table_name, files, partial):
+            with self.metrics.timer('table.time', {'table': table_name}):
+                if per_fragment:
+                    return self.unpack_fragments(files, os.path.join(data_directory, table_name), jobs=jobs,
+                                                 force=force, table_name=table_name)
+                return self.unpack_files(files, os.path.join(data_directory, '{}.txt'.format(table_name)),
+                                         jobs=jobs, table_name=table_name)
+
+        for table_name, outfile in self.process_dump_tables(unpack, dump_id=dump_id, account_id=account_id,
+                                                            table_names=table_names, download_directory=download_directory,
+                                                            max_workers=max_workers, queue_size=queue_size):
+            outfiles[table_name] = outfile
+        return [outfiles[t] for t in dump['artifactsByTable'] if t in outfiles]
+
+    def process_dump_tables(self, process, dump_id='latest', account_id='self', table_names=None,
+                            download_directory='./downloads', include_requests=False, force=False,
+                            max_workers=1, workers=1, queue_size=2):
+        """
+        Downloads a dump's files table by table and calls `process(table_name, files, partial)`
+        for each table as soon as all of its files are here, while the following tables are
+        still downloading. Yields `(table_name, result)` pairs as the tables are processed, in
+        the calling thread; iterate over it to make it run.
+
+        The tables are `table_names` if given, or else all of the dump's tables (except
+        `requests`, unless `include_requests` is set). Each table's files are downloaded using
+        up to `max_workers` concurrent downloads, and `workers` threads call `process`. At most
+        `queue_size` downloaded tables wait to be processed; when processing falls behind that
+        far, downloading pauses, so the downloads can't fill up the disk ahead of it.
+        """
+        dump = self.get_file_urls(dump_id=dump_id, account_id=account_id)
+        if table_names is None:
+            table_names = [t for t in dump['artifactsByTable'] if t != 'requests' or include_requests]
+
+        def download(table_name):
+            files = _files_from_file_urls(dump, table_name=table_name)
+            local_files = self.get_files(files, download_directory=download_directory, force=force,
+                                         max_workers=max_workers)
+            return table_name, local_files, dump['artifactsByTable'][table_name]['partial']
+
+        def run(downloaded):
+            table_name, files, partial = downloaded
+            return table_name, process(table_name, files, partial)
+
+        pipeline = Pipeline([(download, 1), (run, workers)], queue_size=queue_size)
+        for result in pipeline.run(table_names):
+            yield result
+
     def get_latest_regular_dump(self, account_id='self'):
         """Finds the latest dump_id that isn't a full requests dump."""
         last_two_dumps = self.get_dumps(account_id=account_id, limit=2)
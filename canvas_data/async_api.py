@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import os
+from urllib.parse import urlencode
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .api import (_NO_RETRY_STATUS_CODES, _files_from_file_urls, _makedirs,
+                  _PartialDownload, _retry_wait)
+from .exceptions import (APIConnectionError, CanvasDataAPIError,
+                         DownloadVerificationError, MissingCredentialsError)
+from .hmac_auth import API_ROOT, CanvasDataHMACAuth
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCanvasDataAPI(object):
+    """
+    An asyncio version of `CanvasDataAPI`, built on aiohttp (install it with
+    ``pip install canvas-data-sdk[async]``). All requests share one aiohttp session, and
+    at most `max_concurrency` of them are in flight at any time, so thousands of
+    fragment downloads can be scheduled at once without opening thousands of sockets.
+
+    Use it as an async context manager, or call `close()` when you're done::
+
+        async with AsyncCanvasDataAPI(api_key, api_secret) as cd:
+            files = await cd.download_files(dump_id='latest')
+    """
+
+    def __init__(self, api_key, api_secret, download_chunk_size=1024*1024, download_retries=3,
+                 max_concurrency=20, session=None, max_retries=3, retry_delay=1, retry_backoff=2,
+                 max_retry_delay=60, api_root=API_ROOT):
+        if aiohttp is None:
+            raise ImportError('AsyncCanvasDataAPI requires aiohttp; install it with "pip install canvas-data-sdk[async]"')
+        if not api_key or not api_secret:
+            raise MissingCredentialsError(self)
+
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.api_root = api_root
+
+        self.schema = {}
+        self.schema_versions = None
+
+        self.download_chunk_size = download_chunk_size
+        self.download_retries = download_retries
+
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.retry_backoff = retry_backoff
+        self.max_retry_delay = max_retry_delay
+
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = session
+        self._owns_session = session is None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    @property
+    def session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        """Close the underlying aiohttp session, if this client created it."""
+        if self._session is not None and self._owns_session:
+            await self._session.close()
+            self._session = None
+
+    async def _get_with_retries(self, url, headers=None):
+        """
+        GET a URL, retrying connection errors and non-200 responses the same way
+        `CanvasDataAPI` does. The caller must release the returned response.
+        """
+        tries = 0
+        while True:
+            try:
+                resp = await self.session.get(url, headers=headers)
+                if resp.status not in _NO_RETRY_STATUS_CODES and tries < self.max_retries:
+                    logger.warning("Got a non-200 response ({}) - going to retry.".format(resp.status))
+                    resp.release()
+                    await asyncio.sleep(_retry_wait(self, tries, resp.headers))
+                    tries += 1
+                    continue
+            except aiohttp.ClientConnectionError:
+                if tries < self.max_retries:
+                    logger.exception("ConnectionError - %d/%d tries", tries + 1, self.max_retries)
+                    await asyncio.sleep(_retry_wait(self, tries))
+                    tries += 1
+                    continue
+                else:
+                    logger.exception("ConnectionError - reached the retry limit")
+                    raise
+            return resp
+
+    async def _get_api_json(self, url, params=None):
+        """Make a signed request to the Canvas Data API and return the decoded JSON response."""
+        if params:
+            url = '{}?{}'.format(url, urlencode(params))
+        auth = CanvasDataHMACAuth(self.api_key, self.api_secret, api_root=self.api_root)
+        try:
+            async with self._semaphore:
+                response = await self._get_with_retries(url, headers=auth.get_headers(url))
+                try:
+                    if response.status == 200:
+                        return await response.json(content_type=None)
+                    try:
+                        response_data = await response.json(content_type=None)
+                        message = response_data['message']
+                    except (ValueError, KeyError, TypeError):
+                        message = await response.text()
+                    raise CanvasDataAPIError(message)
+                finally:
+                    response.release()
+        except aiohttp.ClientConnectionError as e:
+            raise APIConnectionError("A connection error occurred: {}".format(e))
+        except aiohttp.ClientError as e:
+            raise CanvasDataAPIError("A generic aiohttp error occurred: {}".format(e))
+
+    async def get_schema_versions(self):
+        """Get the list of all available schema versions."""
+        if not self.schema_versions:
+            self.schema_versions = await self._get_api_json('{}/api/schema'.format(self.api_root))
+        return self.schema_versions
+
+    async def get_schema(self, version='latest', key_on_tablenames=False):
+        """
+        Get a particular version of the schema. See `CanvasDataAPI.get_schema` for the
+        meaning of `key_on_tablenames`.
+        """
+        cache_key = '{}/{}'.format(version, key_on_tablenames)
+        if cache_key not in self.schema:
+            schema = await self._get_api_json('{}/api/schema/{}'.format(self.api_root, version))
+            if key_on_tablenames:
+                self.schema[cache_key] = dict((v['tableName'], v) for v in schema['schema'].values())
+            else:
+                self.schema[cache_key] = schema['schema']
+        return self.schema[cache_key]
+
+    async def get_dumps(self, account_id='self', limit=100, after_sequence=None):
+        """Get a list of all dumps"""
+        params = {
+            'limit': limit,
+        }
+        if after_sequence is not None:
+            params['after'] = after_sequence
+        return await self._get_api_json('{}/api/account/{}/dump'.format(self.api_root, account_id), params=params)
+
+    async def get_file_urls(self, account_id='self', **kwargs):
+        """Get a list of file URLs, either by dump_id (or latest) or by table_name."""
+        if kwargs.get('dump_id'):
+            if kwargs['dump_id'] == 'latest':
+                url = '{}/api/account/{}/file/latest'.format(self.api_root, account_id)
+            else:
+                url = '{}/api/account/{}/file/byDump/{}'.format(self.api_root, account_id, kwargs['dump_id'])
+        elif kwargs.get('table_name'):
+            url = '{}/api/account/{}/file/byTable/{}'.format(self.api_root, account_id, kwargs['table_name'])
+        else:
+            raise CanvasDataAPIError("Must pass either dump_id or table_name")
+        return await self._get_api_json(url)
+
+    async def get_sync_file_urls(self, account_id='self'):
+        """Get a list of file URLs that constitute a complete snapshot of the current data"""
+        return await self._get_api_json('{}/api/account/{}/file/sync'.format(self.api_root, account_id))
+
+    async def download_files(self, account_id='self', dump_id=None, table_name=None,
+                             download_directory='./downloads', include_requests=True, force=False):
+        """
+        Download all of the files for a specific dump, all of the files for a specific table, or the files
+        for a specific table from a specific dump. Up to `max_concurrency` files are downloaded at once.
+        """
+        if dump_id:
+            file_urls = await self.get_file_urls(account_id=account_id, dump_id=dump_id)
+        elif table_name:
+            file_urls = await self.get_file_urls(account_id=account_id, table_name=table_name)
+        else:
+            raise CanvasDataAPIError("Neither dump_id or table_name was specified; must specify at least one.")
+
+        files = _files_from_file_urls(file_urls, table_name=table_name, include_requests=include_requests)
+        return await self.get_files(files, download_directory=download_directory, force=force)
+
+    async def get_files(self, files, download_directory='./downloads', force=False):
+        """Download a list of files concurrently. Returns the local filenames in the same order as `files`."""
+        _makedirs(download_directory)
+        return await asyncio.gather(*[
+            self.get_file(file=file, download_directory=download_directory, force=force) for file in files
+        ])
+
+    async def get_file(self, file, download_directory='./downloads', force=False):
+        """
+        Download a single file to the download directory, unless it's already there. Like
+        `CanvasDataAPI.get_file`, this downloads to a `.part` file, resumes interrupted
+        downloads with a Range request, and verifies the file before renaming it into place.
+        """
+        _makedirs(download_directory)
+
+        target_file = os.path.join(download_directory, file['filename'])
+        if os.path.isfile(target_file) and not force:
+            logger.debug("Not downloading %s because it already exists.", target_file)
+            return target_file
+
+        logger.debug("Downloading %s because it doesn't exist yet.", target_file)
+        download = _PartialDownload(file, target_file, restart=force)
+        tries = 0
+        async with self._semaphore:
+            while True:
+                tries += 1
+                try:
+                    r = await self._get_with_retries(file['url'], headers=download.request_headers())
+                    try:
+                        if download.start(r.status, r.headers):
+                            async for chunk in r.content.iter_chunked(self.download_chunk_size):
+                                download.write(chunk)
+                        download.finish()
+                    finally:
+                        download.close()
+                        r.release()
+                    return target_file
+                except (aiohttp.ClientError, asyncio.TimeoutError, DownloadVerificationError) as e:
+                    # an interrupted download keeps its .part file, so the next try only fetches the rest
+                    if tries < self.download_retries:
+                        logger.warning("Error downloading %s (%s) - %d/%d tries", file['filename'], e, tries, self.download_retries)
+                        continue
+                    if isinstance(e, DownloadVerificationError):
+                        raise
+                    raise APIConnectionError('Unable to download {}: {}'.format(file['filename'], e))
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from .compat import replace as _replace
+
+logger = logging.getLogger(__name__)
+
+
+class FileCache(object):
+    """
+    A size-bounded on-disk cache of JSON-serializable values, meant to be shared by many
+    short-lived processes. Each entry is one file, written to a temporary file and then
+    renamed into place, so readers never see a partly written entry. When the cache grows
+    past `max_size` bytes, the least recently used entries are evicted.
+    """
+
+    def __init__(self, directory, max_size=64*1024*1024):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+    def _path(self, key):
+        return os.path.join(self.directory, '{}.json'.format(hashlib.sha1(key.encode('utf-8')).hexdigest()))
+
+    def get(self, key, ttl=None):
+        """
+        Returns the cached value for a key, or None if there isn't one or it's more than
+        `ttl` seconds old. A `ttl` of None means the entry never expires.
+        """
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get('key') != key:
+            return None
+        if ttl is not None and time.time() - entry['stored_at'] > ttl:
+            return None
+        try:
+            # the modification time tracks the last use, for eviction
+            os.utime(path, None)
+        except OSError:
+            pass
+        logger.debug("Cache hit for %s", key)
+        return entry['value']
+
+    def set(self, key, value):
+        """Store a value for a key, replacing any previous value."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'key': key, 'stored_at': time.time(), 'value': value}, f)
+            _replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                # another process evicted it first
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        if total <= self.max_size:
+            return
+        for mtime, size, name in sorted(entries):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+            if total <= self.max_size:
+                break
@@ -0,0 +1,4 @@
+import os
+
+# os.replace overwrites an existing target on every platform; Python 2 only has os.rename
+replace = getattr(os, 'replace', os.rename)
@@ -1,6 +1,9 @@
-from sqlalchemy import MetaData, Table, Column
+import hashlib
+
+from sqlalchemy import MetaData, Table, Column, Index, PrimaryKeyConstraint
 from sqlalchemy import types
-from sqlalchemy.schema import CreateTable, DropTable
+from sqlalchemy.engine.default import DefaultDialect
+from sqlalchemy.schema import CreateIndex, CreateTable, DropIndex, DropTable
 
 
 TYPE_MAP = {
@@ -18,30 +21,232 @@ TYPE_MAP = {
 }
 
 
-def ddl_from_json(schema_json):
+# PostgreSQL's limit; longer index names are shortened with a hash to keep them unique
+MAX_INDEX_NAME_LENGTH = 63
+
+
+def ddl_from_json(schema_json, primary_keys=False, unlogged=False, dialect=None):
     """
     This function takes the schema definition in JSON format that's returned by
     the Canvas Data API and returns SQL DDL statements that can be used to create
     all of the tables necessary to hold the archived data.
+
+    With `primary_keys=True` tables with an `id` column get it as their primary key.
+    With `unlogged=True` the tables are created UNLOGGED, which makes bulk loads into
+    them a lot faster on PostgreSQL (the only database that supports it), at the cost
+    of the tables being emptied after a crash - they'd have to be reloaded from the
+    dumps. (The staging tables that merges load into are temporary, which PostgreSQL
+    never logs anyway.) Pass a sqlalchemy `dialect` to get its flavour of SQL.
+
+    The tables are created without indexes, so loading them is as fast as possible;
+    create the indexes after loading the data with `index_ddl_from_json`.
     """
-    metadata = MetaData()
+    if unlogged and dialect is not None and dialect.name != 'postgresql':
+        raise ValueError('Only PostgreSQL supports unlogged tables')
     create_ddl = []
     drop_ddl = []
+    for t in tables_from_json(schema_json, primary_keys=primary_keys, unlogged=unlogged).values():
+        create_ddl.append(str(CreateTable(t).compile(dialect=dialect)))
+        drop_ddl.append(str(DropTable(t).compile(dialect=dialect)))
+
+    return create_ddl, drop_ddl
+
+
+def index_ddl_from_json(schema_json, dialect=None):
+    """
+    Returns the SQL DDL statements that create and drop indexes on the columns that
+    refer to other tables: the ones the schema links to a dimension table, and the
+    other `*_id` columns. Run the create statements after loading the data (building
+    an index once is much cheaper than keeping it up to date during a bulk load) and
+    the drop statements before reloading it.
+    """
+    create_ddl = []
+    drop_ddl = []
+    for t in tables_from_json(schema_json, indexes=True).values():
+        for index in sorted(t.indexes, key=lambda i: i.name):
+            create_ddl.append(str(CreateIndex(index).compile(dialect=dialect)).strip())
+            drop_ddl.append(str(DropIndex(index).compile(dialect=dialect)).strip())
+
+    return create_ddl, drop_ddl
+
+
+def tables_from_json(schema_json, metadata=None, primary_keys=False, indexes=False, unlogged=False):
+    """
+    Returns a dict of sqlalchemy Table objects, keyed on table name, for the schema
+    definition in JSON format that's returned by the Canvas Data API. The tables are
+    added to `metadata` if it's given, or to a new MetaData otherwise. Columns with a
+    type that can't be mapped are left out.
+
+    The tables get a primary key on `id` with `primary_keys=True`, indexes on the
+    columns that refer to other tables (see `index_ddl_from_json`) with `indexes=True`
+    and are UNLOGGED (PostgreSQL only) with `unlogged=True`.
+    """
+    if metadata is None:
+        metadata = MetaData()
+    tables = {}
     for artifact in schema_json:
         table_name = schema_json[artifact]['tableName']
         json_columns = schema_json[artifact]['columns']
 
-        t = Table(table_name, metadata)
+        t = Table(table_name, metadata, prefixes=['UNLOGGED'] if unlogged else [])
 
         for j_col in json_columns:
             sa_col = _get_column(table_name, j_col)
             if sa_col is not None:
                 t.append_column(sa_col)
 
-        create_ddl.append(str(CreateTable(t)))
-        drop_ddl.append(str(DropTable(t)))
+        if primary_keys and 'id' in t.columns:
+            # the ids come from Canvas, so the database mustn't generate them
+            t.c.id.autoincrement = False
+            t.append_constraint(PrimaryKeyConstraint('id'))
+        if indexes:
+            for j_col in json_columns:
+                if j_col['name'] in t.columns and _is_reference(j_col):
+                    Index(_index_name(table_name, j_col['name']), t.c[j_col['name']])
 
-    return create_ddl, drop_ddl
+        tables[table_name] = t
+
+    return tables
+
+
+def _is_reference(json_column):
+    """Whether a column refers to another table, and so is likely to be joined on."""
+    if json_column['name'] == 'id':
+        return False
+    return 'dimension' in json_column or json_column['name'].endswith('_id')
+
+
+def _index_name(table_name, column_name):
+    name = 'ix_{}_{}'.format(table_name, column_name)
+    if len(name) > MAX_INDEX_NAME_LENGTH:
+        digest = hashlib.md5(name.encode('utf-8')).hexdigest()[:8]
+        name = '{}_{}'.format(name[:MAX_INDEX_NAME_LENGTH - 9], digest)
+    return name
+
+
+def diff_schemas(old_schema_json, new_schema_json):
+    """
+    Compares two versions of the schema definition in JSON format and returns a dict with
+    the `added_tables` and `dropped_tables`, the `changed_tables` (a dict of table name to
+    the table's changes; see below) and the `reload_tables`: the tables whose data has to
+    be loaded again after migrating, because they're new or their rows got new columns.
+
+    The changes to a table are a dict with the `added_columns` and `dropped_columns`, the
+    `altered_columns` (dicts with the column `name`, `old_type` and `new_type`, and whether
+    the change `widened` the type), whether the table has to be `recreate`d, and whether it
+    needs a `reload`. A table is recreated when its columns were reordered or a column was
+    added somewhere other than at the end (the data files are loaded by position), or when
+    a column's type changed in a way that isn't a widening, since the existing values might
+    not convert. Column types are compared after `_get_column`'s manual overrides.
+    """
+    old_tables = tables_from_json(old_schema_json)
+    new_tables = tables_from_json(new_schema_json)
+    added_tables = sorted(set(new_tables) - set(old_tables))
+    changed_tables = {}
+    for table_name in sorted(set(old_tables) & set(new_tables)):
+        changes = _diff_table(old_tables[table_name], new_tables[table_name])
+        if changes:
+            changed_tables[table_name] = changes
+
+    return {
+        'added_tables': added_tables,
+        'dropped_tables': sorted(set(old_tables) - set(new_tables)),
+        'changed_tables': changed_tables,
+        'reload_tables': sorted(added_tables + [t for t, changes in changed_tables.items() if changes['reload']]),
+    }
+
+
+def migration_ddl(old_schema_json, new_schema_json, dialect=None, primary_keys=False, unlogged=False):
+    """
+    Returns the SQL DDL statements that migrate the tables for one version of the schema
+    to the next, as worked out by `diff_schemas`, along with the list of tables whose data
+    has to be reloaded. Only tables that changed are touched: new tables are created,
+    dropped ones dropped, and changed ones altered column by column - unless they have to
+    be recreated, in which case they're dropped and created again. Pass a sqlalchemy
+    `dialect` to get its flavour of SQL; the ALTER COLUMN syntax is PostgreSQL's, or
+    MySQL's for the MySQL dialect. SQLite can't change a column's type, so there tables
+    with altered columns are recreated (and reloaded) too.
+
+    Pass the same `primary_keys` and `unlogged` options the tables were created with (see
+    `ddl_from_json`), so that the tables the migration creates match the others.
+    """
+    if unlogged and dialect is not None and dialect.name != 'postgresql':
+        raise ValueError('Only PostgreSQL supports unlogged tables')
+    if dialect is None:
+        dialect = DefaultDialect()
+    diff = diff_schemas(old_schema_json, new_schema_json)
+    old_tables = tables_from_json(old_schema_json)
+    new_tables = tables_from_json(new_schema_json, primary_keys=primary_keys, unlogged=unlogged)
+    quote = dialect.identifier_preparer.quote
+    reload_tables = set(diff['reload_tables'])
+
+    ddl = []
+    for table_name in diff['dropped_tables']:
+        ddl.append(str(DropTable(old_tables[table_name]).compile(dialect=dialect)))
+    for table_name in diff['added_tables']:
+        ddl.append(str(CreateTable(new_tables[table_name]).compile(dialect=dialect)))
+    for table_name, changes in sorted(diff['changed_tables'].items()):
+        new_table = new_tables[table_name]
+        # SQLite can't alter column types, and an added id column can't get its primary key with ADD COLUMN
+        if (changes['recreate'] or (dialect.name == 'sqlite' and changes['altered_columns']) or
+                (primary_keys and 'id' in changes['added_columns'])):
+            reload_tables.add(table_name)
+            ddl.append(str(DropTable(old_tables[table_name]).compile(dialect=dialect)))
+            ddl.append(str(CreateTable(new_table).compile(dialect=dialect)))
+            continue
+        alter = 'ALTER TABLE {} '.format(quote(table_name))
+        for column_name in changes['dropped_columns']:
+            ddl.append(alter + 'DROP COLUMN {}'.format(quote(column_name)))
+        for column_name in changes['added_columns']:
+            ddl.append(alter + 'ADD COLUMN {} {}'.format(
+                quote(column_name), new_table.c[column_name].type.compile(dialect=dialect)))
+        for column in changes['altered_columns']:
+            column_type = new_table.c[column['name']].type.compile(dialect=dialect)
+            if dialect.name == 'mysql':
+                ddl.append(alter + 'MODIFY COLUMN {} {}'.format(quote(column['name']), column_type))
+            else:
+                ddl.append(alter + 'ALTER COLUMN {} TYPE {}'.format(quote(column['name']), column_type))
+
+    return ddl, sorted(reload_tables)
+
+
+def _diff_table(old_table, new_table):
+    old_columns = [c.name for c in old_table.columns]
+    new_columns = [c.name for c in new_table.columns]
+    added = [c for c in new_columns if c not in old_columns]
+    dropped = [c for c in old_columns if c not in new_columns]
+    kept = [c for c in old_columns if c in new_columns]
+
+    altered = []
+    for name in kept:
+        old_type = str(old_table.c[name].type.compile(dialect=DefaultDialect()))
+        new_type = str(new_table.c[name].type.compile(dialect=DefaultDialect()))
+        if old_type != new_type:
+            altered.append({'name': name, 'old_type': old_type, 'new_type': new_type,
+                            'widened': _is_widening(old_table.c[name].type, new_table.c[name].type)})
+
+    # existing values survive a widening, but any other type change might not convert cleanly
+    recreate = new_columns != kept + added or not all(column['widened'] for column in altered)
+    if not (added or dropped or altered or recreate):
+        return None
+    return {
+        'added_columns': added,
+        'dropped_columns': dropped,
+        'altered_columns': altered,
+        'recreate': recreate,
+        'reload': bool(added) or recreate,
+    }
+
+
+def _is_widening(old_type, new_type):
+    """Whether every value of the old column type fits the new one unchanged."""
+    if isinstance(new_type, types.Text):
+        return isinstance(old_type, types.String)
+    if isinstance(new_type, types.String) and isinstance(old_type, types.String) and not isinstance(old_type, types.Text):
+        return (new_type.length or 0) >= (old_type.length or 0)
+    if isinstance(new_type, types.BigInteger):
+        return isinstance(old_type, types.Integer)
+    return False
 
 
 def _get_column(table, column):
@@ -0,0 +1,114 @@
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from sqlalchemy import types
+
+from .ddl_utils import _get_column
+from .loader import _converter, _unescape
+
+NULL = '\\N'
+
+# Canvas Data types whose values repeat a lot, and so are worth interning
+INTERNED_TYPES = ('guid', 'enum')
+
+
+class RowDecoder(object):
+    """
+    Turns batches of rows from a Canvas Data table into typed columns, one column at a time
+    rather than one cell at a time. Build it from the table's entry in
+    `CanvasDataAPI.get_schema(key_on_tablenames=True)`.
+
+    With NumPy installed, bigint/int, double precision, boolean, timestamp and date columns
+    are decoded into NumPy masked arrays (the mask marks the nulls), using NumPy's vectorized
+    string parsing. Without NumPy they're lists of Python values with None for nulls. Text
+    columns are lists of strings (None for nulls); guid and enum values are interned, so
+    repeated values share one string object.
+    """
+
+    def __init__(self, table_name, table_schema):
+        self.table_name = table_name
+        self.columns = []
+        for j_col in table_schema['columns']:
+            sa_col = _get_column(table_name, j_col)
+            self.columns.append((j_col['name'], j_col['type'], sa_col.type if sa_col is not None else None))
+
+    @property
+    def column_names(self):
+        return [c[0] for c in self.columns]
+
+    def decode(self, rows):
+        """
+        Decode a batch of rows - sequences of string values, as from `CanvasDataAPI.iter_rows`
+        or `split_lines` - into a dict of columns keyed on column name. Nulls can be either
+        None or the raw `\\N` marker.
+        """
+        decoded = {}
+        if not rows:
+            return dict((name, []) for name in self.column_names)
+        for (name, json_type, sa_type), values in zip(self.columns, zip(*rows)):
+            decoded[name] = self._decode_column(json_type, sa_type, values)
+        return decoded
+
+    def decode_lines(self, lines):
+        """Decode a batch of raw tab-separated lines (bytes or str) into columns."""
+        return self.decode(split_lines(lines))
+
+    def _decode_column(self, json_type, sa_type, values):
+        nulls = [v is None or v == NULL for v in values]
+        has_nulls = any(nulls)
+
+        if sa_type is None or isinstance(sa_type, (types.String, types.Text)):
+            if json_type in INTERNED_TYPES:
+                intern = sys.intern
+                return [None if null else intern(v) for v, null in zip(values, nulls)]
+            return [None if null else _unescape(v) for v, null in zip(values, nulls)]
+
+        if np is None:
+            convert = _converter(sa_type)
+            return [None if null else convert(v) for v, null in zip(values, nulls)]
+
+        if isinstance(sa_type, (types.DateTime, types.Date)):
+            filler = 'NaT'
+        elif isinstance(sa_type, types.Boolean):
+            filler = 'false'
+        else:
+            filler = '0'
+        strings = np.array([filler if null else v for v, null in zip(values, nulls)] if has_nulls else values)
+
+        if isinstance(sa_type, types.Integer):
+            data = strings.astype(np.int64)
+        elif isinstance(sa_type, types.Float):
+            data = strings.astype(np.float64)
+        elif isinstance(sa_type, types.Boolean):
+            data = strings == 'true'
+        elif isinstance(sa_type, types.DateTime):
+            data = strings.astype('datetime64[ms]')
+        else:
+            data = strings.astype('datetime64[D]')
+        return np.ma.MaskedArray(data, mask=nulls if has_nulls else False)
+
+
+def split_lines(lines):
+    """Split raw tab-separated lines (bytes or str) into lists of string values."""
+    rows = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        rows.append(line.rstrip('\n').split('\t'))
+    return rows
+
+
+def iter_batches(rows, batch_size=100000):
+    """Group an iterable of rows into lists of up to `batch_size` rows, for `RowDecoder.decode`."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -23,3 +23,11 @@ class APIConnectionError(CanvasDataAPIError):
         if msg is None:
             msg = "There was an API connection error"
         super(CanvasDataAPIError, self).__init__(msg)
+
+
+class DownloadVerificationError(CanvasDataAPIError):
+    '''Raised when a downloaded file doesn't have the expected size or checksum'''
+    def __init__(self, msg=None):
+        if msg is None:
+            msg = "A downloaded file did not match its expected size or checksum"
+        super(CanvasDataAPIError, self).__init__(msg)
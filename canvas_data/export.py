@@ -0,0 +1,134 @@
+import logging
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pa_parquet
+except ImportError:
+    pa = None
+
+from sqlalchemy import types
+
+from .ddl_utils import _get_column
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('parquet', 'arrow')
+
+# the backslash escapes of PostgreSQL's COPY text format, as undone by `loader._unescape`
+_ESCAPES = (('t', '\t'), ('n', '\n'), ('r', '\r'), ('b', '\b'), ('f', '\f'), ('v', '\v'))
+
+
+def arrow_schema(table_name, json_columns):
+    """
+    Returns a pyarrow schema for a table's columns, as described in the JSON schema from the
+    Canvas Data API. The types come from the same mapping (including the manual overrides)
+    that `ddl_utils` uses for the SQL DDL; columns it can't map are left out.
+    """
+    _require_pyarrow()
+    fields = []
+    for j_col in json_columns:
+        sa_col = _get_column(table_name, j_col)
+        if sa_col is not None:
+            fields.append(pa.field(sa_col.name, _arrow_type(sa_col.type)))
+    return pa.schema(fields)
+
+
+def export_fragments(files, table_name, json_columns, outfilename, format='parquet',
+                     row_group_size=1000000, block_size=16*1024*1024):
+    """
+    Converts a table's gzipped fragment files to a Parquet or Arrow IPC file. The fragments
+    are parsed in blocks of `block_size` bytes and written out in row groups (or record
+    batches) of up to `row_group_size` rows, so memory use is bounded no matter how big the
+    table is. Returns the number of rows written.
+    """
+    _require_pyarrow()
+    if format not in FORMATS:
+        raise ValueError('Unknown export format {}; use one of {}'.format(format, ', '.join(FORMATS)))
+
+    schema = arrow_schema(table_name, json_columns)
+    read_options = pa_csv.ReadOptions(column_names=[c['name'] for c in json_columns], block_size=block_size)
+    parse_options = pa_csv.ParseOptions(delimiter='\t', quote_char=False, double_quote=False, newlines_in_values=False)
+    convert_options = pa_csv.ConvertOptions(
+        column_types=dict((f.name, f.type) for f in schema),
+        include_columns=schema.names,
+        null_values=['\\N'],
+        strings_can_be_null=True,
+        true_values=['true'],
+        false_values=['false'],
+    )
+
+    if format == 'parquet':
+        writer = pa_parquet.ParquetWriter(outfilename, schema)
+    else:
+        writer = pa_ipc.new_file(outfilename, schema)
+
+    count = 0
+    pending = []
+    pending_rows = 0
+    try:
+        for filename in files:
+            with pa.input_stream(filename, compression='gzip') as infile:
+                reader = pa_csv.open_csv(infile, read_options=read_options, parse_options=parse_options,
+                                         convert_options=convert_options)
+                for batch in reader:
+                    pending.append(_unescape_batch(batch))
+                    pending_rows += batch.num_rows
+                    if pending_rows >= row_group_size:
+                        count += _write(writer, schema, pending, format, row_group_size)
+                        pending = []
+                        pending_rows = 0
+        if pending:
+            count += _write(writer, schema, pending, format, row_group_size)
+    finally:
+        writer.close()
+    logger.debug("Exported %d rows of %s to %s", count, table_name, outfilename)
+    return count
+
+
+def _unescape_batch(batch):
+    """Undo the backslash escaping in the string columns of a record batch."""
+    columns = []
+    for column in batch.columns:
+        if pa.types.is_string(column.type) and pc.any(pc.match_substring(column, '\\')).as_py():
+            # park escaped backslashes on NUL (which COPY data can't contain) so they don't start another escape
+            column = pc.replace_substring(column, '\\\\', '\x00')
+            for escape, char in _ESCAPES:
+                column = pc.replace_substring(column, '\\' + escape, char)
+            column = pc.replace_substring_regex(column, '\\\\(.)', '\\1')
+            column = pc.replace_substring(column, '\x00', '\\')
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, schema=batch.schema)
+
+
+def _write(writer, schema, batches, format, row_group_size):
+    table = pa.Table.from_batches(batches, schema=schema)
+    if format == 'parquet':
+        writer.write_table(table, row_group_size=row_group_size)
+    else:
+        writer.write_table(table, max_chunksize=row_group_size)
+    return table.num_rows
+
+
+def _arrow_type(sa_type):
+    """Returns the pyarrow type for a sqlalchemy column type from `ddl_utils`."""
+    if isinstance(sa_type, types.BigInteger):
+        return pa.int64()
+    elif isinstance(sa_type, types.Integer):
+        return pa.int32()
+    elif isinstance(sa_type, types.Boolean):
+        return pa.bool_()
+    elif isinstance(sa_type, types.Float):
+        return pa.float64()
+    elif isinstance(sa_type, types.DateTime):
+        return pa.timestamp('ms')
+    elif isinstance(sa_type, types.Date):
+        return pa.date32()
+    return pa.string()
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('Exporting to Parquet/Arrow requires pyarrow; install it with "pip install canvas-data-sdk[arrow]"')
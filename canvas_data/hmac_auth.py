@@ -43,9 +43,17 @@ class CanvasDataHMACAuth(requests.auth.AuthBase):
         self.req_date = datetime.utcnow().strftime('%a, %d %b %y %H:%M:%S GMT')
 
     def __call__(self, r):
-        # build the auth header
-        path = r.url
         logger.debug(r.headers)
+        r.headers.update(self.get_headers(r.url))
+        return r
+
+    def get_headers(self, url):
+        """
+        Returns the Authorization and Date headers for a GET request to `url` (including
+        any query string). This lets clients other than requests sign their requests.
+        """
+        # build the auth header
+        path = url
         if path.startswith(self.api_root):
             path = path[len(self.api_root):]
 
@@ -80,7 +88,7 @@ class CanvasDataHMACAuth(requests.auth.AuthBase):
         if sys.version_info >= (3, 0):
             signature = signature.decode('utf-8')
 
-        r.headers['Authorization'] = 'HMACAuth {0}:{1}'.format(self.api_key, signature)
-        r.headers['Date'] = self.req_date
-
-        return r
+        return {
+            'Authorization': 'HMACAuth {0}:{1}'.format(self.api_key, signature),
+            'Date': self.req_date,
+        }
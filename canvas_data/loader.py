@@ -0,0 +1,287 @@
+import gzip
+import logging
+import re
+from contextlib import closing
+from datetime import datetime
+
+import dateutil.parser
+from sqlalchemy import Column, MetaData, Table, exists, inspect, or_, select, text, true, types
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from .api import _iter_gzip_rows
+from .ddl_utils import _get_column, tables_from_json
+
+logger = logging.getLogger(__name__)
+
+
+class TableLoader(object):
+    """
+    Loads the data in downloaded fragment files straight into a database, using the
+    tables that `ddl_utils.tables_from_json` builds from the Canvas Data schema.
+
+    On PostgreSQL with psycopg2 or psycopg the decompressed data is streamed to the
+    server with a client-side ``COPY ... FROM STDIN``. With any other database the rows
+    are parsed, converted to the column types and inserted with `executemany` in
+    batches of `batch_size` rows.
+
+    With `merge=True`, tables that have a `merge_key` column (`id`) are loaded into a
+    temporary staging table first and then merged into the target: new rows are inserted,
+    changed rows updated and, for a full (non-partial) dump, rows that are gone deleted.
+    Rows that haven't changed aren't written at all (on MySQL the server skips them), so
+    a big table that barely changes costs little. The merge is an upsert (``INSERT ... ON
+    CONFLICT`` on PostgreSQL and SQLite, ``ON DUPLICATE KEY UPDATE`` on MySQL) when the
+    target table has a primary key or unique index on the key column, and a delete and
+    insert of the changed rows otherwise.
+
+    With `primary_keys=True` the tables it creates get a primary key on `id` (which also
+    lets merges upsert), and with `indexes=True` indexes on the columns that refer to
+    other tables (see `ddl_utils.index_ddl_from_json`). A full load of a table drops its
+    indexes first and builds them again once the data is in, which is much faster than
+    keeping them up to date row by row.
+
+    The files are local paths, or - if a `storage` is given - the names of files in that
+    `Storage`, such as the fragments `CanvasDataAPI.get_file` streamed into an `S3Storage`.
+    """
+
+    def __init__(self, engine, schema_json, batch_size=10000, merge=False, merge_key='id', primary_keys=False,
+                 indexes=False, storage=None):
+        self.engine = engine
+        self.storage = storage
+        self.schema_json = schema_json
+        self.batch_size = batch_size
+        self.merge = merge
+        self.merge_key = merge_key
+        self.tables = tables_from_json(schema_json, primary_keys=primary_keys, indexes=indexes)
+
+    def create_tables(self, table_names=None):
+        """Create the tables (all of them, or just the ones named) if they don't exist yet."""
+        tables = [t for name, t in self.tables.items() if table_names is None or name in table_names]
+        if tables:
+            tables[0].metadata.create_all(self.engine, tables=tables, checkfirst=True)
+
+    def load_table(self, table_name, files, partial=False):
+        """
+        Load the rows in a table's gzipped fragment files into the table. Unless the data is
+        `partial` (as in `artifactsByTable[table_name]['partial']`) the table is emptied first.
+        Everything happens in one transaction. Returns the number of rows loaded.
+        """
+        table = self.tables[table_name]
+        if self.merge and self.merge_key in table.columns:
+            return self._merge_table(table_name, files, partial)
+        if self.merge:
+            logger.debug("%s has no %s column, so it can't be merged; loading it instead", table_name, self.merge_key)
+
+        with self.engine.begin() as conn:
+            if not partial:
+                for index in table.indexes:
+                    index.drop(conn, checkfirst=True)
+                if self.engine.dialect.name == 'sqlite':
+                    conn.execute(table.delete())
+                else:
+                    conn.execute(text('TRUNCATE TABLE {}'.format(self._quoted_name(table))))
+
+            count = self._load(conn, table_name, table, files)
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        logger.debug("Loaded %d rows into %s", count, table_name)
+        return count
+
+    def _load(self, conn, table_name, table, files):
+        """Put the rows in the files into `table`, which has the columns of the table `table_name`."""
+        if self._can_copy(table_name):
+            return self._copy(conn, table, files)
+        return self._insert(conn, table_name, table, files)
+
+    def _merge_table(self, table_name, files, partial):
+        table = self.tables[table_name]
+        staging = staging_table(table)
+        with self.engine.begin() as conn:
+            staging.create(conn)
+            try:
+                count = self._load(conn, table_name, staging, files)
+                for statement in merge_statements(table, staging, self.engine.dialect.name, key=self.merge_key,
+                                                  partial=partial, upsert=self._has_unique_key(conn, table)):
+                    conn.execute(statement)
+            finally:
+                staging.drop(conn)
+        logger.debug("Merged %d rows into %s", count, table_name)
+        return count
+
+    def _has_unique_key(self, conn, table):
+        """Whether the table in the database has a primary key or unique constraint on just the merge key."""
+        inspector = inspect(conn)
+        key = [self.merge_key]
+        if inspector.get_pk_constraint(table.name).get('constrained_columns') == key:
+            return True
+        if any(c['column_names'] == key for c in inspector.get_unique_constraints(table.name)):
+            return True
+        return any(i['unique'] and i['column_names'] == key for i in inspector.get_indexes(table.name))
+
+    def _open(self, filename):
+        return self.storage.open_read(filename) if self.storage else open(filename, 'rb')
+
+    def _quoted_name(self, table):
+        return self.engine.dialect.identifier_preparer.format_table(table)
+
+    def _json_columns(self, table_name):
+        for artifact in self.schema_json.values():
+            if artifact['tableName'] == table_name:
+                return artifact['columns']
+        raise KeyError(table_name)
+
+    def _can_copy(self, table_name):
+        # COPY needs every column in the files to be in the table
+        json_columns = self._json_columns(table_name)
+        return (self.engine.dialect.name == 'postgresql' and
+                self.engine.dialect.driver in ('psycopg2', 'psycopg') and
+                len(self.tables[table_name].columns) == len(json_columns))
+
+    def _copy(self, conn, table, files):
+        sql = 'COPY {} FROM STDIN'.format(self._quoted_name(table))
+        cursor = conn.connection.cursor()
+        count = 0
+        try:
+            for filename in files:
+                with closing(self._open(filename)) as raw, gzip.GzipFile(fileobj=raw, mode='rb') as infile:
+                    if self.engine.dialect.driver == 'psycopg2':
+                        cursor.copy_expert(sql, infile, size=1024*1024)
+                    else:
+                        with cursor.copy(sql) as copy:
+                            for block in iter(lambda: infile.read(1024*1024), b''):
+                                copy.write(block)
+                count += max(cursor.rowcount, 0)
+        finally:
+            cursor.close()
+        return count
+
+    def _insert(self, conn, table_name, table, files):
+        # work out which positions in each row go to which column, skipping any that weren't mapped
+        columns = []
+        for i, j_col in enumerate(self._json_columns(table_name)):
+            if _get_column(table_name, j_col) is not None:
+                column = table.columns[j_col['name']]
+                columns.append((i, column.name, _converter(column.type)))
+
+        count = 0
+        batch = []
+        for filename in files:
+            with closing(self._open(filename)) as infile:
+                for row in _iter_gzip_rows(infile):
+                    batch.append(dict((name, None if row[i] is None else convert(row[i])) for i, name, convert in columns))
+                    if len(batch) >= self.batch_size:
+                        conn.execute(table.insert(), batch)
+                        count += len(batch)
+                        batch = []
+        if batch:
+            conn.execute(table.insert(), batch)
+            count += len(batch)
+        return count
+
+
+def staging_table(table):
+    """A temporary table with the same columns as `table` (but no keys), to load data into before merging it."""
+    return Table('{}_staging'.format(table.name), MetaData(),
+                 *[Column(c.name, c.type) for c in table.columns], prefixes=['TEMPORARY'])
+
+
+def merge_statements(table, staging, dialect_name, key='id', partial=True, upsert=True):
+    """
+    Returns the statements that merge the rows of `staging` into `table` on `key`. Unless
+    the data is `partial`, rows that aren't in `staging` are deleted first. With `upsert`
+    (which needs a primary key or unique index on `key`) the rows are merged with
+    `merge_statement`; otherwise the rows that changed are deleted and inserted again.
+    """
+    statements = []
+    table_key = table.c[key]
+    if not partial:
+        # a full dump has every row, so anything that isn't in it has been deleted
+        statements.append(table.delete().where(~exists().where(staging.c[key] == table_key)))
+    if upsert:
+        statements.append(merge_statement(table, staging, dialect_name, key))
+    else:
+        columns = [c.name for c in table.columns]
+        # match on the key with a plain equality, so the database can hash or merge join on it
+        same = exists().where(table_key == staging.c[key])
+        if len(columns) > 1:
+            same = same.where(_all_equal(table, staging, [c for c in columns if c != key]))
+        changed = select(staging).where(~same)
+        statements.append(table.delete().where(table_key.in_(select(changed.subquery().c[key]))))
+        statements.append(table.insert().from_select(columns, changed))
+    return statements
+
+
+def merge_statement(table, staging, dialect_name, key='id'):
+    """
+    Returns the statement that upserts the rows of `staging` into `table` on `key`, for the
+    'postgresql', 'sqlite' or 'mysql' dialect. The table needs a primary key or unique index
+    on `key`. On PostgreSQL and SQLite, rows that are already the same aren't updated.
+    """
+    columns = [c.name for c in table.columns]
+    rows = select(*[staging.c[c] for c in columns])
+    if dialect_name == 'mysql':
+        stmt = mysql.insert(table).from_select(columns, rows)
+        return stmt.on_duplicate_key_update(dict((c, stmt.inserted[c]) for c in columns if c != key))
+
+    if dialect_name == 'postgresql':
+        stmt = postgresql.insert(table).from_select(columns, rows)
+    elif dialect_name == 'sqlite':
+        # without a WHERE clause, SQLite can't tell where the SELECT ends and the ON CONFLICT starts
+        stmt = sqlite.insert(table).from_select(columns, rows.where(true()))
+    else:
+        raise ValueError("Can't upsert with the {} dialect".format(dialect_name))
+    updated = [c for c in columns if c != key]
+    if not updated:
+        return stmt.on_conflict_do_nothing(index_elements=[key])
+    return stmt.on_conflict_do_update(
+        index_elements=[key],
+        set_=dict((c, stmt.excluded[c]) for c in updated),
+        where=or_(*[table.c[c].is_distinct_from(stmt.excluded[c]) for c in updated]),
+    )
+
+
+def _all_equal(table, other, columns):
+    """A condition that's true when every one of the columns is the same (or both null) in both tables."""
+    return ~or_(*[table.c[c].is_distinct_from(other.c[c]) for c in columns])
+
+
+_ESCAPE_RE = re.compile(r'\\(.)')
+_ESCAPES = {'t': '\t', 'n': '\n', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v', '\\': '\\'}
+
+
+def _unescape(value):
+    """Undo the backslash escaping that PostgreSQL's COPY text format (and Canvas Data) uses."""
+    if '\\' not in value:
+        return value
+    return _ESCAPE_RE.sub(lambda m: _ESCAPES.get(m.group(1), m.group(1)), value)
+
+
+def _parse_boolean(value):
+    return value.lower() in ('true', 't', '1')
+
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _parse_timestamp(value):
+    for fmt in ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return dateutil.parser.parse(value)
+
+
+def _converter(sa_type):
+    """Returns a function that converts a value from a Canvas Data file to the Python type for a column."""
+    if isinstance(sa_type, types.Integer):
+        return int
+    elif isinstance(sa_type, types.Boolean):
+        return _parse_boolean
+    elif isinstance(sa_type, types.Float):
+        return float
+    elif isinstance(sa_type, types.DateTime):
+        return _parse_timestamp
+    elif isinstance(sa_type, types.Date):
+        return _parse_date
+    return _unescape
@@ -0,0 +1,132 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+MANIFEST_FILENAME = '.canvas_data_manifest.sqlite'
+
+COLUMNS = ('filename', 'dump_id', 'table_name', 'sequence', 'partial', 'size', 'md5', 'downloaded_at', 'rows')
+
+
+class DownloadManifest(object):
+    """
+    A SQLite index of the fragment files in a download directory. Each fragment's
+    filename is mapped to the dump, table and sequence it came from, along with its
+    size, MD5 checksum and - if it was validated while downloading - its row count. It's used to decide in bulk which files still need to be
+    downloaded, and to find files that are no longer needed.
+
+    One manifest can be shared by several threads, and several processes can use the
+    same manifest file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS fragments (
+                    filename TEXT PRIMARY KEY,
+                    dump_id TEXT,
+                    table_name TEXT,
+                    sequence INTEGER,
+                    partial INTEGER,
+                    size INTEGER,
+                    md5 TEXT,
+                    downloaded_at REAL,
+                    rows INTEGER
+                )''')
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(fragments)')]
+            if 'rows' not in columns:
+                # a manifest from before row counts were recorded
+                self._conn.execute('ALTER TABLE fragments ADD COLUMN rows INTEGER')
+
+    @classmethod
+    def for_directory(cls, directory):
+        """Open (or create) the manifest for a download directory."""
+        return cls(os.path.join(directory, MANIFEST_FILENAME))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def filenames(self):
+        """Returns the set of filenames recorded in the manifest."""
+        with self._lock:
+            return set(row[0] for row in self._conn.execute('SELECT filename FROM fragments'))
+
+    def get(self, filename):
+        """Returns the manifest entry for a filename as a dict, or None."""
+        with self._lock:
+            row = self._conn.execute('SELECT {} FROM fragments WHERE filename = ?'.format(', '.join(COLUMNS)),
+                                     (filename,)).fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def entries(self):
+        """Returns all of the manifest entries as a list of dicts."""
+        with self._lock:
+            rows = self._conn.execute('SELECT {} FROM fragments'.format(', '.join(COLUMNS))).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def add(self, filename, dump_id=None, table_name=None, sequence=None, partial=None, size=None, md5=None,
+            rows=None):
+        """Record (or replace) the entry for a downloaded file."""
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO fragments ({}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'.format(', '.join(COLUMNS)),
+                (filename, dump_id, table_name, sequence, None if partial is None else int(partial), size, md5,
+                 time.time(), rows)
+            )
+
+    def annotate(self, entries):
+        """
+        Fill in the dump, table, sequence and partial flag of existing entries that don't have
+        them yet. `entries` is a list of `(filename, dump_id, table_name, sequence, partial)`.
+        """
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.executemany('''
+                UPDATE fragments SET dump_id = COALESCE(dump_id, ?), table_name = COALESCE(table_name, ?),
+                                     sequence = COALESCE(sequence, ?), partial = COALESCE(partial, ?)
+                WHERE filename = ?''',
+                [(dump_id, table_name, sequence, None if partial is None else int(partial), filename)
+                 for filename, dump_id, table_name, sequence, partial in entries])
+            self._conn.execute('COMMIT')
+
+    def row_counts(self, sequence=None):
+        """
+        Returns the total number of rows per table, for reconciling against a load; only files
+        with a recorded row count are included. Limit it to one dump with `sequence`.
+        """
+        query = 'SELECT table_name, SUM(rows) FROM fragments WHERE rows IS NOT NULL'
+        params = ()
+        if sequence is not None:
+            query += ' AND sequence = ?'
+            params = (sequence,)
+        with self._lock:
+            rows = self._conn.execute(query + ' GROUP BY table_name', params).fetchall()
+        return dict(rows)
+
+    def remove(self, filenames):
+        """Remove the entries for some filenames."""
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.executemany('DELETE FROM fragments WHERE filename = ?', [(f,) for f in filenames])
+            self._conn.execute('COMMIT')
+
+    def obsolete(self):
+        """
+        Returns the entries for fragments that aren't part of the latest full snapshot of
+        their table: any fragment with a lower sequence than the table's newest non-partial
+        dump. Entries without a table or sequence are never considered obsolete.
+        """
+        with self._lock:
+            rows = self._conn.execute('''
+                SELECT {} FROM fragments f
+                JOIN (SELECT table_name, MAX(sequence) AS full_sequence FROM fragments
+                      WHERE partial = 0 GROUP BY table_name) latest
+                ON f.table_name = latest.table_name
+                WHERE f.sequence < latest.full_sequence
+            '''.format(', '.join('f.{}'.format(c) for c in COLUMNS))).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
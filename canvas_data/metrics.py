@@ -0,0 +1,151 @@
+import logging
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics(object):
+    """
+    The interface `CanvasDataAPI` reports its metrics through. This base class throws
+    everything away; subclass it and override `timing` and `increment` to send the
+    measurements somewhere. Tags are a dict of short string values (such as the table name)
+    that further describe a measurement.
+
+    The metrics reported are:
+
+    - `request.latency` (timing): time until the response headers arrived, for each
+      attempt at a request, tagged with `kind` (`api` for the HMAC-signed API calls,
+      `file` for file downloads)
+    - `request.retries` (counter): requests that were retried
+    - `download.time` (timing) and `download.bytes` (counter): per downloaded file
+    - `download.rows` (counter): rows in the downloaded files, when they're validated
+    - `unpack.time` (timing), `unpack.bytes_in` and `unpack.bytes_out` (counters): the
+      decompression of a set of fragments, tagged with `table`
+    - `table.time` (timing): the whole of `get_data_for_table`, tagged with `table`
+    """
+
+    def timing(self, name, seconds, tags=None):
+        """Record how long something took."""
+        pass
+
+    def increment(self, name, value=1, tags=None):
+        """Add to a counter."""
+        pass
+
+    @contextmanager
+    def timer(self, name, tags=None):
+        """Time the body of a `with` block."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timing(name, time.time() - start, tags)
+
+
+class MetricsCollector(Metrics):
+    """
+    Keeps count, total, minimum and maximum of every metric in memory, per combination of
+    name and tags. It's thread-safe, so one collector can be shared by all the download
+    threads. `snapshot` returns the numbers, for instance to expose them to Prometheus;
+    `summary` formats them for people.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._counters = {}
+
+    def timing(self, name, seconds, tags=None):
+        key = _key(name, tags)
+        with self._lock:
+            stats = self._timings.get(key)
+            if stats is None:
+                self._timings[key] = {'count': 1, 'total': seconds, 'min': seconds, 'max': seconds}
+            else:
+                stats['count'] += 1
+                stats['total'] += seconds
+                stats['min'] = min(stats['min'], seconds)
+                stats['max'] = max(stats['max'], seconds)
+
+    def increment(self, name, value=1, tags=None):
+        key = _key(name, tags)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self):
+        """
+        Returns a dict with `timings` and `counters`, each a list of dicts with the metric's
+        `name`, `tags` and its statistics (`count`/`total`/`min`/`max` for timings, `value`
+        for counters).
+        """
+        with self._lock:
+            timings = [dict(stats, name=name, tags=dict(tags)) for (name, tags), stats in sorted(self._timings.items())]
+            counters = [{'name': name, 'tags': dict(tags), 'value': value}
+                        for (name, tags), value in sorted(self._counters.items())]
+        return {'timings': timings, 'counters': counters}
+
+    def summary(self):
+        """A human-readable summary of everything that's been recorded."""
+        snapshot = self.snapshot()
+        lines = []
+        for t in snapshot['timings']:
+            lines.append('{:<40} count={} total={:.3f}s mean={:.3f}s max={:.3f}s'.format(
+                _label(t['name'], t['tags']), t['count'], t['total'], t['total'] / t['count'], t['max']))
+        for c in snapshot['counters']:
+            lines.append('{:<40} {}'.format(_label(c['name'], c['tags']), c['value']))
+
+        # throughput, where we have both the bytes and the time they took
+        timings = dict(((t['name'], tuple(sorted(t['tags'].items()))), t) for t in snapshot['timings'])
+        for c in snapshot['counters']:
+            for suffix in ('.bytes', '.bytes_out'):
+                if not c['name'].endswith(suffix):
+                    continue
+                t = timings.get((c['name'][:-len(suffix)] + '.time', tuple(sorted(c['tags'].items()))))
+                if t and t['total'] > 0:
+                    lines.append('{:<40} {:.2f} MB/s'.format(
+                        _label(c['name'][:-len(suffix)] + '.throughput', c['tags']), c['value'] / t['total'] / 1e6))
+        return '\n'.join(lines)
+
+
+class StatsdMetrics(Metrics):
+    """
+    Sends metrics to a statsd server over UDP, as `<prefix>.<name>`. Tags are appended to
+    the name (`download.bytes` with `{'table': 'user_dim'}` becomes `download.bytes.user_dim`),
+    since plain statsd doesn't support them. Sending never blocks and errors are only logged.
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='canvas_data'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def timing(self, name, seconds, tags=None):
+        self._send('{}:{:.3f}|ms'.format(self._name(name, tags), seconds * 1000))
+
+    def increment(self, name, value=1, tags=None):
+        self._send('{}:{}|c'.format(self._name(name, tags), value))
+
+    def _name(self, name, tags):
+        parts = [self.prefix, name] if self.prefix else [name]
+        parts.extend(str(v).replace('.', '_') for k, v in sorted((tags or {}).items()))
+        return '.'.join(parts)
+
+    def _send(self, data):
+        try:
+            self._socket.sendto(data.encode('utf-8'), self.address)
+        except (IOError, OSError) as e:
+            logger.debug("Couldn't send metric %s: %s", data, e)
+
+
+def _key(name, tags):
+    return name, tuple(sorted((tags or {}).items()))
+
+
+def _label(name, tags):
+    if not tags:
+        return name
+    return '{}[{}]'.format(name, ','.join('{}={}'.format(k, v) for k, v in sorted(tags.items())))
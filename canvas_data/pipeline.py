@@ -0,0 +1,121 @@
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+logger = logging.getLogger(__name__)
+
+# how often a blocked stage checks whether the pipeline has been stopped
+_POLL_INTERVAL = 0.1
+
+_DONE = object()
+
+
+class Pipeline(object):
+    """
+    Runs items through a series of stages at the same time: while one item is in the second
+    stage, the next can already be in the first. Each stage is a `(function, workers)` pair;
+    the function takes the previous stage's result (or an item, for the first stage) and its
+    return value is passed on. A stage runs in `workers` threads.
+
+    Between stages there are queues that hold at most `queue_size` results. When a stage
+    falls behind, the queue in front of it fills up and the stages before it wait, so a
+    fast stage can't run arbitrarily far ahead of a slow one.
+
+    If any stage raises an exception, the whole pipeline stops and the exception is
+    re-raised from `run`.
+    """
+
+    def __init__(self, stages, queue_size=2):
+        self.stages = [(func, max(1, workers)) for func, workers in stages]
+        self.queue_size = queue_size
+
+    def run(self, items):
+        """Yields the results of the last stage, as they come, in the calling thread."""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        output = queue.Queue()
+        stop = threading.Event()
+        errors = []
+        lock = threading.Lock()
+        remaining = [workers for func, workers in self.stages]
+
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=_POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    pass
+            return _DONE
+
+        def fail(e):
+            with lock:
+                errors.append(e)
+            stop.set()
+
+        def feed():
+            try:
+                for item in items:
+                    if not put(queues[0], item):
+                        return
+            except Exception as e:
+                fail(e)
+                return
+            for _ in range(self.stages[0][1]):
+                put(queues[0], _DONE)
+
+        def work(i, func):
+            last = i == len(self.stages) - 1
+            while True:
+                item = get(queues[i])
+                if item is _DONE:
+                    break
+                try:
+                    result = func(item)
+                except Exception as e:
+                    logger.debug("Pipeline stage %d failed", i, exc_info=True)
+                    fail(e)
+                    break
+                if not put(output if last else queues[i + 1], result):
+                    break
+            with lock:
+                remaining[i] -= 1
+                finished = remaining[i] == 0
+            if finished:
+                # this stage is done, so the next one is too once it has caught up
+                if last:
+                    output.put(_DONE)
+                else:
+                    for _ in range(self.stages[i + 1][1]):
+                        put(queues[i + 1], _DONE)
+
+        threads = [threading.Thread(target=feed)]
+        for i, (func, workers) in enumerate(self.stages):
+            threads.extend(threading.Thread(target=work, args=(i, func)) for _ in range(workers))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            while True:
+                result = get(output)
+                if result is _DONE:
+                    break
+                yield result
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
@@ -0,0 +1,40 @@
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    A thread-safe token bucket. Tokens are added at `rate` per second, up to `capacity`
+    (which defaults to one second's worth). `consume` blocks until the requested number of
+    tokens is available; a request for more than `capacity` tokens is allowed, and makes
+    later callers wait until the bucket has refilled.
+
+    One bucket can be shared by any number of threads (and `CanvasDataAPI` instances) to
+    cap their combined rate.
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens):
+        """Take tokens from the bucket, going into debt if needed; returns how long to wait."""
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    def consume(self, tokens=1):
+        """Wait until `tokens` tokens are available and take them."""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
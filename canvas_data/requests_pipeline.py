@@ -0,0 +1,114 @@
+import gzip
+import logging
+import os
+import shutil
+from collections import OrderedDict
+
+from .compat import replace as _replace
+from .exceptions import CanvasDataAPIError
+
+logger = logging.getLogger(__name__)
+
+STAGING_DIRECTORY = '.staging'
+DONE_DIRECTORY = '.done'
+UNKNOWN_DAY = 'unknown'
+
+
+class RequestsPartitioner(object):
+    """
+    Splits the rows of the `requests` table into one directory per day, based on the date
+    part of the timestamp column. Each dump that contributes rows to a day gets its own file
+    in that day's directory, so the output for one day looks like::
+
+        <output_directory>/2017-05-01/<sequence>.txt
+
+    A dump is processed into a staging directory first and only moved into place once all
+    of its fragments are done; a marker then records that the dump has been processed, so
+    running it again does nothing. A full (non-partial) dump replaces everything that came
+    before it. Rows are streamed, and at most `max_open_files` output files are open at once,
+    so memory use doesn't depend on the size of the table.
+    """
+
+    def __init__(self, output_directory, timestamp_column_index, max_open_files=32):
+        self.output_directory = output_directory
+        self.timestamp_column_index = timestamp_column_index
+        self.max_open_files = max_open_files
+
+    def is_processed(self, sequence):
+        return os.path.isfile(os.path.join(self.output_directory, DONE_DIRECTORY, str(sequence)))
+
+    def days(self):
+        """Returns the days that have data, in order."""
+        if not os.path.isdir(self.output_directory):
+            return []
+        return sorted(d for d in os.listdir(self.output_directory) if not d.startswith('.'))
+
+    def process_dump(self, sequence, files, partial=True, timestamp_column_index=None):
+        """
+        Partition the rows in one dump's gzipped `requests` fragment files by day. Returns the
+        days the dump had rows for, or None if the dump had already been processed. Pass
+        `timestamp_column_index` for a dump whose rows have a different layout.
+        """
+        if self.is_processed(sequence):
+            logger.debug("Not processing dump %s again; it's already been done.", sequence)
+            return None
+
+        staging_directory = os.path.join(self.output_directory, STAGING_DIRECTORY, str(sequence))
+        if os.path.isdir(staging_directory):
+            # left over from an interrupted run
+            shutil.rmtree(staging_directory)
+        os.makedirs(staging_directory)
+
+        if timestamp_column_index is None:
+            timestamp_column_index = self.timestamp_column_index
+        days = self._partition(files, staging_directory, timestamp_column_index)
+        self._commit(sequence, staging_directory, days, partial)
+        return sorted(days)
+
+    def _partition(self, files, staging_directory, index):
+        open_files = OrderedDict()
+        days = set()
+        try:
+            for filename in files:
+                with gzip.open(filename, 'rb') as infile:
+                    for line in infile:
+                        fields = line.split(b'\t', index + 1)
+                        if len(fields) <= index:
+                            raise CanvasDataAPIError('Malformed row in {}: {!r}'.format(filename, line[:200]))
+                        timestamp = fields[index]
+                        day = UNKNOWN_DAY if timestamp.startswith(b'\\N') else timestamp[:10].decode('ascii')
+
+                        outfile = open_files.pop(day, None)
+                        if outfile is None:
+                            if len(open_files) >= self.max_open_files:
+                                # close the least recently used output file
+                                open_files.popitem(last=False)[1].close()
+                            outfile = open(os.path.join(staging_directory, '{}.txt'.format(day)), 'ab')
+                            days.add(day)
+                        open_files[day] = outfile
+                        outfile.write(line)
+        finally:
+            for outfile in open_files.values():
+                outfile.close()
+        return days
+
+    def _commit(self, sequence, staging_directory, days, partial):
+        done_directory = os.path.join(self.output_directory, DONE_DIRECTORY)
+        if not partial:
+            # a full dump has every row, so nothing from earlier dumps is needed
+            for day in self.days():
+                shutil.rmtree(os.path.join(self.output_directory, day))
+            if os.path.isdir(done_directory):
+                shutil.rmtree(done_directory)
+
+        for day in days:
+            day_directory = os.path.join(self.output_directory, day)
+            if not os.path.isdir(day_directory):
+                os.makedirs(day_directory)
+            _replace(os.path.join(staging_directory, '{}.txt'.format(day)),
+                     os.path.join(day_directory, '{}.txt'.format(sequence)))
+
+        if not os.path.isdir(done_directory):
+            os.makedirs(done_directory)
+        open(os.path.join(done_directory, str(sequence)), 'w').close()
+        shutil.rmtree(staging_directory)
@@ -4,9 +4,16 @@ import yaml
 import click
 import dateutil.parser
 from dateutil import tz
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 
-from canvas_data.api import CanvasDataAPI
-from canvas_data.ddl_utils import ddl_from_json
+from canvas_data.api import CanvasDataAPI, _files_from_file_urls
+from canvas_data.ddl_utils import ddl_from_json, index_ddl_from_json, migration_ddl, tables_from_json
+from canvas_data.hmac_auth import API_ROOT
+from canvas_data.loader import TableLoader, merge_statements, staging_table
+from canvas_data.metrics import MetricsCollector
+
+DIALECTS = {'postgresql': postgresql, 'mysql': mysql, 'sqlite': sqlite}
 
 
 class HyphenUnderscoreAliasedGroup(click.Group):
@@ -27,8 +34,14 @@ class HyphenUnderscoreAliasedGroup(click.Group):
 @click.option('-c', '--config', type=click.File('r'), envvar='CANVAS_DATA_CONFIG')
 @click.option('--api-key', envvar='CANVAS_DATA_API_KEY')
 @click.option('--api-secret', envvar='CANVAS_DATA_API_SECRET')
+@click.option('--cache-dir', envvar='CANVAS_DATA_CACHE_DIR', type=click.Path(), help='cache API responses in this directory')
+@click.option('--max-requests-per-second', type=float, help='limit the rate of requests to the API and file store')
+@click.option('--max-bytes-per-second', type=int, help='limit the download bandwidth')
+@click.option('--api-root', envvar='CANVAS_DATA_API_ROOT', help='use a different API server (for testing)')
+@click.option('--validate', is_flag=True, default=False, help='check downloaded files for corruption as they arrive')
+@click.option('--stats', is_flag=True, default=False, help='print timing and throughput statistics when done')
 @click.pass_context
-def cli(ctx, config, api_key, api_secret):
+def cli(ctx, config, api_key, api_secret, cache_dir, max_requests_per_second, max_bytes_per_second, api_root, validate, stats):
     """A command-line tool to work with Canvas Data. Command-specific help
     is available at: canvas-data COMMAND --help"""
     # if a config file was specified, read settings from that
@@ -42,6 +55,40 @@ def cli(ctx, config, api_key, api_secret):
         ctx.obj['api_key'] = api_key
     if api_secret:
         ctx.obj['api_secret'] = api_secret
+    if cache_dir:
+        ctx.obj['cache_dir'] = cache_dir
+    if max_requests_per_second:
+        ctx.obj['max_requests_per_second'] = max_requests_per_second
+    if max_bytes_per_second:
+        ctx.obj['max_bytes_per_second'] = max_bytes_per_second
+    if api_root:
+        ctx.obj['api_root'] = api_root
+    if validate:
+        ctx.obj['validate'] = validate
+
+    if stats or ctx.obj.get('stats'):
+        # one collector for every CanvasDataAPI the command creates
+        metrics = MetricsCollector()
+        ctx.obj['metrics'] = metrics
+        ctx.call_on_close(lambda: click.echo(metrics.summary() or 'No statistics were recorded.', err=True))
+
+
+def _get_api(ctx, max_workers=1):
+    """
+    Returns a CanvasDataAPI configured from the command line options and config file, with a
+    connection pool big enough for `max_workers` concurrent downloads.
+    """
+    return CanvasDataAPI(
+        api_key=ctx.obj.get('api_key'),
+        api_secret=ctx.obj.get('api_secret'),
+        cache_dir=ctx.obj.get('cache_dir'),
+        max_requests_per_second=ctx.obj.get('max_requests_per_second'),
+        max_bytes_per_second=ctx.obj.get('max_bytes_per_second'),
+        metrics=ctx.obj.get('metrics'),
+        api_root=ctx.obj.get('api_root', API_ROOT),
+        validate_downloads=ctx.obj.get('validate', False),
+        pool_maxsize=max(10, max_workers)
+    )
 
 
 @cli.command(name='get-schema')
@@ -49,10 +96,7 @@ def cli(ctx, config, api_key, api_secret):
 @click.pass_context
 def get_schema(ctx, version):
     """Gets a particular version of the Canvas Data schema (latest by default) and outputs as JSON"""
-    cd = CanvasDataAPI(
-        api_key=ctx.obj.get('api_key'),
-        api_secret=ctx.obj.get('api_secret')
-    )
+    cd = _get_api(ctx)
 
     schema = cd.get_schema(version, key_on_tablenames=True)
     click.echo(json.dumps(schema, sort_keys=True, indent=4))
@@ -60,32 +104,77 @@ def get_schema(ctx, version):
 
 @cli.command(name='get-ddl')
 @click.option('--version', default='latest')
+@click.option('--phase', default='load', type=click.Choice(['pre-load', 'load', 'post-load', 'all']),
+              help='print the DDL to run before reloading existing tables (dropping the indexes), to set up '
+                   'the tables (dropping and creating them), after loading the data (creating the indexes), '
+                   'or to set up the tables and then index them (default load)')
+@click.option('--primary-keys', is_flag=True, default=False, help='give tables with an id column a primary key on it')
+@click.option('--unlogged', is_flag=True, default=False, help='create UNLOGGED tables, for faster loads (PostgreSQL only)')
+@click.option('--dialect', type=click.Choice(sorted(DIALECTS)), default=None, help='write the SQL for this database')
 @click.pass_context
-def get_ddl(ctx, version):
+def get_ddl(ctx, version, phase, primary_keys, unlogged, dialect):
     """Gets DDL for a particular version of the Canvas Data schema (latest by default)"""
-    cd = CanvasDataAPI(
-        api_key=ctx.obj.get('api_key'),
-        api_secret=ctx.obj.get('api_secret')
-    )
+    cd = _get_api(ctx)
 
     json_schema = cd.get_schema(version, key_on_tablenames=True)
-    create_ddl, drop_ddl = ddl_from_json(json_schema)
-    for t in drop_ddl:
-        click.echo('{};'.format(t))
-    for t in create_ddl:
-        click.echo('{};'.format(t))
+    dialect = DIALECTS[dialect].dialect() if dialect else None
+    create_index_ddl, drop_index_ddl = index_ddl_from_json(json_schema, dialect=dialect)
+    if phase == 'pre-load':
+        for t in drop_index_ddl:
+            click.echo('{};'.format(t))
+    if phase in ('load', 'all'):
+        try:
+            create_ddl, drop_ddl = ddl_from_json(json_schema, primary_keys=primary_keys, unlogged=unlogged,
+                                                 dialect=dialect)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        for t in drop_ddl:
+            click.echo('{};'.format(t))
+        for t in create_ddl:
+            click.echo('{};'.format(t))
+    if phase in ('post-load', 'all'):
+        if phase == 'all':
+            click.echo('-- after loading the data:')
+        for t in create_index_ddl:
+            click.echo('{};'.format(t))
+
+
+@cli.command(name='migrate-ddl')
+@click.option('--from', 'from_version', required=True, help='the schema version the tables are at now')
+@click.option('--to', 'to_version', default='latest', help='the schema version to migrate them to (latest by default)')
+@click.option('--dialect', type=click.Choice(sorted(DIALECTS)), default=None, help='write the SQL for this database')
+@click.option('--primary-keys', is_flag=True, default=False, help='the tables were created with get-ddl --primary-keys')
+@click.option('--unlogged', is_flag=True, default=False, help='the tables were created with get-ddl --unlogged')
+@click.pass_context
+def migrate_ddl(ctx, from_version, to_version, dialect, primary_keys, unlogged):
+    """Gets the DDL that migrates the tables from one version of the Canvas Data schema to another"""
+    cd = _get_api(ctx)
+
+    old_schema = cd.get_schema(from_version, key_on_tablenames=True)
+    new_schema = cd.get_schema(to_version, key_on_tablenames=True)
+    try:
+        ddl, reload_tables = migration_ddl(old_schema, new_schema,
+                                           dialect=DIALECTS[dialect].dialect() if dialect else None,
+                                           primary_keys=primary_keys, unlogged=unlogged)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    for t in ddl:
+        click.echo('{};'.format(str(t).strip()))
+    if reload_tables:
+        click.echo('-- tables that need their data reloaded: {}'.format(', '.join(reload_tables)))
 
 
 @cli.command(name='list-dumps')
+@click.option('--all', 'all_dumps', is_flag=True, default=False, help='list the whole dump history, oldest first, instead of the latest page')
 @click.pass_context
-def list_dumps(ctx):
+def list_dumps(ctx, all_dumps):
     """Lists available dumps"""
-    cd = CanvasDataAPI(
-        api_key=ctx.obj.get('api_key'),
-        api_secret=ctx.obj.get('api_secret')
-    )
+    cd = _get_api(ctx)
 
-    dumps = cd.get_dumps()
+    if all_dumps:
+        dumps = cd.iter_dumps()
+    else:
+        dumps = cd.get_dumps()
     for d in dumps:
         create_date = dateutil.parser.parse(d['createdAt'])
         localtz = tz.tzlocal()
@@ -102,48 +191,101 @@ def list_dumps(ctx):
 @click.option('--download-dir', default=None, type=click.Path(), help='store downloaded files in this directory')
 @click.option('--table', default=None, help='(optional) only get the files for a particular table')
 @click.option('--force', is_flag=True, default=False, help='re-download files even if they already exist (default False)')
+@click.option('--parallel', default=1, type=click.IntRange(min=1), help='number of files to download at the same time (default 1)')
 @click.pass_context
-def get_dump_files(ctx, dump_id, download_dir, table, force):
+def get_dump_files(ctx, dump_id, download_dir, table, force, parallel):
     """Downloads the Canvas Data files for a particular dump. Can be optionally limited to a single table."""
     if download_dir:
         ctx.obj['download_dir'] = download_dir
     if table:
         ctx.obj['table'] = table
-    cd = CanvasDataAPI(
-        api_key=ctx.obj.get('api_key'),
-        api_secret=ctx.obj.get('api_secret')
-    )
+    cd = _get_api(ctx, max_workers=parallel)
 
     if dump_id is 'latest':
         dump_id = cd.get_latest_regular_dump()
 
     # first, get the dump details so we can extract the list of fragment files to download
-    dump_files = []
     dump_details = cd.get_file_urls(dump_id=dump_id)
-    if ctx.obj.get('table'):
-        dump_files.extend(dump_details['artifactsByTable'][ctx.obj['table']]['files'])
-    else:
-        for k, v in dump_details['artifactsByTable'].items():
-            if k == 'requests':
-                continue
-            dump_files.extend(v['files'])
+    # the requests table is only downloaded when it's asked for
+    dump_files = _files_from_file_urls(dump_details, table_name=ctx.obj.get('table'),
+                                       include_requests=bool(ctx.obj.get('table')))
 
-    filenames = []
     progress_label = '{: <23}'.format('Downloading {} files'.format(len(dump_files)))
-    with click.progressbar(dump_files, label=progress_label) as file_list:
-        for f in file_list:
-            filenames.append(cd.get_file(file=f, download_directory=ctx.obj['download_dir'], force=force))
+    with click.progressbar(length=len(dump_files), label=progress_label) as bar:
+        cd.get_files(dump_files, download_directory=ctx.obj['download_dir'], force=force,
+                     max_workers=parallel, callback=lambda f: bar.update(1))
     click.echo('Done.')
 
 
+@cli.command(name='sync')
+@click.option('--download-dir', default=None, type=click.Path(), help='store downloaded files in this directory')
+@click.option('--include-requests', is_flag=True, default=False, help='also sync the requests table (default False)')
+@click.option('--no-delete', is_flag=True, default=False, help='don\'t delete files that are no longer part of the snapshot')
+@click.option('--parallel', default=1, type=click.IntRange(min=1), help='number of files to download at the same time (default 1)')
+@click.pass_context
+def sync(ctx, download_dir, include_requests, no_delete, parallel):
+    """
+    Brings the download directory up to date with the current complete snapshot of the data:
+    downloads new files and deletes files that are no longer needed.
+    """
+    if download_dir:
+        ctx.obj['download_dir'] = download_dir
+    cd = _get_api(ctx, max_workers=parallel)
+
+    plan = cd.plan_sync(download_directory=ctx.obj['download_dir'], include_requests=include_requests)
+
+    progress_label = '{: <23}'.format('Downloading {} files'.format(len(plan['download'])))
+    with click.progressbar(length=len(plan['download']), label=progress_label) as bar:
+        result = cd.sync(download_directory=ctx.obj['download_dir'], delete=not no_delete, max_workers=parallel,
+                         callback=lambda f: bar.update(1), plan=plan)
+    click.echo('Downloaded {} files, deleted {} files.'.format(len(result['downloaded']), len(result['deleted'])))
+
+
+@cli.command(name='plan-backfill')
+@click.option('-t', '--table', required=True, help='the table to plan a backfill for')
+@click.option('--measure', is_flag=True, default=False, help='look up the size of every file to report the bytes saved')
+@click.option('--download', is_flag=True, default=False, help='download the planned files')
+@click.option('--download-dir', default=None, type=click.Path(), help='store downloaded files in this directory')
+@click.option('--force', is_flag=True, default=False, help='re-download files even if they already exist (default False)')
+@click.option('--parallel', default=1, type=click.IntRange(min=1), help='number of files to download at the same time (default 1)')
+@click.pass_context
+def plan_backfill(ctx, table, measure, download, download_dir, force, parallel):
+    """
+    Works out the smallest set of files needed to rebuild a table from its history (its latest
+    full dump plus the partial dumps after it), and optionally downloads them.
+    """
+    if download_dir:
+        ctx.obj['download_dir'] = download_dir
+    cd = _get_api(ctx, max_workers=parallel)
+
+    plan = cd.plan_table_backfill(table, measure=measure)
+    for d in plan['dumps']:
+        click.echo('sequence: {}\tpartial: {}\tid: {}'.format(d['sequence'], d.get('partial'), d['dumpId']))
+    click.echo('{} of {} files needed; {} of {} bytes, saving {} bytes.'.format(
+        len(plan['files']), len(plan['files']) + len(plan['skipped']),
+        plan['planned_bytes'], plan['total_bytes'], plan['saved_bytes']))
+
+    if download:
+        progress_label = '{: <23}'.format('Downloading {} files'.format(len(plan['files'])))
+        with click.progressbar(length=len(plan['files']), label=progress_label) as bar:
+            cd.get_files(plan['files'], download_directory=ctx.obj['download_dir'], force=force,
+                         max_workers=parallel, callback=lambda f: bar.update(1))
+        click.echo('Done.')
+
+
 @cli.command(name='unpack-dump-files')
 @click.option('--dump-id', default='latest', help='get files for this dump (defaults to the latest dump)')
 @click.option('--download-dir', default=None, type=click.Path(), help='store downloaded files in this directory')
 @click.option('--data-dir', default=None, type=click.Path(), help='store unpacked files in this directory')
 @click.option('-t', '--table', default=None, help='(optional) only get the files for a particular table')
 @click.option('--force', is_flag=True, default=False, help='re-download/re-unpack files even if they already exist (default False)')
+@click.option('--parallel', default=1, type=click.IntRange(min=1), help='number of files to download at the same time (default 1)')
+@click.option('-j', '--jobs', default=1, type=click.IntRange(min=1), help='number of processes to decompress files with (default 1)')
+@click.option('--per-fragment', is_flag=True, default=False, help='unpack each downloaded file separately instead of concatenating them per table')
+@click.option('--pipeline', is_flag=True, default=False, help='unpack each table as soon as it\'s downloaded, while the next ones download')
+@click.option('--merge', is_flag=True, default=False, help='make the reload script merge tables with an id column instead of reloading them')
 @click.pass_context
-def unpack_dump_files(ctx, dump_id, download_dir, data_dir, table, force):
+def unpack_dump_files(ctx, dump_id, download_dir, data_dir, table, force, parallel, jobs, per_fragment, pipeline, merge):
     """
     Downloads, uncompresses and re-assembles the Canvas Data files for a dump. Can be
     optionally limited to a single table.
@@ -154,16 +296,15 @@ def unpack_dump_files(ctx, dump_id, download_dir, data_dir, table, force):
         ctx.obj['data_dir'] = data_dir
     if table:
         ctx.obj['table'] = table
-    cd = CanvasDataAPI(
-        api_key=ctx.obj.get('api_key'),
-        api_secret=ctx.obj.get('api_secret')
-    )
+    cd = _get_api(ctx, max_workers=parallel)
 
     if dump_id is 'latest':
         dump_id = cd.get_latest_regular_dump()
 
-    # first make sure all of the files are downloaded
-    ctx.invoke(get_dump_files, dump_id=dump_id, download_dir=ctx.obj['download_dir'], table=ctx.obj.get('table'), force=force)
+    if not pipeline:
+        # first make sure all of the files are downloaded
+        ctx.invoke(get_dump_files, dump_id=dump_id, download_dir=ctx.obj['download_dir'], table=ctx.obj.get('table'), force=force,
+                   parallel=parallel)
 
     dump_details = cd.get_file_urls(dump_id=dump_id)
     sequence = dump_details['sequence']
@@ -175,32 +316,234 @@ def unpack_dump_files(ctx, dump_id, download_dir, data_dir, table, force):
         table_names.extend(dump_details['artifactsByTable'].keys())
         table_names.remove('requests')
 
-    data_file_names = []
+    data_file_names = {}
     progress_label = '{: <23}'.format('Unpacking {} tables'.format(len(table_names)))
 
     # store the data files in dump-specific subdirectory named after the sequence
     dump_data_dir = os.path.join(ctx.obj['data_dir'], str(sequence))
 
-    with click.progressbar(table_names, label=progress_label) as tnames:
-        for t in tnames:
-            data_file_names.append(cd.get_data_for_table(table_name=t,
-                                                         dump_id=dump_id,
-                                                         download_directory=ctx.obj['download_dir'],
-                                                         data_directory=dump_data_dir,
-                                                         force=force))
+    if pipeline:
+        def unpack(t, files, partial):
+            if per_fragment:
+                return cd.unpack_fragments(files, os.path.join(dump_data_dir, t), jobs=jobs, force=force, table_name=t)
+            if not os.path.isdir(dump_data_dir):
+                os.makedirs(dump_data_dir)
+            return [cd.unpack_files(files, os.path.join(dump_data_dir, '{}.txt'.format(t)), jobs=jobs, table_name=t)]
+
+        # like get_data_for_table, leave tables that were already unpacked alone (unpack_fragments skips fragments itself)
+        pending = []
+        for t in table_names:
+            outfilename = os.path.join(dump_data_dir, '{}.txt'.format(t))
+            if not per_fragment and not force and os.path.isfile(outfilename):
+                data_file_names[t] = [outfilename]
+            else:
+                pending.append(t)
+
+        with click.progressbar(length=len(table_names), label=progress_label) as bar:
+            bar.update(len(table_names) - len(pending))
+            for t, data_files in cd.process_dump_tables(unpack, dump_id=dump_id, table_names=pending,
+                                                        download_directory=ctx.obj['download_dir'], force=force,
+                                                        max_workers=parallel):
+                data_file_names[t] = data_files
+                bar.update(1)
+    else:
+        with click.progressbar(table_names, label=progress_label) as tnames:
+            for t in tnames:
+                data_files = cd.get_data_for_table(table_name=t,
+                                                   dump_id=dump_id,
+                                                   download_directory=ctx.obj['download_dir'],
+                                                   data_directory=dump_data_dir,
+                                                   force=force,
+                                                   jobs=jobs,
+                                                   per_fragment=per_fragment)
+                data_file_names[t] = data_files if per_fragment else [data_files]
 
     if ctx.obj.get('table'):
         reload_script = 'reload_{}.sql'.format(ctx.obj['table'])
     else:
         reload_script = 'reload_all.sql'
+    tables = tables_from_json(cd.get_schema(dump_details['schemaVersion'], key_on_tablenames=True)) if merge else {}
     with open(os.path.join(dump_data_dir, reload_script), 'w') as sqlfile:
-        for df in data_file_names:
-            abs_df = os.path.abspath(df)
-            df_path, df_file = os.path.split(df)
-            table_name, ext = df_file.split('.')
-            if not dump_details['artifactsByTable'][table_name]['partial']:
+        for table_name in table_names:
+            partial = dump_details['artifactsByTable'][table_name]['partial']
+            if table_name in tables and 'id' in tables[table_name].columns:
+                _write_merge_script(sqlfile, tables[table_name], data_file_names[table_name], partial)
+                continue
+            if not partial:
                 # not a partial dump for this table - truncate the table first
                 sqlfile.write('TRUNCATE TABLE {};\n'.format(table_name))
-            sqlfile.write("COPY {} FROM '{}';\n".format(table_name, abs_df))
+            for df in data_file_names[table_name]:
+                abs_df = os.path.abspath(df)
+                sqlfile.write("COPY {} FROM '{}';\n".format(table_name, abs_df))
+
+    click.echo('Done.')
+
+
+def _write_merge_script(sqlfile, table, data_files, partial):
+    """
+    Write the PostgreSQL statements that copy a table's data files into a staging table and
+    merge it into the table by id. The database can't be checked for a unique index on id
+    here, so changed rows are deleted and inserted again rather than upserted.
+    """
+    staging = staging_table(table)
+    sqlfile.write('CREATE TEMPORARY TABLE {} (LIKE {} INCLUDING DEFAULTS);\n'.format(staging.name, table.name))
+    for df in data_files:
+        sqlfile.write("COPY {} FROM '{}';\n".format(staging.name, os.path.abspath(df)))
+    for statement in merge_statements(table, staging, 'postgresql', partial=partial, upsert=False):
+        sqlfile.write('{};\n'.format(str(statement.compile(dialect=postgresql.dialect())).replace('\n', ' ')))
+    sqlfile.write('DROP TABLE {};\n'.format(staging.name))
+
+
+@cli.command(name='unpack-requests')
+@click.option('--download-dir', default=None, type=click.Path(), help='store downloaded files in this directory')
+@click.option('--data-dir', default=None, type=click.Path(), help='store the per-day files in a requests directory under this directory')
+@click.option('--parallel', default=1, type=click.IntRange(min=1), help='number of files to download at the same time (default 1)')
+@click.option('--max-open-files', default=32, type=click.IntRange(min=1), help='maximum number of per-day files to keep open (default 32)')
+@click.pass_context
+def unpack_requests(ctx, download_dir, data_dir, parallel, max_open_files):
+    """
+    Downloads the requests table (its latest full dump and the partial dumps since) and splits
+    it into one directory of files per day. Dumps that were already processed are skipped.
+    """
+    if download_dir:
+        ctx.obj['download_dir'] = download_dir
+    if data_dir:
+        ctx.obj['data_dir'] = data_dir
+    cd = _get_api(ctx, max_workers=parallel)
 
+    days = cd.partition_requests(data_directory=ctx.obj['data_dir'], download_directory=ctx.obj['download_dir'],
+                                 max_workers=parallel, max_open_files=max_open_files,
+                                 callback=lambda d: click.echo('Processed dump {}'.format(d['sequence'])))
+    click.echo('Wrote data for {} days.'.format(len(days)))
+
+
+@cli.command(name='load')
+@click.option('--db-url', required=True, envvar='CANVAS_DATA_DB_URL', help='SQLAlchemy URL of the database to load the data into')
+@click.option('--dump-id', default='latest', help='load the data from this dump (defaults to the latest dump)')
+@click.option('--download-dir', default=None, type=click.Path(), help='store downloaded files in this directory')
+@click.option('-t', '--table', default=None, help='(optional) only load a particular table')
+@click.option('--batch-size', default=10000, type=click.IntRange(min=1), help='rows per INSERT batch when COPY isn\'t available (default 10000)')
+@click.option('--create-tables', is_flag=True, default=False, help='create any tables that don\'t exist yet')
+@click.option('--force', is_flag=True, default=False, help='re-download files even if they already exist (default False)')
+@click.option('--parallel', default=1, type=click.IntRange(min=1), help='number of files to download at the same time (default 1)')
+@click.option('--pipeline', is_flag=True, default=False, help='load each table as soon as it\'s downloaded, while the next ones download')
+@click.option('--merge', is_flag=True, default=False, help='merge the rows into tables with an id column instead of reloading them')
+@click.option('--primary-keys', is_flag=True, default=False, help='create tables with an id column with a primary key on it')
+@click.option('--indexes', is_flag=True, default=False, help='index the columns that refer to other tables, building the indexes after loading')
+@click.pass_context
+def load(ctx, db_url, dump_id, download_dir, table, batch_size, create_tables, force, parallel, pipeline, merge,
+         primary_keys, indexes):
+    """
+    Downloads the Canvas Data files for a dump and loads them straight into a database.
+    Can be optionally limited to a single table.
+    """
+    if download_dir:
+        ctx.obj['download_dir'] = download_dir
+    if table:
+        ctx.obj['table'] = table
+    cd = _get_api(ctx, max_workers=parallel)
+
+    if dump_id == 'latest':
+        dump_id = cd.get_latest_regular_dump()
+
+    if not pipeline:
+        # first make sure all of the files are downloaded
+        ctx.invoke(get_dump_files, dump_id=dump_id, download_dir=ctx.obj['download_dir'], table=ctx.obj.get('table'), force=force,
+                   parallel=parallel)
+
+    dump_details = cd.get_file_urls(dump_id=dump_id)
+    json_schema = cd.get_schema(dump_details['schemaVersion'], key_on_tablenames=True)
+    loader = TableLoader(create_engine(db_url), json_schema, batch_size=batch_size, merge=merge,
+                         primary_keys=primary_keys, indexes=indexes)
+
+    table_names = []
+    if ctx.obj.get('table'):
+        table_names.append(ctx.obj['table'])
+    else:
+        table_names.extend(dump_details['artifactsByTable'].keys())
+        table_names.remove('requests')
+
+    if create_tables:
+        loader.create_tables(table_names)
+
+    progress_label = '{: <23}'.format('Loading {} tables'.format(len(table_names)))
+    if pipeline:
+        # the loader decompresses as it loads, so the stages are downloading and loading
+        with click.progressbar(length=len(table_names), label=progress_label) as bar:
+            for t, count in cd.process_dump_tables(loader.load_table, dump_id=dump_id, table_names=table_names,
+                                                   download_directory=ctx.obj['download_dir'], force=force,
+                                                   max_workers=parallel):
+                bar.update(1)
+    else:
+        with click.progressbar(table_names, label=progress_label) as tnames:
+            for t in tnames:
+                files = cd.download_files(dump_id=dump_id, table_name=t, download_directory=ctx.obj['download_dir'])
+                loader.load_table(t, files, partial=dump_details['artifactsByTable'][t]['partial'])
     click.echo('Done.')
+
+
+@cli.command(name='export')
+@click.option('--format', 'export_format', default='parquet', type=click.Choice(['parquet', 'arrow']), help='output file format (default parquet)')
+@click.option('--dump-id', default='latest', help='export the data from this dump (defaults to the latest dump)')
+@click.option('--download-dir', default=None, type=click.Path(), help='store downloaded files in this directory')
+@click.option('--data-dir', default=None, type=click.Path(), help='store exported files in this directory')
+@click.option('-t', '--table', default=None, help='(optional) only export a particular table')
+@click.option('--row-group-size', default=1000000, type=click.IntRange(min=1), help='maximum rows per row group (default 1000000)')
+@click.option('--force', is_flag=True, default=False, help='re-download/re-export files even if they already exist (default False)')
+@click.pass_context
+def export(ctx, export_format, dump_id, download_dir, data_dir, table, row_group_size, force):
+    """
+    Downloads the Canvas Data files for a dump and converts them to Parquet or Arrow files,
+    one per table. Can be optionally limited to a single table.
+    """
+    if download_dir:
+        ctx.obj['download_dir'] = download_dir
+    if data_dir:
+        ctx.obj['data_dir'] = data_dir
+    if table:
+        ctx.obj['table'] = table
+    cd = _get_api(ctx)
+
+    if dump_id == 'latest':
+        dump_id = cd.get_latest_regular_dump()
+
+    dump_details = cd.get_file_urls(dump_id=dump_id)
+    sequence = dump_details['sequence']
+
+    table_names = []
+    if ctx.obj.get('table'):
+        table_names.append(ctx.obj['table'])
+    else:
+        table_names.extend(dump_details['artifactsByTable'].keys())
+        table_names.remove('requests')
+
+    # store the exported files in dump-specific subdirectory named after the sequence
+    dump_data_dir = os.path.join(ctx.obj['data_dir'], str(sequence))
+
+    progress_label = '{: <23}'.format('Exporting {} tables'.format(len(table_names)))
+    with click.progressbar(table_names, label=progress_label) as tnames:
+        for t in tnames:
+            cd.export_data_for_table(table_name=t, format=export_format, dump_id=dump_id,
+                                     download_directory=ctx.obj['download_dir'], data_directory=dump_data_dir,
+                                     force=force, row_group_size=row_group_size)
+    click.echo('Done.')
+
+
+@cli.command(name='gc')
+@click.option('--download-dir', default=None, type=click.Path(), help='the directory that holds the downloaded files')
+@click.option('--dry-run', is_flag=True, default=False, help='list the files that would be deleted, but don\'t delete them')
+@click.pass_context
+def gc(ctx, download_dir, dry_run):
+    """Deletes downloaded files that aren't needed for the latest full snapshot of each table."""
+    if download_dir:
+        ctx.obj['download_dir'] = download_dir
+    cd = _get_api(ctx)
+
+    removed = cd.gc(download_directory=ctx.obj['download_dir'], dry_run=dry_run)
+    for entry in removed:
+        click.echo('{}\t{}\tsequence: {}'.format(entry['filename'], entry['table_name'], entry['sequence']))
+    total_size = sum(entry['size'] or 0 for entry in removed)
+    if dry_run:
+        click.echo('Would delete {} files ({} bytes).'.format(len(removed), total_size))
+    else:
+        click.echo('Deleted {} files ({} bytes).'.format(len(removed), total_size))
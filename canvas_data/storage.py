@@ -0,0 +1,274 @@
+import io
+import logging
+import os
+import threading
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+from .compat import replace as _replace
+
+logger = logging.getLogger(__name__)
+
+
+class Storage(object):
+    """
+    Where downloaded fragments and unpacked data files are kept. Files are identified by
+    name, which may contain `/` to put them in subdirectories. Writes are atomic: a file
+    only appears once its writer is committed, and an aborted write leaves nothing behind.
+
+    Pass a Storage instead of a path as the `download_directory` or `data_directory` of the
+    `CanvasDataAPI` methods that support it (see `get_file` and `get_data_for_table`).
+    """
+
+    def exists(self, name):
+        raise NotImplementedError
+
+    def size(self, name):
+        raise NotImplementedError
+
+    def open_read(self, name):
+        """Returns a binary file-like object to read a file from."""
+        raise NotImplementedError
+
+    def open_write(self, name):
+        """
+        Returns a writer for a file, with `write(data)`, `commit()` to make the file appear,
+        and `abort()` to throw away what's been written.
+        """
+        raise NotImplementedError
+
+    def delete(self, name):
+        raise NotImplementedError
+
+    def list(self, prefix=''):
+        """Returns the names of the files whose names start with `prefix`."""
+        raise NotImplementedError
+
+    def location(self, name):
+        """A string that identifies a file to people (and, for local files, to `open`)."""
+        return name
+
+
+class LocalStorage(Storage):
+    """Files in a local directory. This is what a plain directory path means."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def location(self, name):
+        return os.path.join(self.directory, *name.split('/'))
+
+    def exists(self, name):
+        return os.path.isfile(self.location(name))
+
+    def size(self, name):
+        return os.path.getsize(self.location(name))
+
+    def open_read(self, name):
+        return open(self.location(name), 'rb')
+
+    def open_write(self, name):
+        path = self.location(name)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        return _LocalWriter(path)
+
+    def delete(self, name):
+        path = self.location(name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def list(self, prefix=''):
+        names = []
+        for root, dirs, files in os.walk(self.directory):
+            relative = os.path.relpath(root, self.directory)
+            for filename in files:
+                name = filename if relative == os.curdir else '/'.join(relative.split(os.sep) + [filename])
+                if name.startswith(prefix) and not name.endswith('.part'):
+                    names.append(name)
+        return sorted(names)
+
+
+class _LocalWriter(object):
+    def __init__(self, path):
+        self.path = path
+        self.part_path = path + '.part'
+        self.fd = open(self.part_path, 'wb')
+
+    def write(self, data):
+        self.fd.write(data)
+
+    def commit(self):
+        self.fd.close()
+        _replace(self.part_path, self.path)
+
+    def abort(self):
+        self.fd.close()
+        if os.path.isfile(self.part_path):
+            os.remove(self.part_path)
+
+
+class MemoryStorage(Storage):
+    """Keeps files in a dict, as bytes. Meant for tests; everything is lost with the object."""
+
+    def __init__(self):
+        self.files = {}
+        self._lock = threading.Lock()
+
+    def exists(self, name):
+        with self._lock:
+            return name in self.files
+
+    def size(self, name):
+        with self._lock:
+            return len(self.files[name])
+
+    def open_read(self, name):
+        with self._lock:
+            return io.BytesIO(self.files[name])
+
+    def open_write(self, name):
+        return _MemoryWriter(self, name)
+
+    def delete(self, name):
+        with self._lock:
+            self.files.pop(name, None)
+
+    def list(self, prefix=''):
+        with self._lock:
+            return sorted(name for name in self.files if name.startswith(prefix))
+
+
+class _MemoryWriter(object):
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        self.buffer = io.BytesIO()
+
+    def write(self, data):
+        self.buffer.write(data)
+
+    def commit(self):
+        with self.storage._lock:
+            self.storage.files[self.name] = self.buffer.getvalue()
+
+    def abort(self):
+        self.buffer = io.BytesIO()
+
+
+class S3Storage(Storage):
+    """
+    Files in an S3 (or S3-compatible) bucket, under `prefix`. Files are streamed up as
+    multipart uploads in parts of `part_size` bytes, so at most one part is held in memory
+    per file being written; a file smaller than one part is uploaded with a single PUT.
+    Reads stream straight from S3.
+
+    Pass a boto3 S3 `client` to control credentials and endpoints, or the `endpoint_url` of
+    an S3-compatible service. Requires boto3 (``pip install canvas-data-sdk[s3]``).
+    """
+
+    def __init__(self, bucket, prefix='', client=None, endpoint_url=None, part_size=8*1024*1024):
+        if client is None:
+            if boto3 is None:
+                raise ImportError('S3Storage requires boto3; install it with "pip install canvas-data-sdk[s3]"')
+            client = boto3.client('s3', endpoint_url=endpoint_url)
+        if part_size < 5*1024*1024:
+            raise ValueError('S3 multipart uploads need parts of at least 5 MB')
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = client
+        self.part_size = part_size
+
+    def key(self, name):
+        return '{}/{}'.format(self.prefix, name) if self.prefix else name
+
+    def location(self, name):
+        return 's3://{}/{}'.format(self.bucket, self.key(name))
+
+    def _head(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except self.client.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, name):
+        return self._head(name) is not None
+
+    def size(self, name):
+        head = self._head(name)
+        if head is None:
+            raise IOError('{} does not exist'.format(self.location(name)))
+        return head['ContentLength']
+
+    def open_read(self, name):
+        return self.client.get_object(Bucket=self.bucket, Key=self.key(name))['Body']
+
+    def open_write(self, name):
+        return _S3MultipartWriter(self, self.key(name))
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def list(self, prefix=''):
+        names = []
+        key_prefix = self.key(prefix)
+        strip = len(self.prefix) + 1 if self.prefix else 0
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=key_prefix):
+            for obj in page.get('Contents', []):
+                names.append(obj['Key'][strip:])
+        return sorted(names)
+
+
+class _S3MultipartWriter(object):
+    def __init__(self, storage, key):
+        self.storage = storage
+        self.client = storage.client
+        self.key = key
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.storage.part_size:
+            part = bytes(self.buffer[:self.storage.part_size])
+            del self.buffer[:self.storage.part_size]
+            self._upload_part(part)
+
+    def _upload_part(self, data):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(Bucket=self.storage.bucket, Key=self.key)['UploadId']
+        number = len(self.parts) + 1
+        response = self.client.upload_part(Bucket=self.storage.bucket, Key=self.key, UploadId=self.upload_id,
+                                           PartNumber=number, Body=data)
+        self.parts.append({'PartNumber': number, 'ETag': response['ETag']})
+
+    def commit(self):
+        if self.upload_id is None:
+            self.client.put_object(Bucket=self.storage.bucket, Key=self.key, Body=bytes(self.buffer))
+            return
+        if self.buffer:
+            self._upload_part(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.client.complete_multipart_upload(Bucket=self.storage.bucket, Key=self.key, UploadId=self.upload_id,
+                                              MultipartUpload={'Parts': self.parts})
+
+    def abort(self):
+        self.buffer = bytearray()
+        if self.upload_id is not None:
+            try:
+                self.client.abort_multipart_upload(Bucket=self.storage.bucket, Key=self.key, UploadId=self.upload_id)
+            except Exception:
+                logger.exception("Couldn't abort the multipart upload of %s", self.key)
+            self.upload_id = None
@@ -20,7 +20,14 @@ setup(
         "requests >= 2.13.0",
         "Click >= 6.7",
         "PyYAML >= 3.12",
-        "sqlalchemy >= 1.1.9",
+        "sqlalchemy >= 1.4",
         "python-dateutil >= 2.6.0",
     ],
+    extras_require={
+        "arrow": ["pyarrow >= 4.0"],
+        "async": ["aiohttp >= 3.0"],
+        "fast": ["isal >= 1.0"],
+        "numpy": ["numpy >= 1.11"],
+        "s3": ["boto3 >= 1.9"],
+    },
 )
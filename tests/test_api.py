@@ -0,0 +1,72 @@
+import gzip
+import os
+
+import pytest
+
+from canvas_data.api import CanvasDataAPI, _retry_wait
+from canvas_data.exceptions import CanvasDataAPIError
+
+
+class FakeResponse(object):
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+def client(cache_dir, api_key='key-a', api_root='https://api.example.com', versions=None):
+    cd = CanvasDataAPI(api_key=api_key, api_secret='secret', api_root=api_root, cache_dir=str(cache_dir))
+    cd._get_with_retries = lambda *args, **kwargs: FakeResponse(versions)
+    return cd
+
+
+def test_cache_is_shared_by_clients_with_the_same_credentials(tmpdir):
+    assert client(tmpdir, versions=['1.0.0']).get_schema_versions() == ['1.0.0']
+    assert client(tmpdir, versions=['2.0.0']).get_schema_versions() == ['1.0.0']
+
+
+def test_cache_is_not_shared_between_accounts_or_servers(tmpdir):
+    assert client(tmpdir, versions=['1.0.0']).get_schema_versions() == ['1.0.0']
+    assert client(tmpdir, api_key='key-b', versions=['2.0.0']).get_schema_versions() == ['2.0.0']
+    assert client(tmpdir, api_root='https://other.example.com', versions=['3.0.0']).get_schema_versions() == ['3.0.0']
+
+
+def test_file_lists_are_not_shared_between_accounts(tmpdir):
+    a = client(tmpdir, versions={'artifactsByTable': {}, 'account': 'a'})
+    b = client(tmpdir, api_key='key-b', versions={'artifactsByTable': {}, 'account': 'b'})
+    assert a.get_file_urls(dump_id='dump-1')['account'] == 'a'
+    assert b.get_file_urls(dump_id='dump-1')['account'] == 'b'
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_failed_unpack_leaves_no_partial_files(tmpdir, jobs):
+    good = str(tmpdir.join('good.gz'))
+    with gzip.open(good, 'wb') as f:
+        f.write(b'1\tx\n' * 1000)
+    truncated = str(tmpdir.join('truncated.gz'))
+    with open(good, 'rb') as f:
+        data = f.read()
+    with open(truncated, 'wb') as f:
+        f.write(data[:len(data) // 2])
+    cd = CanvasDataAPI(api_key='key', api_secret='secret')
+
+    fragments = tmpdir.join('fragments')
+    with pytest.raises(CanvasDataAPIError):
+        cd.unpack_fragments([good, truncated], str(fragments), jobs=jobs, table_name='t')
+    assert not [f for f in os.listdir(str(fragments)) if f.endswith('.part')]
+
+    data_dir = tmpdir.mkdir('data')
+    with pytest.raises(CanvasDataAPIError):
+        cd.unpack_files([good, truncated], str(data_dir.join('t.txt')), jobs=jobs, table_name='t')
+    assert not [f for f in os.listdir(str(data_dir)) if f.endswith('.part')]
+
+
+def test_retry_after_is_capped():
+    cd = CanvasDataAPI(api_key='key', api_secret='secret', max_retry_delay=30)
+
+    assert _retry_wait(cd, 1, {'Retry-After': '5'}) == 5
+    assert _retry_wait(cd, 1, {'Retry-After': '86400'}) == 30
+    assert _retry_wait(cd, 1, {'Retry-After': 'Fri, 31 Dec 2100 23:59:59 GMT'}) == 30
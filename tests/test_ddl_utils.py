@@ -0,0 +1,101 @@
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from canvas_data.ddl_utils import diff_schemas, migration_ddl
+
+
+def column(name, type, length=None):
+    col = {'name': name, 'type': type}
+    if length:
+        col['length'] = length
+    return col
+
+
+def schema(**tables):
+    return dict((name, {'tableName': name, 'columns': columns}) for name, columns in tables.items())
+
+
+OLD = schema(
+    widened_dim=[column('id', 'bigint'), column('name', 'varchar', 256), column('count', 'int')],
+    appended_dim=[column('id', 'bigint'), column('name', 'varchar', 256)],
+    inserted_dim=[column('id', 'bigint'), column('name', 'varchar', 256)],
+    retyped_dim=[column('id', 'bigint'), column('code', 'varchar', 256)],
+    shrunk_dim=[column('id', 'bigint'), column('legacy', 'int'), column('name', 'varchar', 256)],
+    same_dim=[column('id', 'bigint')],
+    dropped_dim=[column('id', 'bigint')],
+)
+
+NEW = schema(
+    widened_dim=[column('id', 'bigint'), column('name', 'varchar', 512), column('count', 'bigint')],
+    appended_dim=[column('id', 'bigint'), column('name', 'varchar', 256), column('extra', 'boolean')],
+    inserted_dim=[column('id', 'bigint'), column('extra', 'boolean'), column('name', 'varchar', 256)],
+    retyped_dim=[column('id', 'bigint'), column('code', 'bigint')],
+    shrunk_dim=[column('id', 'bigint'), column('name', 'varchar', 256)],
+    same_dim=[column('id', 'bigint')],
+    added_dim=[column('id', 'bigint')],
+)
+
+
+def statements(dialect=None, **kwargs):
+    ddl, reload_tables = migration_ddl(OLD, NEW, dialect=dialect, **kwargs)
+    return [' '.join(s.split()) for s in ddl], reload_tables
+
+
+def test_diff_schemas():
+    diff = diff_schemas(OLD, NEW)
+
+    assert diff['added_tables'] == ['added_dim']
+    assert diff['dropped_tables'] == ['dropped_dim']
+    assert sorted(diff['changed_tables']) == ['appended_dim', 'inserted_dim', 'retyped_dim', 'shrunk_dim',
+                                              'widened_dim']
+    widened = diff['changed_tables']['widened_dim']
+    assert [c['name'] for c in widened['altered_columns']] == ['name', 'count']
+    assert all(c['widened'] for c in widened['altered_columns'])
+    assert not widened['recreate'] and not widened['reload']
+    assert diff['changed_tables']['appended_dim']['added_columns'] == ['extra']
+    assert not diff['changed_tables']['appended_dim']['recreate']
+    assert diff['changed_tables']['inserted_dim']['recreate']
+    assert diff['changed_tables']['retyped_dim']['recreate']
+    assert diff['changed_tables']['shrunk_dim']['dropped_columns'] == ['legacy']
+    assert not diff['changed_tables']['shrunk_dim']['reload']
+    assert diff['reload_tables'] == ['added_dim', 'appended_dim', 'inserted_dim', 'retyped_dim']
+
+
+def test_migration_ddl_postgresql():
+    ddl, reload_tables = statements(postgresql.dialect())
+
+    assert 'DROP TABLE dropped_dim' in ddl
+    assert 'CREATE TABLE added_dim ( id BIGINT )' in ddl
+    assert 'ALTER TABLE widened_dim ALTER COLUMN name TYPE VARCHAR(512)' in ddl
+    assert 'ALTER TABLE widened_dim ALTER COLUMN count TYPE BIGINT' in ddl
+    assert 'ALTER TABLE appended_dim ADD COLUMN extra BOOLEAN' in ddl
+    assert 'ALTER TABLE shrunk_dim DROP COLUMN legacy' in ddl
+    # a varchar can't simply be altered into a bigint, so the table is recreated instead
+    assert not any('retyped_dim ALTER' in s for s in ddl)
+    assert ddl.index('DROP TABLE retyped_dim') < ddl.index('CREATE TABLE retyped_dim ( id BIGINT, code BIGINT )')
+    assert ddl.index('DROP TABLE inserted_dim') < ddl.index(
+        'CREATE TABLE inserted_dim ( id BIGINT, extra BOOLEAN, name VARCHAR(256) )')
+    assert not any('same_dim' in s for s in ddl)
+    assert reload_tables == ['added_dim', 'appended_dim', 'inserted_dim', 'retyped_dim']
+
+
+def test_migration_ddl_mysql():
+    ddl, reload_tables = statements(mysql.dialect())
+
+    assert 'ALTER TABLE widened_dim MODIFY COLUMN name VARCHAR(512)' in ddl
+    assert not any('ALTER COLUMN' in s for s in ddl)
+
+
+def test_migration_ddl_sqlite_recreates_altered_tables():
+    ddl, reload_tables = statements(sqlite.dialect())
+
+    assert not any('ALTER COLUMN' in s or 'MODIFY COLUMN' in s for s in ddl)
+    assert 'DROP TABLE widened_dim' in ddl
+    assert 'ALTER TABLE appended_dim ADD COLUMN extra BOOLEAN' in ddl
+    assert reload_tables == ['added_dim', 'appended_dim', 'inserted_dim', 'retyped_dim', 'widened_dim']
+
+
+def test_migration_ddl_keeps_table_options():
+    ddl, reload_tables = statements(postgresql.dialect(), primary_keys=True, unlogged=True)
+
+    assert 'CREATE UNLOGGED TABLE added_dim ( id BIGINT NOT NULL, PRIMARY KEY (id) )' in ddl
+    assert any(s.startswith('CREATE UNLOGGED TABLE retyped_dim') and 'PRIMARY KEY (id)' in s for s in ddl)
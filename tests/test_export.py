@@ -0,0 +1,40 @@
+import gzip
+
+import pytest
+
+from canvas_data.export import export_fragments
+from canvas_data.loader import _unescape
+
+pa_parquet = pytest.importorskip('pyarrow.parquet')
+
+COLUMNS = [
+    {'name': 'id', 'type': 'bigint'},
+    {'name': 'name', 'type': 'varchar', 'length': 256},
+]
+
+VALUES = [
+    r'plain',
+    r'a\tb\\c',
+    r'line one\nline two',
+    r'trailing backslash\\',
+    r'\\t is not a tab',
+    r'\N inside',
+]
+
+
+def test_export_unescapes_strings(tmpdir):
+    fragment = str(tmpdir.join('fragment.gz'))
+    with gzip.open(fragment, 'wt') as f:
+        for i, value in enumerate(VALUES):
+            f.write('{}\t{}\n'.format(i, value))
+        f.write('{}\t\\N\n'.format(len(VALUES)))
+    outfile = str(tmpdir.join('out.parquet'))
+
+    count = export_fragments([fragment], 'test_dim', COLUMNS, outfile)
+
+    assert count == len(VALUES) + 1
+    names = pa_parquet.read_table(outfile).column('name').to_pylist()
+    assert names == [_unescape(v) for v in VALUES] + [None]
+    assert names[1] == 'a\tb\\c'
+    assert names[2] == 'line one\nline two'
+    assert names[4] == '\\t is not a tab'
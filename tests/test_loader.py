@@ -0,0 +1,119 @@
+import gzip
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import create_engine, select
+
+from canvas_data.loader import TableLoader
+from canvas_data.storage import MemoryStorage
+
+SCHEMA = {
+    'widget_dim': {
+        'tableName': 'widget_dim',
+        'columns': [
+            {'name': 'id', 'type': 'bigint'},
+            {'name': 'name', 'type': 'varchar', 'length': 256},
+            {'name': 'count', 'type': 'int'},
+            {'name': 'score', 'type': 'double precision'},
+            {'name': 'active', 'type': 'boolean'},
+            {'name': 'created_at', 'type': 'timestamp'},
+            {'name': 'day', 'type': 'date'},
+        ],
+    },
+}
+
+
+def fragment(storage, name, rows):
+    """Store gzipped Canvas Data rows (lists of already formatted values) under `name`."""
+    data = ''.join('\t'.join(row) + '\n' for row in rows)
+    writer = storage.open_write(name)
+    writer.write(gzip.compress(data.encode('utf-8')))
+    writer.commit()
+    return name
+
+
+def row(id, name='widget', count='1'):
+    return [str(id), name, count, '2.5', 'true', '2017-06-28 12:34:56.789', '2017-06-28']
+
+
+def load(loader, storage, rows, partial=False, name='part-00000.gz'):
+    return loader.load_table('widget_dim', [fragment(storage, name, rows)], partial=partial)
+
+
+def contents(loader):
+    table = loader.tables['widget_dim']
+    with loader.engine.connect() as conn:
+        return dict((r.id, r) for r in conn.execute(select(table)))
+
+
+@pytest.fixture
+def storage():
+    return MemoryStorage()
+
+
+@pytest.fixture(params=[False, True], ids=['plain', 'primary_key'])
+def make_loader(request, storage):
+    def make(**kwargs):
+        loader = TableLoader(create_engine('sqlite://'), SCHEMA, batch_size=2, storage=storage,
+                             primary_keys=request.param, **kwargs)
+        loader.create_tables()
+        return loader
+    return make
+
+
+def test_load_converts_values(make_loader, storage):
+    loader = make_loader()
+    count = load(loader, storage, [
+        row(1, name=r'tab\there, backslash\\, newline\n'),
+        ['2', '\\N', '\\N', '\\N', 'false', '\\N', '\\N'],
+        row(3),
+    ])
+
+    assert count == 3
+    rows = contents(loader)
+    assert rows[1].name == 'tab\there, backslash\\, newline\n'
+    assert rows[1].count == 1
+    assert rows[1].score == 2.5
+    assert rows[1].active is True
+    assert rows[1].created_at == datetime(2017, 6, 28, 12, 34, 56, 789000)
+    assert rows[1].day == date(2017, 6, 28)
+    assert rows[2].name is None and rows[2].count is None and rows[2].created_at is None
+    assert rows[2].active is False
+
+
+def test_full_load_replaces_rows(make_loader, storage):
+    loader = make_loader()
+    load(loader, storage, [row(1), row(2)])
+    load(loader, storage, [row(3)], name='part-00001.gz')
+
+    assert sorted(contents(loader)) == [3]
+
+
+def test_partial_load_appends_rows(make_loader, storage):
+    loader = make_loader()
+    load(loader, storage, [row(1), row(2)])
+    load(loader, storage, [row(3)], partial=True, name='part-00001.gz')
+
+    assert sorted(contents(loader)) == [1, 2, 3]
+
+
+def test_full_merge(make_loader, storage):
+    loader = make_loader(merge=True)
+    load(loader, storage, [row(1), row(2, name='old'), row(3)])
+    load(loader, storage, [row(2, name='new'), row(3), row(4)], name='part-00001.gz')
+
+    rows = contents(loader)
+    assert sorted(rows) == [2, 3, 4]
+    assert rows[2].name == 'new'
+
+
+def test_partial_merge(make_loader, storage):
+    loader = make_loader(merge=True)
+    load(loader, storage, [row(1), row(2, count='5')])
+    load(loader, storage, [row(2, count='6'), ['3', '\\N', '\\N', '\\N', '\\N', '\\N', '\\N']], partial=True,
+         name='part-00001.gz')
+
+    rows = contents(loader)
+    assert sorted(rows) == [1, 2, 3]
+    assert rows[2].count == 6
+    assert rows[3].name is None